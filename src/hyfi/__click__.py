@@ -142,3 +142,138 @@ def sc(uninstall, shell):
             "run the following command to install shell completion in your current shell\n"
         )
         click.echo(f'eval "$(hyfi -sc install={shell})"')
+
+
+@cli.command()
+@click.option(
+    "--backends",
+    "-b",
+    show_default=True,
+    default="serial,multiprocessing,loky,joblib,p_tqdm,ray",
+    help="Comma-separated backends to benchmark",
+)
+@click.option(
+    "--data_types",
+    "-d",
+    show_default=True,
+    default="list,series,dataframe,ndarray,csr",
+    help="Comma-separated data types to benchmark",
+)
+@click.option(
+    "--sizes",
+    show_default=True,
+    default="10000",
+    help="Comma-separated numbers of rows",
+)
+@click.option("--procs", show_default=True, default=2, help="Number of workers")
+@click.option(
+    "--minibatch_size", show_default=True, default=1000, help="Size of the minibatches"
+)
+@click.option(
+    "--repeats", show_default=True, default=3, help="Number of timed runs per case"
+)
+@click.option("--output", "-o", default=None, help="Path to save the JSON baseline to")
+@click.option(
+    "--baseline", default=None, help="Path of a JSON baseline to compare with"
+)
+@click.option(
+    "--placements",
+    default=None,
+    help="Comma-separated worker placements to benchmark on a memory-bound workload, "
+    "e.g. none,compact,spread",
+)
+@click.option(
+    "--merge_types",
+    default=None,
+    help="Comma-separated result types whose minibatch merge to benchmark, "
+    "e.g. list,ndarray,csr,dataframe",
+)
+@click.option(
+    "--row_modes",
+    default=None,
+    help="Comma-separated row modes of Apply on DataFrames to benchmark, "
+    "e.g. series,namedtuple,columns,dict",
+)
+@click.option(
+    "--kernels",
+    is_flag=True,
+    default=False,
+    help="Benchmark the vectorize path of Apply with a cold and a warm kernel cache",
+)
+@click.option(
+    "--tolerance",
+    show_default=True,
+    default=0.2,
+    help="Throughput loss over the baseline reported as a regression",
+)
+def benchmark(**args):
+    """
+    Benchmark the Batcher backends across operations, data types and sizes.
+    """
+    from hyfi.joblib.batcher import benchmark as bench
+
+    if args["placements"]:
+        placements = [None if p == "none" else p for p in args["placements"].split(",")]
+        results = bench.run_placement_benchmark(
+            placements,
+            backend=args["backends"].split(",")[0],
+            procs=args["procs"],
+            minibatch_size=args["minibatch_size"],
+            repeats=args["repeats"],
+        )
+        click.echo(bench.format_placement_table(results))
+        return
+    if args["merge_types"]:
+        results = bench.run_merge_benchmark(
+            args["merge_types"].split(","),
+            num_batches=max(
+                1, int(args["sizes"].split(",")[0]) // args["minibatch_size"]
+            ),
+            rows=args["minibatch_size"],
+            repeats=args["repeats"],
+        )
+        click.echo(bench.format_merge_table(results))
+        return
+    if args["row_modes"]:
+        results = bench.run_row_mode_benchmark(
+            args["row_modes"].split(","),
+            num_rows=int(args["sizes"].split(",")[0]),
+            minibatch_size=args["minibatch_size"],
+            repeats=args["repeats"],
+        )
+        click.echo(bench.format_row_mode_table(results))
+        return
+    if args["kernels"]:
+        results = bench.run_kernel_benchmark(
+            num_rows=int(args["sizes"].split(",")[0]),
+            minibatch_size=args["minibatch_size"],
+            repeats=args["repeats"],
+        )
+        click.echo(bench.format_kernel_table(results))
+        return
+    results = bench.run_benchmark(
+        backends=args["backends"].split(","),
+        data_types=args["data_types"].split(","),
+        sizes=[int(size) for size in args["sizes"].split(",")],
+        procs=args["procs"],
+        minibatch_size=args["minibatch_size"],
+        repeats=args["repeats"],
+    )
+    click.echo("Throughput (rows/s)")
+    click.echo(bench.format_table(results, "rows_per_second"))
+    click.echo("\nLatency (ms/minibatch)")
+    click.echo(bench.format_table(results, "ms_per_batch"))
+    if args["output"]:
+        click.echo(
+            f"\nSaved baseline to {bench.save_baseline(results, args['output'])}"
+        )
+    if args["baseline"]:
+        regressions = bench.compare_baseline(
+            results, args["baseline"], tolerance=args["tolerance"]
+        )
+        click.echo(f"\n{len(regressions)} regressions against {args['baseline']}")
+        for r in regressions:
+            click.echo(
+                f"  {r['backend']} {r['operation']} {r['data_type']}[{r['size']}] "
+                f"{r['function']}: {r['ratio']:.2f}x the baseline throughput"
+            )
@@ -0,0 +1,98 @@
+"""Adaptive minibatch sizing based on the measured cost of minibatches"""
+
+import pickle
+from typing import Any, Optional
+
+from hyfi.utils.logging import LOGGING
+
+logger = LOGGING.getLogger(__name__)
+
+
+class AdaptiveBatchSizer(object):
+    """
+    Grows or shrinks the minibatch size toward a target run time per minibatch.
+
+    The run time of every completed minibatch is used to estimate the cost per row,
+    and the pickled payload size of the first minibatches to estimate the bytes per row.
+    The next minibatch size is the number of rows expected to run for `target_seconds`,
+    capped so that a payload stays below `max_batch_bytes`. Each update changes the size
+    by at most a factor of `max_growth`, so a single outlier does not swing it.
+
+    Args:
+        minibatch_size: The initial minibatch size.
+        target_seconds: The target run time per minibatch in seconds.
+        min_size: The minimum minibatch size.
+        max_size: The maximum minibatch size.
+        max_batch_bytes: The maximum pickled payload size per minibatch in bytes.
+        max_growth: The maximum factor by which the size changes in one update.
+        payload_samples: The number of minibatches whose payload size is measured.
+
+    Attributes:
+        size: The current minibatch size.
+        num_updates: The number of minibatches measured so far.
+    """
+
+    def __init__(
+        self,
+        minibatch_size: int,
+        target_seconds: float = 1.0,
+        min_size: int = 1,
+        max_size: Optional[int] = None,
+        max_batch_bytes: int = 64 * 1024 * 1024,
+        max_growth: float = 4.0,
+        payload_samples: int = 4,
+    ):
+        self.size = max(min_size, int(minibatch_size))
+        self.target_seconds = target_seconds
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_batch_bytes = max_batch_bytes
+        self.max_growth = max_growth
+        self.payload_samples = payload_samples
+        self.num_updates = 0
+        self.bytes_per_row: Optional[float] = None
+        self._num_payloads = 0
+
+    def __call__(self) -> int:
+        """Return the size of the next minibatch"""
+        return self.size
+
+    def measure_payload(self, params: Any, rows: int):
+        """Measure the pickled size of a minibatch payload, for the first minibatches only"""
+        if self._num_payloads >= self.payload_samples or rows <= 0:
+            return
+        self._num_payloads += 1
+        try:
+            num_bytes = len(pickle.dumps(params, protocol=pickle.HIGHEST_PROTOCOL))
+        except Exception:  # the backend may serialize objects that pickle cannot
+            return
+        bytes_per_row = num_bytes / rows
+        if self.bytes_per_row is None:
+            self.bytes_per_row = bytes_per_row
+        else:
+            self.bytes_per_row = max(self.bytes_per_row, bytes_per_row)
+
+    def update(self, rows: int, seconds: float):
+        """Update the size from the run time of a completed minibatch of `rows` rows"""
+        if rows <= 0:
+            return
+        self.num_updates += 1
+        if seconds > 0:
+            size = self.target_seconds * rows / seconds
+        else:
+            size = self.size * self.max_growth
+        if self.bytes_per_row:
+            size = min(size, self.max_batch_bytes / self.bytes_per_row)
+        size = min(max(size, self.size / self.max_growth), self.size * self.max_growth)
+        size = max(self.min_size, int(size))
+        if self.max_size:
+            size = min(size, self.max_size)
+        if size != self.size:
+            logger.debug(
+                "minibatch of %s rows ran in %.3fs, resizing minibatches from %s to %s",
+                rows,
+                seconds,
+                self.size,
+                size,
+            )
+        self.size = size
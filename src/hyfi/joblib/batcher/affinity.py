@@ -0,0 +1,245 @@
+"""CPU affinity of the workers: compact, spread or explicit placement on the cores of the NUMA nodes"""
+
+import contextlib
+import os
+import platform
+import shutil
+import tempfile
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Union
+
+from hyfi.utils.logging import LOGGING
+
+from .broadcast import wraps_task
+
+logger = LOGGING.getLogger(__name__)
+
+PLACEMENTS = ("compact", "spread")
+
+# The cores this worker process is pinned to, once pinned
+_PINNED: Optional[List[int]] = None
+# Whether this worker process logged that it runs on another machine than its placement
+_REMOTE_LOGGED = False
+
+
+def parse_cpulist(cpulist: str) -> List[int]:
+    """Parse a Linux CPU list, e.g. '0-3,8-11'"""
+    cpus: List[int] = []
+    for part in cpulist.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            start, stop = part.split("-")
+            cpus.extend(range(int(start), int(stop) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def numa_nodes() -> Dict[int, List[int]]:
+    """Return the cores of each NUMA node this process may run on, or a single node of all of them"""
+    available = (
+        sorted(os.sched_getaffinity(0))
+        if hasattr(os, "sched_getaffinity")
+        else list(range(os.cpu_count() or 1))
+    )
+    nodes: Dict[int, List[int]] = {}
+    for path in sorted(Path("/sys/devices/system/node").glob("node[0-9]*")):
+        try:
+            cpus = parse_cpulist((path / "cpulist").read_text())
+        except (OSError, ValueError):
+            continue
+        cpus = [cpu for cpu in cpus if cpu in available]
+        if cpus:
+            nodes[int(path.name[4:])] = cpus
+    return nodes or {0: available}
+
+
+def plan_placement(
+    placement: Union[str, Sequence[Union[int, Sequence[int]]]],
+    procs: int,
+    nodes: Optional[Dict[int, List[int]]] = None,
+) -> List[List[int]]:
+    """
+    Plan the cores of each worker.
+
+    Args:
+        placement: How the workers are placed on the cores.
+            - 'compact': on consecutive cores, filling a NUMA node before the next one,
+              so that the workers share caches and memory.
+            - 'spread': on the NUMA nodes in turn, so that the workers share the memory
+              bandwidth of all the nodes.
+            - A list of the cores of each worker, e.g. `[[0, 1], [2, 3]]`, or of one core per worker.
+        procs: The number of workers.
+        nodes: The cores of each NUMA node. Defaults to the nodes of this host.
+
+    Returns:
+        The cores of each worker slot. Workers beyond the slots reuse them in turn.
+    """
+    if not isinstance(placement, str):
+        slots = [[core] if isinstance(core, int) else list(core) for core in placement]
+        if not slots or not all(slots):
+            raise ValueError(
+                f"placement must list the cores of each worker, got {placement}"
+            )
+        return slots
+    if placement not in PLACEMENTS:
+        raise ValueError(
+            f"placement must be one of {PLACEMENTS} or a list of cores, got {placement}"
+        )
+    if nodes is None:
+        nodes = numa_nodes()
+    cpus_by_node = [nodes[node] for node in sorted(nodes)]
+    if placement == "compact":
+        cores = [cpu for cpus in cpus_by_node for cpu in cpus]
+    else:
+        cores = [
+            cpus[i]
+            for i in range(max(len(cpus) for cpus in cpus_by_node))
+            for cpus in cpus_by_node
+            if i < len(cpus)
+        ]
+    return [[cores[i % len(cores)]] for i in range(max(1, procs))]
+
+
+class WorkerPlacement(object):
+    """
+    The cores of the worker slots, claimed by the workers as they start.
+
+    A worker claims the first free slot with a claim file holding its PID, taking over
+    the slots of workers that exited, and pins itself to the cores of the slot. Memory
+    is allocated on the NUMA node of the core that first touches it, so the minibatches
+    and the results of a pinned worker stay local to its node.
+
+    The workers of the pools owned by the Batcher are pinned for their life with `pin`.
+    The workers shared with other work, e.g. the executors of joblib and Ray, are only
+    pinned while running a task with `pinned`. The claim files are local to the machine
+    of the Batcher, so the workers on other machines, e.g. of a Ray cluster, are not pinned.
+
+    Args:
+        slots: The cores of each worker slot.
+    """
+
+    def __init__(self, slots: List[List[int]]):
+        self.slots = slots
+        self.claim_dir = tempfile.mkdtemp(prefix="hyfi-placement-")
+        self.node = platform.node()
+
+    @contextlib.contextmanager
+    def pinned(self) -> Iterator[None]:
+        """Pin this worker process to the cores of a slot in the context, and restore its affinity after"""
+        if _PINNED is not None or not hasattr(os, "sched_setaffinity"):
+            yield
+            return
+        if self.is_remote():
+            yield
+            return
+        previous = os.sched_getaffinity(0)
+        slot = self._claim()
+        try:
+            os.sched_setaffinity(0, self.slots[slot])
+        except OSError as e:
+            logger.warning(
+                "cannot pin worker %s to cores %s: %s", os.getpid(), self.slots[slot], e
+            )
+            yield
+            return
+        try:
+            yield
+        finally:
+            os.sched_setaffinity(0, previous)
+
+    def pin(self):
+        """Pin this worker process to the cores of a slot, once"""
+        global _PINNED
+        if _PINNED is not None or not hasattr(os, "sched_setaffinity"):
+            return
+        slot = self._claim()
+        try:
+            os.sched_setaffinity(0, self.slots[slot])
+            _PINNED = self.slots[slot]
+        except OSError as e:
+            logger.warning(
+                "cannot pin worker %s to cores %s: %s", os.getpid(), self.slots[slot], e
+            )
+            _PINNED = []
+
+    def is_remote(self) -> bool:
+        """Return True in a worker on another machine, which cannot see the claim files"""
+        if platform.node() == self.node and os.path.isdir(self.claim_dir):
+            return False
+        global _REMOTE_LOGGED
+        if not _REMOTE_LOGGED:
+            logger.info(
+                "not placing worker %s on %s, the placement was planned on %s",
+                os.getpid(),
+                platform.node(),
+                self.node,
+            )
+            _REMOTE_LOGGED = True
+        return True
+
+    def _claim(self) -> int:
+        pid = os.getpid()
+        for slot in range(len(self.slots)):
+            path = os.path.join(self.claim_dir, f"slot-{slot}")
+            if _claim_file(path, pid):
+                return slot
+        # more workers than slots
+        return pid % len(self.slots)
+
+    def cleanup(self):
+        shutil.rmtree(self.claim_dir, ignore_errors=True)
+
+    def __repr__(self):
+        return f"WorkerPlacement({self.slots})"
+
+
+def _claim_file(path: str, pid: int) -> bool:
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        try:
+            with open(path) as f:
+                owner = int(f.read() or 0)
+        except (OSError, ValueError):
+            return False
+        if owner == pid:
+            return True
+        if not owner or _is_alive(owner):
+            # claimed, or being claimed
+            return False
+        # the slot of a worker that exited; the first worker to remove the file takes over
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            return False
+        return _claim_file(path, pid)
+    except FileNotFoundError:  # the claim directory was cleaned up
+        return False
+    with os.fdopen(fd, "w") as f:
+        f.write(str(pid))
+    return True
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def placed_task(task: Callable, placement: WorkerPlacement) -> Callable:
+    """Wrap a task so that the worker running it is pinned while it runs"""
+    if wraps_task(task, run_placed):
+        return task
+    return partial(run_placed, task, placement)
+
+
+def run_placed(task: Callable, placement: WorkerPlacement, params: List[Any]) -> Any:
+    with placement.pinned():
+        return task(params)
@@ -0,0 +1,141 @@
+"""asyncio backend for I/O-bound minibatch tasks"""
+
+import asyncio
+import contextvars
+import inspect
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, List, Optional
+
+from hyfi.utils.logging import LOGGING
+
+logger = LOGGING.getLogger(__name__)
+
+# The concurrency of the rows of a minibatch awaited outside of the asyncio backend
+DEFAULT_CONCURRENCY = 100
+
+# The semaphore bounding the rows awaited at once by all the minibatch tasks of a run
+_ROW_SEMAPHORE: contextvars.ContextVar = contextvars.ContextVar(
+    "row_semaphore", default=None
+)
+
+
+def row_semaphore() -> asyncio.Semaphore:
+    """Return the semaphore bounding the rows awaited at once, shared by the minibatches of a run"""
+    semaphore = _ROW_SEMAPHORE.get()
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(DEFAULT_CONCURRENCY)
+    return semaphore
+
+
+def is_async_callable(func: Any) -> bool:
+    """Return True if calling the function returns a coroutine, including for partials"""
+    while hasattr(func, "func"):
+        func = func.func
+    return inspect.iscoroutinefunction(func) or inspect.iscoroutinefunction(
+        getattr(func, "__call__", None)
+    )
+
+
+def run_coroutine(coro: Awaitable) -> Any:
+    """Run a coroutine to completion, also from within a running event loop (e.g. Jupyter)"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)  # type: ignore
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()  # type: ignore
+
+
+async def call_async(
+    task: Callable,
+    params: Any,
+    semaphore: Optional[asyncio.Semaphore] = None,
+    timeout: Optional[float] = None,
+    rows: Optional[asyncio.Semaphore] = None,
+) -> Any:
+    """Await a task on a minibatch within the concurrency limit and the timeout
+
+    Coroutine functions are awaited on the event loop. Other functions run in a thread
+    of the default executor, and their result is awaited if it is awaitable. The `rows`
+    semaphore is returned by `row_semaphore` in the task, to bound the rows it awaits.
+    """
+
+    async def _call():
+        if rows is not None:
+            _ROW_SEMAPHORE.set(rows)
+        if is_async_callable(task):
+            return await task(params)
+        result = await asyncio.get_running_loop().run_in_executor(None, task, params)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    if semaphore is None:
+        return await asyncio.wait_for(_call(), timeout)
+    async with semaphore:
+        return await asyncio.wait_for(_call(), timeout)
+
+
+async def gather_batches(
+    task: Callable,
+    paral_params: List[Any],
+    concurrency: int,
+    timeout: Optional[float] = None,
+    callback: Optional[Callable[[Any], Any]] = None,
+) -> List[Any]:
+    """Await the task on all minibatches, and their rows, at most `concurrency` at a time, in order"""
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    rows = asyncio.Semaphore(max(1, concurrency))
+
+    async def _run(params):
+        result = await call_async(task, params, semaphore, timeout, rows)
+        if callback is not None:
+            callback(result)
+        return result
+
+    return await asyncio.gather(*(_run(params) for params in paral_params))
+
+
+class EventLoopThread(object):
+    """An event loop running in a background thread, to which coroutines are submitted
+
+    Args:
+        concurrency: The maximum number of tasks awaited at once.
+        timeout: The timeout of each task in seconds.
+    """
+
+    def __init__(self, concurrency: int, timeout: Optional[float] = None):
+        self.timeout = timeout
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.semaphore = self._run(self._make_semaphore(max(1, concurrency))).result()
+        self.rows = self._run(self._make_semaphore(max(1, concurrency))).result()
+
+    @staticmethod
+    async def _make_semaphore(concurrency: int) -> asyncio.Semaphore:
+        return asyncio.Semaphore(concurrency)
+
+    def _run(self, coro: Awaitable) -> Future:
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)  # type: ignore
+
+    def submit(self, task: Callable, params: Any) -> Future:
+        """Submit a task on a minibatch and return a future of its result"""
+        return self._run(
+            call_async(task, params, self.semaphore, self.timeout, self.rows)
+        )
+
+    def close(self):
+        """Cancel the outstanding tasks and stop the event loop"""
+
+        async def _cancel():
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        self._run(_cancel()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
@@ -1,11 +1,32 @@
 #!python
 from __future__ import absolute_import, division, print_function, with_statement
 
-from typing import Any, Callable, Mapping, Optional, Sequence
+import inspect
+from typing import (
+    Any,
+    Callable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Union,
+)
 
 import pandas as pd
 
+from hyfi.utils.logging import LOGGING
+
+from .aio import is_async_callable, row_semaphore
 from .batcher import Batcher
+from .checkpoint import fingerprint
+from .kernels import compile_vectorized
+from .memo import MemoStore, deduplicate, expand
+
+logger = LOGGING.getLogger(__name__)
+
+ROW_MODES = ("series", "namedtuple", "columns", "dict")
+IN_PROCESS_BACKENDS = ("serial", "threading", "asyncio")
 
 
 def decorator_apply(
@@ -14,6 +35,12 @@ def decorator_apply(
     cache: Optional[int] = None,
     vectorize: Optional[Callable] = None,
     description: str = "batch_apply",
+    memoize: bool = False,
+    memo_dir: Optional[str] = None,
+    memo_max_bytes: int = 1024 * 1024 * 1024,
+    row_mode: str = "series",
+    vectorize_target: str = "cpu",
+    vectorize_cache: bool = False,
 ):
     """
     Decorator that applies a function to each row of a minibatch.
@@ -24,6 +51,12 @@ def decorator_apply(
         cache: The maximum size of the LRU cache for the function.
         vectorize: The function to use for vectorization.
         description: The description of the apply operation.
+        memoize: Whether to compute the function once per unique value of the data.
+        memo_dir: The directory of the disk store persisting the results between runs.
+        memo_max_bytes: The maximum size of the disk store in bytes.
+        row_mode: How the rows of a DataFrame are passed to the function.
+        vectorize_target: The numba target of the vectorized function, 'cpu' or 'parallel'.
+        vectorize_cache: Whether numba caches the vectorized function on disk.
 
     Returns:
         The wrapper function.
@@ -38,6 +71,12 @@ def decorator_apply(
             cache=cache,
             vectorize=vectorize,
             description=description,
+            memoize=memoize,
+            memo_dir=memo_dir,
+            memo_max_bytes=memo_max_bytes,
+            row_mode=row_mode,
+            vectorize_target=vectorize_target,
+            vectorize_cache=vectorize_cache,
         ).transform(args[0])
 
     return wrapper_func
@@ -55,6 +94,8 @@ def batch_transform(args):
             - func_kwargs: The keyword arguments to pass to the function.
             - cache_maxsize: The maximum size of the LRU cache for the function.
             - vectorize_func: The function to use for vectorization.
+            - row_mode: How the rows of a DataFrame are passed to the function (optional).
+            - vectorize_options: The target and cache options of the vectorization (optional).
 
     Returns:
         The result of applying the function to the data.
@@ -65,22 +106,193 @@ def batch_transform(args):
     func_kwargs = args[3]
     cache_maxsize = args[4]
     vectorize_func = args[5]
+    row_mode = args[6] if len(args) > 6 else "series"
+    vectorize_options = args[7] if len(args) > 7 else {}
     if vectorize_func is not None:
-        from numba import vectorize
-
-        return vectorize(vectorize_func, fastmath=True)(func)(*zip(*data))
+        kernel = compile_vectorized(func, vectorize_func, **vectorize_options)
+        return kernel(*zip(*data))
     if cache_maxsize is not None:
         from functools import lru_cache
 
         func = lru_cache(maxsize=cache_maxsize)(func)
-    # Applying per DataFrame row is very slow, use ApplyBatch instead
     if isinstance(data, pd.DataFrame):
-        return data.apply(lambda x: func(x, *func_args, **func_kwargs), axis=1)
+        row_mode = resolve_row_mode(func, data.columns, row_mode)
+        return apply_rows(data, func, func_args, func_kwargs, row_mode)
     elif isinstance(data, pd.Series):
         return data.apply(lambda x: func(x, *func_args, **func_kwargs))
     return [func(row, *func_args, **func_kwargs) for row in data]
 
 
+def resolve_row_mode(func: Callable, columns: Sequence, row_mode: str = "auto") -> str:
+    """
+    Resolves the row mode of a function applied on DataFrame rows.
+
+    In the 'auto' mode, functions whose leading parameters are named after the columns
+    receive the column values as arguments ('columns'), functions whose row parameter
+    is annotated as a dict or mapping receive dicts ('dict'), and functions annotated
+    with a tuple or NamedTuple receive namedtuples ('namedtuple'). Other functions
+    receive a Series per row ('series'), which supports any kind of row access.
+
+    Args:
+        func: The function to apply.
+        columns: The columns of the DataFrame.
+        row_mode: One of 'auto', 'series', 'namedtuple', 'columns' or 'dict'.
+
+    Returns:
+        The resolved row mode.
+    """
+    if row_mode not in ROW_MODES + ("auto",):
+        raise ValueError(
+            f"row_mode must be 'auto' or one of {ROW_MODES}, got {row_mode}"
+        )
+    if row_mode != "auto":
+        return row_mode
+    try:
+        params = [
+            p
+            for p in inspect.signature(func).parameters.values()
+            if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)
+        ]
+    except (TypeError, ValueError):  # builtins without a signature
+        return "series"
+    names = [str(c) for c in columns]
+    if len(names) > 1 and [p.name for p in params[: len(names)]] == names:
+        return "columns"
+    if params:
+        annotation = params[0].annotation
+        name = (
+            annotation
+            if isinstance(annotation, str)
+            else getattr(getattr(annotation, "__origin__", annotation), "__name__", "")
+        )
+        if name.split("[")[0] in ("dict", "Dict", "Mapping", "MutableMapping"):
+            return "dict"
+        if name.split("[")[0] in ("tuple", "Tuple", "NamedTuple") or (
+            isinstance(annotation, type) and issubclass(annotation, tuple)
+        ):
+            return "namedtuple"
+    return "series"
+
+
+def apply_rows(
+    data: pd.DataFrame,
+    func: Callable,
+    func_args: Sequence,
+    func_kwargs: Mapping,
+    row_mode: str = "series",
+) -> pd.Series:
+    """
+    Applies a function to each row of a DataFrame.
+
+    Args:
+        data: The DataFrame to apply the function to.
+        func: The function to apply.
+        func_args: The arguments to pass to the function following the row.
+        func_kwargs: The keyword arguments to pass to the function.
+        row_mode: How the rows are passed to the function.
+            - 'series': a Series per row, using `DataFrame.apply(axis=1)`. This is the slowest mode.
+            - 'namedtuple': a namedtuple per row, using `DataFrame.itertuples`.
+            - 'columns': the values of the row as separate arguments, zipped from the column arrays.
+            - 'dict': a dict per row, built from the column arrays.
+
+    Returns:
+        A Series of the results with the index of the DataFrame.
+    """
+    if row_mode == "series":
+        return data.apply(lambda x: func(x, *func_args, **func_kwargs), axis=1)
+    if row_mode == "namedtuple":
+        results = [
+            func(row, *func_args, **func_kwargs)
+            for row in data.itertuples(index=False, name="Row")
+        ]
+    else:
+        arrays = [data.iloc[:, i].to_numpy() for i in range(data.shape[1])]
+        if row_mode == "columns":
+            results = [
+                func(*values, *func_args, **func_kwargs) for values in zip(*arrays)
+            ]
+        elif row_mode == "dict":
+            keys = list(data.columns)
+            results = [
+                func(dict(zip(keys, values)), *func_args, **func_kwargs)
+                for values in zip(*arrays)
+            ]
+        else:
+            raise ValueError(f"row_mode must be one of {ROW_MODES}, got {row_mode}")
+    return pd.Series(results, index=data.index)
+
+
+async def async_batch_transform(args):
+    """
+    Awaits a coroutine function on each row of a minibatch concurrently, at most
+    `async_concurrency` rows at a time across the minibatches of the asyncio backend.
+
+    Args:
+        args: A tuple containing the same elements as for `batch_transform`.
+            Caching and vectorization are not supported for coroutine functions.
+
+    Returns:
+        The result of awaiting the function on the data.
+    """
+    import asyncio
+
+    data = args[0]
+    func = args[1]
+    func_args = args[2]
+    func_kwargs = args[3]
+    if isinstance(data, pd.DataFrame):
+        rows = [row for _, row in data.iterrows()]
+    else:
+        rows = list(data)
+    # bound the rows awaited at once, across the minibatches awaited concurrently
+    semaphore = row_semaphore()
+
+    async def _call(row):
+        async with semaphore:
+            return await func(row, *func_args, **func_kwargs)
+
+    results = await asyncio.gather(*(_call(row) for row in rows))
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        return pd.Series(results, index=data.index)
+    return list(results)
+
+
+def columns_transform(args):
+    """
+    Applies a function to each value of several columns of a minibatch, in one pass.
+
+    Args:
+        args: A tuple containing the following elements:
+            - data: The DataFrame minibatch holding the columns to apply the functions to.
+            - functions: The function to apply to each column, by column.
+            - func_args: The arguments to pass to the functions.
+            - func_kwargs: The keyword arguments to pass to the functions.
+            - cache_maxsize: The maximum size of the LRU cache of each function.
+
+    Returns:
+        A DataFrame of the results, with a column per column of the functions.
+    """
+    data = args[0]
+    functions = args[1]
+    func_args = args[2]
+    func_kwargs = args[3]
+    cache_maxsize = args[4]
+    cached = {}
+    results = {}
+    for column, func in functions.items():
+        if cache_maxsize is not None:
+            from functools import lru_cache
+
+            # columns sharing a function share its cache
+            if id(func) not in cached:
+                cached[id(func)] = lru_cache(maxsize=cache_maxsize)(func)
+            func = cached[id(func)]
+        results[column] = [
+            func(value, *func_args, **func_kwargs) for value in data[column]
+        ]
+    return pd.DataFrame(results, index=data.index, columns=list(functions))
+
+
 class Apply(object):
     """
     Applies a function to each row of a minibatch.
@@ -93,6 +305,22 @@ class Apply(object):
         cache: The maximum size of the LRU cache for the function.
         vectorize: The function to use for vectorization.
         description: The description of the apply operation.
+        memoize: Whether to compute the function once per unique value of the data.
+            The unique values are found before dispatch, so results are shared across
+            minibatches and worker processes. Used for Series and sequences of hashable values.
+        memo_dir: The directory of the disk store persisting the results between runs.
+            Implies memoize.
+        memo_max_bytes: The maximum size of the disk store in bytes, above which
+            the least recently used results are evicted.
+        row_mode: How the rows of a DataFrame are passed to the function, one of
+            'series' (the default), 'namedtuple', 'columns', 'dict' or 'auto'. See `apply_rows`.
+            'auto' picks the fastest mode matching the signature of the function.
+        vectorize_target: The numba target of the vectorized function, 'cpu' or 'parallel'.
+        vectorize_cache: Whether numba caches the vectorized function on disk, so that
+            worker processes and later runs load it instead of compiling it again.
+            The compiled function is also kept in memory per process, and is compiled
+            once before dispatch so that forked workers and threads inherit it.
+            See `precompile`.
 
     Attributes:
         batcher: The batcher to use for processing the minibatches.
@@ -102,6 +330,12 @@ class Apply(object):
         cache: The maximum size of the LRU cache for the function.
         vectorize: The function to use for vectorization.
         description: The description of the apply operation.
+        memoize: Whether to compute the function once per unique value of the data.
+        memo_dir: The directory of the disk store persisting the results between runs.
+        memo_max_bytes: The maximum size of the disk store in bytes.
+        row_mode: How the rows of a DataFrame are passed to the function.
+        vectorize_target: The numba target of the vectorized function.
+        vectorize_cache: Whether numba caches the vectorized function on disk.
     """
 
     def __init__(
@@ -113,6 +347,12 @@ class Apply(object):
         cache: Optional[int] = None,
         vectorize: Optional[Callable] = None,
         description: str = "batch_apply",
+        memoize: bool = False,
+        memo_dir: Optional[str] = None,
+        memo_max_bytes: int = 1024 * 1024 * 1024,
+        row_mode: str = "series",
+        vectorize_target: str = "cpu",
+        vectorize_cache: bool = False,
     ):
         if args is None:
             args = []
@@ -125,6 +365,54 @@ class Apply(object):
         self.cache = [cache]
         self.vectorize = [vectorize]
         self.description = description
+        self.memoize = memoize or memo_dir is not None
+        self.memo_dir = memo_dir
+        self.memo_max_bytes = memo_max_bytes
+        self.row_mode = [row_mode]
+        self.vectorize_options = [
+            {"target": vectorize_target, "cache": vectorize_cache}
+        ]
+
+    @property
+    def task(self) -> Callable:
+        """The task applied on each minibatch, awaiting the rows for coroutine functions"""
+        if is_async_callable(self.function):
+            return async_batch_transform
+        return batch_transform
+
+    @property
+    def task_args(self) -> List[Any]:
+        """The arguments passed to the task following each minibatch"""
+        return (
+            [self.function]
+            + self.args
+            + self.kwargs
+            + self.cache
+            + self.vectorize
+            + self.row_mode
+            + self.vectorize_options
+        )
+
+    def compile(self) -> Optional[Callable]:
+        """Compile the vectorized function in this process, returning None if not vectorized"""
+        if self.vectorize[0] is None:
+            return None
+        return compile_vectorized(
+            self.function, self.vectorize[0], **self.vectorize_options[0]
+        )
+
+    def precompile(self, batcher: Batcher):
+        """
+        Compile the vectorized function before dispatch, so that threads and forked workers inherit it.
+
+        The parallel target is compiled in the workers instead, unless they share this process,
+        because numba's threading layers are not all safe to fork once started.
+        """
+        if (
+            self.vectorize_options[0]["target"] == "cpu"
+            or batcher.backend in IN_PROCESS_BACKENDS
+        ):
+            self.compile()
 
     def fit(self, **kwargs):
         """
@@ -184,12 +472,198 @@ class Apply(object):
         """
         if batcher is None:
             batcher = self.batcher
+        self.precompile(batcher)
+        if self.memoize and not input_split and merge_output:
+            deduplicated = deduplicate(data)
+            if deduplicated is not None:
+                return self._memoized_transform(
+                    data, *deduplicated, minibatch_size, batcher
+                )
+            logger.debug("data is not a sequence of hashable values, not memoizing")
         return batcher.process_batches(
-            batch_transform,
+            self.task,
             data,
-            [self.function] + self.args + self.kwargs + self.cache + self.vectorize,
+            self.task_args,
             input_split=input_split,
             merge_output=merge_output,
             minibatch_size=minibatch_size,
             description=self.description,
         )
+
+    def _memoized_transform(
+        self,
+        data: Any,
+        uniques: List[Any],
+        codes: Any,
+        minibatch_size: Optional[int],
+        batcher: Batcher,
+    ):
+        """Compute the function on the unique values missing from the store and expand the results"""
+        store = None
+        found = {}
+        if self.memo_dir is not None:
+            store = MemoStore(
+                self.memo_dir,
+                namespace=fingerprint(self.task, [], self.task_args),
+                max_bytes=self.memo_max_bytes,
+            )
+            found = store.get_many(uniques)
+        missing = [i for i in range(len(uniques)) if i not in found]
+        logger.info(
+            "memoizing %s: %s rows, %s unique values, %s in the store",
+            self.description,
+            len(codes),
+            len(uniques),
+            len(found),
+        )
+        if missing:
+            values = [uniques[i] for i in missing]
+            results = batcher.process_batches(
+                self.task,
+                values,
+                self.task_args,
+                minibatch_size=minibatch_size,
+                description=self.description,
+            )
+            found.update(zip(missing, results))
+            if store is not None:
+                store.set_many(values, results)
+        return expand(data, [found[i] for i in range(len(uniques))], codes)
+
+    def stream(
+        self,
+        data: Any,
+        input_split: bool = False,
+        ordered: bool = True,
+        max_in_flight: Optional[int] = None,
+        minibatch_size: Optional[int] = None,
+        batcher: Optional[Batcher] = None,
+        procs: Optional[int] = None,
+    ) -> Iterator:
+        """
+        Transform the apply operation, yielding the result of each minibatch as it completes.
+
+        Args:
+            data: The data to apply the function to. Can be any iterable, e.g. a generator of DataFrame chunks.
+            input_split: Whether the input data is already split into minibatches.
+            ordered: Whether to yield the results in the order of the minibatches.
+            max_in_flight: The maximum number of minibatches in flight.
+            minibatch_size: The size of the minibatches.
+            batcher: The batcher to use for processing the minibatches.
+            procs: The number of workers. Defaults to the procs of the batcher.
+
+        Returns:
+            An iterator over the results of the minibatches.
+        """
+        if batcher is None:
+            batcher = self.batcher
+        self.precompile(batcher)
+        return batcher.stream_batches(
+            self.task,
+            data,
+            self.task_args,
+            input_split=input_split,
+            ordered=ordered,
+            max_in_flight=max_in_flight,
+            minibatch_size=minibatch_size,
+            procs=procs,
+            description=self.description,
+        )
+
+
+class ApplyColumns(object):
+    """
+    Applies a function, or a function per column, to each value of several columns of a DataFrame.
+
+    Each minibatch is sent once with all the columns, instead of once per column,
+    and the results of the columns are merged once.
+
+    Args:
+        function: The function to apply to every column, or a dict of the function to apply by column.
+        batcher: The batcher to use for processing the minibatches.
+        columns: The columns to apply the function to. Defaults to the keys of the dict of functions.
+        args: The arguments to pass to the functions.
+        kwargs: The keyword arguments to pass to the functions.
+        cache: The maximum size of the LRU cache of each function.
+        description: The description of the apply operation.
+
+    Attributes:
+        batcher: The batcher to use for processing the minibatches.
+        functions: The function to apply, by column.
+        args: The arguments to pass to the functions.
+        kwargs: The keyword arguments to pass to the functions.
+        cache: The maximum size of the LRU cache of each function.
+        description: The description of the apply operation.
+    """
+
+    def __init__(
+        self,
+        function: Union[Callable, Mapping[str, Callable]],
+        batcher: Optional[Batcher] = None,
+        columns: Optional[Sequence[str]] = None,
+        args: Optional[Sequence] = None,
+        kwargs: Optional[Mapping] = None,
+        cache: Optional[int] = None,
+        description: str = "batch_apply_columns",
+    ):
+        if isinstance(function, Mapping):
+            if columns is None:
+                columns = list(function)
+            missing = [c for c in columns if c not in function]
+            if missing:
+                raise ValueError(f"no function given for the columns {missing}")
+            functions = {c: function[c] for c in columns}
+        else:
+            if not columns:
+                raise ValueError("columns are required to apply a single function")
+            functions = {c: function for c in columns}
+        if any(is_async_callable(func) for func in functions.values()):
+            raise ValueError(
+                "coroutine functions are not supported, use Apply per column"
+            )
+        self.batcher = Batcher() if batcher is None else batcher
+        self.functions = functions
+        self.args = [] if args is None else list(args)
+        self.kwargs = {} if kwargs is None else dict(kwargs)
+        self.cache = cache
+        self.description = description
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self.functions)
+
+    @property
+    def task_args(self) -> List[Any]:
+        """The arguments passed to the task following each minibatch"""
+        return [self.functions, self.args, self.kwargs, self.cache]
+
+    def transform(
+        self,
+        data: pd.DataFrame,
+        minibatch_size: Optional[int] = None,
+        batcher: Optional[Batcher] = None,
+    ) -> pd.DataFrame:
+        """
+        Transform the columns of a DataFrame.
+
+        Only the columns to apply the functions to are sent to the workers.
+
+        Args:
+            data: The DataFrame holding the columns.
+            minibatch_size: The size of the minibatches.
+            batcher: The batcher to use for processing the minibatches.
+
+        Returns:
+            A DataFrame of the results, with the index of the data and a column per column.
+        """
+        if batcher is None:
+            batcher = self.batcher
+        if len(data) == 0:
+            return pd.DataFrame(index=data.index, columns=self.columns)
+        return batcher.process_batches(
+            columns_transform,
+            data[self.columns],
+            self.task_args,
+            minibatch_size=minibatch_size,
+            description=self.description,
+        )
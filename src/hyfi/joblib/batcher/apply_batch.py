@@ -1,6 +1,6 @@
 from __future__ import absolute_import, division, print_function, with_statement
 
-from typing import Any, Callable, Mapping, Optional, Sequence
+from typing import Any, Callable, Iterator, Mapping, Optional, Sequence
 
 from .batcher import Batcher
 
@@ -127,6 +127,41 @@ class ApplyBatch(object):
             minibatch_size=minibatch_size,
         )
 
+    def stream(
+        self,
+        data: Any,
+        input_split: bool = False,
+        ordered: bool = True,
+        max_in_flight: Optional[int] = None,
+        minibatch_size: Optional[int] = None,
+        batcher: Optional[Batcher] = None,
+    ) -> Iterator:
+        """
+        Applies the function to each minibatch, yielding the outputs as they complete.
+
+        Args:
+            data (Any): The data to apply the function to. Can be any iterable, e.g. a generator of DataFrame chunks.
+            input_split (bool, optional): Whether the input data is already split into minibatches. Defaults to False.
+            ordered (bool, optional): Whether to yield the outputs in the order of the minibatches. Defaults to True.
+            max_in_flight (Optional[int], optional): The maximum number of minibatches in flight. Defaults to None.
+            minibatch_size (Optional[int], optional): The size of the minibatches. Defaults to None.
+            batcher (Optional[Batcher], optional): The batcher to use. Defaults to None.
+
+        Returns:
+            Iterator: An iterator over the outputs of the function applied to the minibatches.
+        """
+        if batcher is None:
+            batcher = self.batcher
+        return batcher.stream_batches(
+            task=batch_transform,
+            data=data,
+            args=[self.function] + self.args + self.kwargs,
+            input_split=input_split,
+            ordered=ordered,
+            max_in_flight=max_in_flight,
+            minibatch_size=minibatch_size,
+        )
+
 
 def batch_transform(args):
     """
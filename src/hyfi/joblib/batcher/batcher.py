@@ -1,17 +1,63 @@
 """Batcher class for handling parallel jobs on minibatches"""
 
 import contextlib
+import importlib
+import inspect
 import multiprocessing
-from contextlib import closing
+import os
+import time
+from collections.abc import Sized
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from functools import partial
+from itertools import chain, islice
 from math import ceil
-from typing import Any, Callable, List, Optional
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Union
 
+import numpy as np
 import pandas as pd
 import scipy.sparse as ssp
 from tqdm.auto import tqdm
 
 from hyfi.utils.logging import LOGGING
 
+from .adaptive import AdaptiveBatchSizer
+from .affinity import WorkerPlacement, placed_task, plan_placement
+from .aio import EventLoopThread, gather_batches, run_coroutine
+from .broadcast import (
+    Broadcast,
+    broadcast_task,
+    find_broadcasts,
+    install_broadcasts,
+    resolve_broadcasts,
+)
+from .budget import (
+    MemoryBudget,
+    ResultSpill,
+    estimate_nbytes,
+    merge_spilled,
+    resident_memory,
+)
+from .checkpoint import BatchCheckpoint, fingerprint, indexed_task
+from .merge import merge_results
+from .retry import (
+    RetryPolicy,
+    is_isolated,
+    isolated_task,
+    save_quarantine,
+    unwrap_isolated,
+    unwrap_isolated_stream,
+)
+from .schedule import SCHEDULES, plan_chunks, row_costs
+from .shared import (
+    SharedData,
+    load_shared_result,
+    load_shared_results,
+    shared_task,
+    supports_shared_memory,
+)
+from .telemetry import BatchTelemetry, run_measured
+from .threads import resolve_inner_threads, thread_limited_task, thread_limits
+
 logger = LOGGING.getLogger(__name__)
 
 
@@ -32,12 +78,17 @@ class Batcher(object):
 
                         - 'multiprocessing' Python standard multiprocessing library
 
-                        - 'threading' Python standard threading library
+                        - 'threading' Thread pool of the Python standard library, sharing the data with the
+                          tasks without copying or pickling. Use it for tasks that release the GIL,
+                          e.g. NumPy, regex or pyarrow kernels
 
                         - 'loky' Loky fork of multiprocessing library
 
                         - 'joblib' Joblib fork of multiprocessing library
 
+                        - 'asyncio' asyncio event loop for I/O-bound tasks. Coroutine functions are awaited,
+                          at most `async_concurrency` minibatches at a time
+
                         - 'ray' Ray local or distributed execution
 
         task_num_cpus (int):
@@ -49,6 +100,148 @@ class Batcher(object):
         backend_handle (object):
                 Backend handle for sending tasks
 
+        max_in_flight (int):
+                Maximum number of minibatches submitted but not yet consumed when streaming.
+                Defaults to twice the number of processes. The 'joblib' backend only bounds
+                the minibatches dispatched ahead, and keeps computing results whether or not
+                they are consumed, so it does not bound the memory of slow consumers.
+
+        transport (str): {'pickle', 'shared_memory'}
+                How minibatches are sent to and returned from worker processes
+
+                        - 'pickle' every minibatch is pickled into the workers
+
+                        - 'shared_memory' numeric columns of DataFrames, Series and ndarrays are copied
+                          into shared memory once, and workers receive only (offset, length) descriptors
+                          from which they rebuild zero-copy views. Numeric results come back the same way.
+                          Used for multiprocessing, loky, joblib and p_tqdm.
+
+        persistent_pool (bool):
+                If True, the multiprocessing worker pool is created once and reused across calls
+                until `shutdown` is called, instead of being created on every call.
+
+        max_tasks_per_child (int):
+                Number of minibatches a multiprocessing worker completes before it is replaced
+                with a fresh worker. Defaults to 2. None means workers live as long as the pool.
+
+        max_memory_per_child (int):
+                Resident memory in bytes above which the workers of a persistent pool are recycled
+                before the next call. Checked on platforms exposing `/proc` only.
+
+        adaptive_minibatch (bool):
+                If True, the minibatch size starts at `minibatch_size` and is grown or shrunk from the
+                measured run time and payload size of the minibatches, toward `target_batch_seconds`.
+                The size reached is kept in `tuned_minibatch_size` and logged, so it can be pinned.
+
+        target_batch_seconds (float):
+                Target run time per minibatch in seconds for the adaptive minibatch size
+
+        async_concurrency (int):
+                Maximum number of minibatch tasks awaited at once by the asyncio backend, and of
+                the rows awaited at once by the coroutine functions of `Apply` across them
+
+        async_timeout (float):
+                Timeout in seconds of each minibatch task of the asyncio backend. None means no timeout.
+
+        checkpoint_dir (str):
+                Directory in which the result of every finished minibatch is saved, under a fingerprint
+                of the task, its arguments and the input. A rerun after a crash computes only the
+                minibatches without a saved result. None disables checkpointing.
+
+        start_method (str): {'fork', 'forkserver', 'spawn'}
+                Start method of the multiprocessing workers. None means the platform default.
+
+        preload_modules (list):
+                Modules imported once in every multiprocessing and loky worker when it starts,
+                e.g. ['pandas', 'scipy.sparse'], instead of on the first task. With 'forkserver',
+                they are imported in the fork server, and workers forked from it start warm.
+
+        telemetry (bool):
+                If True, the queue wait, run time, pickled input and output size and worker PID of
+                every minibatch are recorded. The utilization and straggler report of each call is
+                logged and kept in `last_telemetry`. Not recorded on the asyncio backend.
+
+        telemetry_dir (str):
+                Directory in which the telemetry of each call is saved as JSON. Implies telemetry.
+
+        max_inflight_bytes (int):
+                Memory budget of the estimated bytes of submitted minibatches and of results not
+                yet consumed. Submission waits for completions while the budget is exceeded, and
+                results collected beyond it are spilled to disk until they are merged.
+
+        max_rss_bytes (int):
+                Memory budget as a ceiling on the resident memory of this process, enforced the
+                same way. Checked on platforms exposing `/proc` only.
+
+        spill_dir (str):
+                Directory in which results are spilled. Defaults to the system temporary directory.
+
+        schedule (str): {'static', 'dynamic', 'guided'}
+                How the data is split into minibatches and handed out to the workers
+
+                        - 'static' minibatches of `minibatch_size` rows
+
+                        - 'dynamic' minibatches of `minibatch_size` rows, handed out to the workers on demand
+
+                        - 'guided' minibatches of half of the remaining rows over the number of workers,
+                          at most `minibatch_size` rows, handed out on demand. The sizes decrease toward
+                          the end, so the workers finish together.
+
+        cost (str or callable):
+                Column holding the cost of every row, or a function of the data returning it,
+                e.g. `lambda df: df.text.str.len()`. Minibatches are balanced by total cost
+                instead of row count.
+
+        retries (int):
+                Number of retries of a failed minibatch, waiting `retry_backoff` seconds before
+                the first retry and doubling the wait before each next one
+
+        retry_backoff (float):
+                Wait before the first retry of a failed minibatch in seconds
+
+        on_error (str): {'fail', 'skip', 'default'}
+                What to do with the rows failing the task once the retries are exhausted
+
+                        - 'fail' raise the error, aborting the call
+
+                        - 'skip' bisect the failing minibatch to isolate the failing rows, and leave
+                          them out of the results
+
+                        - 'default' bisect the failing minibatch to isolate the failing rows, and
+                          substitute `error_default` for their results
+
+                Only the failing minibatches are rerun. The quarantined rows are logged and kept
+                in `last_quarantine`, also when streaming. Not supported on the asyncio backend,
+                where a warning is logged instead.
+
+        error_default (object):
+                Result substituted for the failing rows with the 'default' policy
+
+        quarantine_dir (str):
+                Directory in which the report of the quarantined rows of each call is saved as JSON
+
+        inner_threads (int or str):
+                Number of BLAS and OpenMP threads of each worker, e.g. of NumPy, SciPy and numba,
+                or 'auto' to divide the available cores among the workers. Worker processes are
+                limited before their first minibatch, and the serial and threading backends
+                limit this process for the duration of the call only. Libraries already loaded
+                are limited with threadpoolctl if it is installed. Defaults to no limit.
+
+        placement (str or list):
+                Placement of the worker processes on the cores, pinning each worker with
+                `os.sched_setaffinity`. Defaults to no pinning.
+
+                        - 'compact' consecutive cores, filling a NUMA node before the next one
+
+                        - 'spread' the NUMA nodes in turn, to use the memory bandwidth of all of them
+
+                        - a list of the cores of each worker, e.g. `[[0, 1], [2, 3]]`
+
+                Memory is allocated on the node of the core first touching it, so the minibatches
+                and results of a pinned worker stay local to its node. The multiprocessing and loky
+                workers are pinned as they start, and the workers of the other backends before
+                their first minibatch. Linux only.
+
         verbose (int):
                 Verbosity level.
                 Setting verbose > 0 will display additional information depending on the specific level set.
@@ -62,6 +255,32 @@ class Batcher(object):
         backend: str = "multiprocessing",
         task_num_cpus: int = 1,
         task_num_gpus: int = 0,
+        max_in_flight: Optional[int] = None,
+        transport: str = "pickle",
+        persistent_pool: bool = False,
+        max_tasks_per_child: Optional[int] = 2,
+        max_memory_per_child: Optional[int] = None,
+        adaptive_minibatch: bool = False,
+        target_batch_seconds: float = 1.0,
+        async_concurrency: int = 100,
+        async_timeout: Optional[float] = None,
+        checkpoint_dir: Optional[str] = None,
+        start_method: Optional[str] = None,
+        preload_modules: Optional[List[str]] = None,
+        telemetry: bool = False,
+        telemetry_dir: Optional[str] = None,
+        max_inflight_bytes: Optional[int] = None,
+        max_rss_bytes: Optional[int] = None,
+        spill_dir: Optional[str] = None,
+        schedule: str = "static",
+        cost: Optional[Union[str, Callable[[Any], Any]]] = None,
+        retries: int = 0,
+        retry_backoff: float = 0.5,
+        on_error: str = "fail",
+        error_default: Any = None,
+        quarantine_dir: Optional[str] = None,
+        inner_threads: Optional[Union[int, str]] = None,
+        placement: Optional[Union[str, List[Any]]] = None,
         verbose: int = 0,
     ):
         if procs == 0 or procs is None:
@@ -73,6 +292,56 @@ class Batcher(object):
         self.backend = backend
         self.task_num_cpus = task_num_cpus
         self.task_num_gpus = task_num_gpus
+        self.max_in_flight = max_in_flight
+        self.transport = transport
+        self.persistent_pool = persistent_pool
+        self.max_tasks_per_child = max_tasks_per_child
+        self.max_memory_per_child = max_memory_per_child
+        self.adaptive_minibatch = adaptive_minibatch
+        self.target_batch_seconds = target_batch_seconds
+        self.tuned_minibatch_size: Optional[int] = None
+        self.async_concurrency = async_concurrency
+        self.async_timeout = async_timeout
+        self.checkpoint_dir = checkpoint_dir
+        if start_method is not None and (
+            start_method not in multiprocessing.get_all_start_methods()
+        ):
+            raise ValueError(
+                f"start_method must be one of {multiprocessing.get_all_start_methods()}, got {start_method}"
+            )
+        self.start_method = start_method
+        self.preload_modules = list(preload_modules or [])
+        self.worker_startup_seconds: Optional[float] = None
+        self.telemetry = telemetry or telemetry_dir is not None
+        self.telemetry_dir = telemetry_dir
+        self.last_telemetry: Optional[BatchTelemetry] = None
+        self.max_inflight_bytes = max_inflight_bytes
+        self.max_rss_bytes = max_rss_bytes
+        self.spill_dir = spill_dir
+        if schedule not in SCHEDULES:
+            raise ValueError(f"schedule must be one of {SCHEDULES}, got {schedule}")
+        self.schedule = schedule
+        self.cost = cost
+        self.retry_policy = RetryPolicy(
+            retries=retries,
+            backoff=retry_backoff,
+            on_error=on_error,
+            default=error_default,
+        )
+        self.quarantine_dir = quarantine_dir
+        self.last_quarantine: List[dict] = []
+        resolve_inner_threads(inner_threads, 1)
+        self.inner_threads = inner_threads
+        if placement is not None:
+            plan_placement(placement, 1, {0: [0]})
+        self.placement = placement
+        self._placement: Optional[WorkerPlacement] = None
+        self._pool: Any = None
+        self._pool_procs = 0
+        self._broadcasts: dict = {}
+        self._broadcast_initargs: tuple = ({},)
+        self._pool_broadcasts: frozenset = frozenset()
+        self._pool_placement: Optional[WorkerPlacement] = None
 
     def split_batches(
         self,
@@ -100,36 +369,108 @@ class Batcher(object):
             minibatch_size = self.minibatch_size
         if backend is None:
             backend = self.backend
-        if isinstance(data, (list, tuple, dict)):
-            len_data = len(data)
-        else:
-            len_data = data.shape[0]
+        return list(_slice_batches(data, minibatch_size))
 
-        if isinstance(data, pd.DataFrame):
-            data = [
-                data.iloc[x * minibatch_size : (x + 1) * minibatch_size]
-                for x in range(int(ceil(len_data / minibatch_size)))
-            ]
-        elif isinstance(data, dict):
-            data = [
-                dict(
-                    list(data.items())[
-                        x * minibatch_size : min(len_data, (x + 1) * minibatch_size)
-                    ]
-                )
-                for x in range(int(ceil(len_data / minibatch_size)))
-            ]
+    def iter_batches(
+        self,
+        data: Iterable,
+        minibatch_size: Optional[Union[int, Callable[[], int]]] = None,
+        input_split: bool = False,
+    ) -> Iterator:
+        """Lazily split data into minibatches with a specified size
+
+        Unlike `split_batches`, the data can be any iterable, including a generator.
+        Sized inputs are sliced on demand. For other iterables, chunks that are
+        DataFrames, Series, arrays or sparse matrices are split further into
+        minibatches, while any other items are grouped into lists of minibatch size.
+
+        Arguments:
+            data (iterable):
+                Data to be split into batches, or an iterable of data chunks.
+
+            minibatch_size (int or callable):
+                Expected sizes of minibatches split from the data, or a callable returning
+                the size of the next minibatch, e.g. an `AdaptiveBatchSizer`.
+
+            input_split (bool):
+                If True, each item of data is already a minibatch and is yielded as is.
+
+        Yields:
+            Minibatches, each a list-like object representing the data subset in a batch.
+        """
+        if minibatch_size is None:
+            minibatch_size = self.minibatch_size
+        if input_split:
+            yield from data
+        elif _is_chunk(data) or isinstance(data, (Sized, dict)):
+            yield from _slice_batches(data, minibatch_size)
         else:
-            data = [
-                data[x * minibatch_size : min(len_data, (x + 1) * minibatch_size)]
-                for x in range(int(ceil(len_data / minibatch_size)))
-            ]
-        return data
+            iterator = iter(data)
+            for item in iterator:
+                if _is_chunk(item):
+                    yield from _slice_batches(item, minibatch_size)
+                else:
+                    size = _next_size(minibatch_size)
+                    yield [item] + list(islice(iterator, size - 1))
+
+    def schedule_batches(
+        self,
+        data: Any,
+        minibatch_size: Optional[int] = None,
+        procs: Optional[int] = None,
+    ) -> List[Any]:
+        """Split data into minibatches planned by the `schedule` and `cost` of the Batcher
+
+        Arguments:
+            data (list, tuple, dict, numpy.ndarray, scipy.sparse.csr_matrix, pandas.DataFrame):
+                Sized data to be split into batches.
+
+            minibatch_size (int):
+                Maximum size of the minibatches.
+
+            procs (int):
+                Number of workers the minibatches are planned for.
+
+        Returns:
+            data_split (list):
+                List of minibatches
+        """
+        costs = None if self.cost is None else row_costs(data, self.cost)
+        minibatch_size = minibatch_size or self.minibatch_size
+        sizes = iter(
+            plan_chunks(
+                _len_data(data),
+                procs or self.procs,
+                minibatch_size,
+                self.schedule,
+                costs,
+                # the tail of a guided schedule does not shrink into single rows
+                min_chunk_size=max(1, minibatch_size // 16),
+            )
+        )
+        batches = list(_slice_batches(data, lambda: next(sizes)))
+        logger.debug(
+            "%s schedule: %s minibatches of %s rows",
+            self.schedule,
+            len(batches),
+            [_len_data(b) for b in batches],
+        )
+        return batches
 
     def collect_batches(self, data: Any, backend: Any = None):
         if backend is None:
             backend = self.backend
-        return data
+        return load_shared_results(data)
+
+    def use_shared_memory(self, data: Any, backend: Optional[str] = None) -> bool:
+        """Return True if minibatches of the data are sent through shared memory"""
+        if backend is None:
+            backend = self.backend
+        return (
+            self.transport == "shared_memory"
+            and backend in ["multiprocessing", "loky", "joblib", "p_tqdm"]
+            and supports_shared_memory(data)
+        )
 
     def merge_batches(self, data: Any):
         """Merge a list of data minibatches into one single instance representing the data
@@ -139,15 +480,11 @@ class Batcher(object):
                 List of minibatches to merge
 
         Returns:
-            data (list, numpy.ndarray, scipy.sparse.csr_matrix, pandas.DataFrame):
+            data (list, numpy.ndarray, scipy.sparse matrix, pandas.DataFrame, pandas.Series,
+                pyarrow.Table, pyarrow.ChunkedArray, datasets.Dataset, dict):
                 Single complete list-like data merged from given batches
         """
-        print(data)
-        if isinstance(data[0], ssp.csr_matrix):  # type: ignore
-            return ssp.vstack(data)  # type: ignore
-        if isinstance(data[0], (pd.DataFrame, pd.Series)):
-            return pd.concat(data)
-        return [item for sublist in data for item in sublist]
+        return merge_results(data)
 
     def process_batches(
         self,
@@ -164,6 +501,7 @@ class Batcher(object):
         task_num_gpus: Optional[int] = None,
         verbose: Optional[int] = None,
         description: str = "batch_apply",
+        checkpoint_dir: Optional[str] = None,
     ):
         """
         Apply a function on minibatches of data in parallel
@@ -197,12 +535,17 @@ class Batcher(object):
 
                         - 'multiprocessing' Python standard multiprocessing library
 
-                        - 'threading' Python standard threading library
+                        - 'threading' Thread pool of the Python standard library, sharing the data with the
+                          tasks without copying or pickling. Use it for tasks that release the GIL,
+                          e.g. NumPy, regex or pyarrow kernels
 
                         - 'loky' Loky fork of multiprocessing library
 
                         - 'joblib' Joblib fork of multiprocessing library
 
+                        - 'asyncio' asyncio event loop for I/O-bound tasks. Coroutine functions are awaited,
+                          at most `async_concurrency` minibatches at a time
+
                         - 'ray' Ray local or distributed execution
 
             backend_handle (object):
@@ -218,6 +561,10 @@ class Batcher(object):
                 Verbosity level.
                 Setting verbose > 0 will display additional information depending on the specific level set.
 
+            checkpoint_dir (str):
+                Directory in which the result of every finished minibatch is saved. Defaults to the
+                `checkpoint_dir` of the batcher.
+
         Returns:
             data (list):
                 If merge_output is specified as True, this will be a list-like object representing
@@ -236,6 +583,94 @@ class Batcher(object):
             task_num_gpus = self.task_num_gpus
         if verbose is None:
             verbose = self.verbose
+        if checkpoint_dir is None:
+            checkpoint_dir = self.checkpoint_dir
+        if self._isolates(task, backend):
+            results = self.process_batches(
+                isolated_task(task, self.retry_policy),
+                data,
+                args,
+                backend=backend,
+                backend_handle=backend_handle,
+                input_split=input_split,
+                merge_output=False,
+                minibatch_size=minibatch_size,
+                procs=procs,
+                task_num_cpus=task_num_cpus,
+                task_num_gpus=task_num_gpus,
+                verbose=verbose,
+                description=description,
+                checkpoint_dir=checkpoint_dir,
+            )
+            results = self.collect_batches(results, backend=backend)
+            results, self.last_quarantine = unwrap_isolated(results, description)
+            self._save_quarantine(description)
+            return self.merge_batches(results) if merge_output else results
+        if checkpoint_dir:
+            # the task is bound to the backend when streaming
+            results = self._process_checkpointed(
+                task,
+                data if input_split else self.split_batches(data, minibatch_size),
+                args,
+                checkpoint_dir,
+                backend=backend,
+                backend_handle=backend_handle,
+                procs=procs,
+                task_num_cpus=task_num_cpus,
+                task_num_gpus=task_num_gpus,
+                description=description,
+            )
+            return self.merge_batches(results) if merge_output else results
+        task, args = self._bind_broadcasts(task, args, backend, backend_handle)
+        task = self._bind_thread_limits(task, backend, procs)
+        task = self._bind_placement(task, backend, procs)
+        if not input_split and self.use_shared_memory(data, backend):
+            with SharedData(data) as shared:
+                results = self.process_batches(
+                    shared_task(task),
+                    shared.split(minibatch_size or self.minibatch_size),
+                    args,
+                    backend=backend,
+                    backend_handle=backend_handle,
+                    input_split=True,
+                    merge_output=False,
+                    procs=procs,
+                    task_num_cpus=task_num_cpus,
+                    task_num_gpus=task_num_gpus,
+                    verbose=verbose,
+                    description=description,
+                )
+                # load the results before the blocks of those not loaded are released
+                results = self.collect_batches(results, backend=backend)
+            return self.merge_batches(results) if merge_output else results
+        on_demand = False
+        if not input_split and (self.schedule != "static" or self.cost is not None):
+            if _is_chunk(data) or isinstance(data, Sized):
+                data = self.schedule_batches(data, minibatch_size, procs)
+                input_split = True
+                on_demand = self.schedule != "static"
+        adaptive = self.adaptive_minibatch and not input_split and backend != "asyncio"
+        budget = self._memory_budget(backend, streaming=False)
+        if adaptive or on_demand or budget is not None:
+            results = self._collect_stream(
+                task,
+                data,
+                args,
+                budget,
+                merge_output=merge_output,
+                backend=backend,
+                backend_handle=backend_handle,
+                input_split=input_split,
+                # hand out the minibatches on demand, one per idle worker
+                max_in_flight=procs if on_demand else None,
+                minibatch_size=minibatch_size,
+                procs=procs,
+                task_num_cpus=task_num_cpus,
+                task_num_gpus=task_num_gpus,
+                adaptive=adaptive,
+                description=description,
+            )
+            return results if merge_output else self.collect_batches(results)
         # if verbose > 1:
         logger.debug(
             "backend: %s, minibatch_size: %s, procs: %s, input_split: %s, merge_output: %s, len(data): %s, len(args): %s",
@@ -244,16 +679,16 @@ class Batcher(object):
             procs,
             input_split,
             merge_output,
-            len(data),
+            _len_data(data),
             len(args),
         )
 
         # if verbose > 10:
         logger.debug(
-            " len(data): %s len(args): %s [type(x) for x in data]: %s [type(x) for x in args]: %s",
-            len(data),
+            " len(data): %s len(args): %s type(data): %s [type(x) for x in args]: %s",
+            _len_data(data),
             len(args),
-            [type(x) for x in data],
+            type(data),
             [type(x) for x in args],
         )
 
@@ -265,30 +700,45 @@ class Batcher(object):
         else:
             paral_params = [[data_batch] + args for data_batch in data]
         logger.debug("Start task, len(paral_params): %s", len(paral_params))
+        telemetry = self._new_telemetry(description, backend, procs)
+        if telemetry is not None:
+            task = partial(run_measured, task)
         results = []
         if backend == "serial":
-            results = [
-                task(minibatch) for minibatch in tqdm(paral_params, desc=description)
-            ]
+            with thread_limits(self._inner_threads(backend, procs)):
+                results = [
+                    task(minibatch)
+                    for minibatch in tqdm(paral_params, desc=description)
+                ]
         else:
             if backend == "multiprocessing":
-                with closing(
-                    multiprocessing.Pool(max(1, procs), maxtasksperchild=2)
-                ) as pool:
-                    results = pool.map_async(task, paral_params)
-                    pool.close()
-                    pool.join()
-                    results = results.get()
+                with self._worker_pool(procs) as pool:
+                    results = pool.map_async(task, paral_params).get()
             elif backend == "threading":
-                with closing(multiprocessing.Pool(max(1, procs))) as pool:
-                    results = pool.map(task, paral_params)
-                    pool.close()
-                    pool.join()
+                with thread_limits(
+                    self._inner_threads(backend, procs)
+                ), ThreadPoolExecutor(max_workers=max(1, procs)) as executor:
+                    results = list(
+                        tqdm(
+                            executor.map(task, paral_params),
+                            total=len(paral_params),
+                            desc=description,
+                        )
+                    )
             elif backend == "loky":
-                from loky import get_reusable_executor
-
-                pool = get_reusable_executor(max_workers=max(1, procs))
+                pool = self._loky_executor(procs)
                 results = list(pool.map(task, tqdm(paral_params, desc=description)))
+            elif backend == "asyncio":
+                with tqdm(desc=description, total=len(paral_params)) as pbar:
+                    results = run_coroutine(
+                        gather_batches(
+                            task,
+                            paral_params,
+                            concurrency=self.async_concurrency,
+                            timeout=self.async_timeout,
+                            callback=lambda _: pbar.update(1),
+                        )
+                    )
             elif backend == "joblib":
                 from joblib import Parallel, delayed
 
@@ -303,39 +753,23 @@ class Batcher(object):
 
                 results = p_map(task, paral_params, num_cpus=procs)
             elif backend == "ray":
-
-                @self.backend_handle.remote(
-                    num_cpus=task_num_cpus, num_gpus=task_num_gpus
+                results = self._process_ray(
+                    task,
+                    paral_params,
+                    backend_handle,
+                    procs,
+                    task_num_cpus,
+                    task_num_gpus,
+                    description,
                 )
-                def f_ray(f, data):
-                    return f(data)
-
-                pbar = tqdm(desc=description, total=len(paral_params) + 1)
-                results = [
-                    f_ray.remote(task, paral_params.pop(0))
-                    for _ in range(min(len(paral_params), self.procs))
-                ]
-                uncompleted = results
-                pbar.update(len(results))
-                while paral_params:
-                    # More tasks than available processors. Queue the task calls
-                    done, remaining = self.backend_handle.wait(
-                        uncompleted, timeout=60, fetch_local=False
-                    )
-                    # if verbose > 5:  print("Done, len(done), len(remaining)", len(done), len(remaining))
-                    if len(done) == 0:
-                        continue
-                    done = done[0]
-                    uncompleted = [x for x in uncompleted if x != done]
-                    if len(remaining) > 0:
-                        new = f_ray.remote(task, paral_params.pop(0))
-                        pbar.update(1)
-                        uncompleted.append(new)
-                        results.append(new)
-                results = [self.backend_handle.get(x) for x in results]
-                pbar.update(1)
-                pbar.close()
 
+        if telemetry is not None:
+            results, records = zip(*results) if results else ([], [])
+            results = list(results)
+            for index, record in enumerate(records):
+                # all minibatches are submitted at once
+                telemetry.add(index, record, telemetry.started)
+            self._report_telemetry(telemetry)
         if merge_output:
             return self.merge_batches(self.collect_batches(results, backend=backend))
         logger.debug(
@@ -346,14 +780,869 @@ class Batcher(object):
         )
         return results
 
+    def stream_batches(
+        self,
+        task: Callable,
+        data: Iterable,
+        args: List[Any],
+        backend: Optional[str] = None,
+        backend_handle: Any = None,
+        input_split: bool = False,
+        ordered: bool = True,
+        max_in_flight: Optional[int] = None,
+        minibatch_size: Optional[int] = None,
+        procs: Optional[int] = None,
+        task_num_cpus: Optional[int] = None,
+        task_num_gpus: Optional[int] = None,
+        adaptive: Optional[bool] = None,
+        description: str = "batch_apply",
+    ) -> Iterator:
+        """
+        Apply a function on minibatches of data in parallel, yielding results as they complete
+
+        Minibatches are split from the data on demand and at most `max_in_flight` of them
+        are submitted or waiting to be consumed at any time, so memory stays flat regardless
+        of the size of the input.
+
+        Arguments:
+            task (callable):
+                Function to apply on each minibatch with other specified arguments
+
+            data (iterable):
+                Samples to split into minibatches, or an iterable (e.g. a generator) of data chunks
+
+            args (list):
+                Arguments to pass to the specified function following the mini-batch
+
+            input_split (bool):
+                If True, input data is already mapped into minibatches, otherwise data will be split on the fly.
+
+            ordered (bool):
+                If True, results are yielded in the order of the minibatches, otherwise as soon as they complete.
+
+            max_in_flight (int):
+                Maximum number of minibatches in flight. Defaults to the Batcher attribute, or twice the procs.
+                With the 'joblib' backend, only the minibatches dispatched ahead are bounded.
+
+            minibatch_size (int):
+                Expected size of each minibatch
+
+            backend (str):
+                Backend for computing the tasks. See `process_batches`.
+                The 'joblib' backend always yields results in order.
+
+            backend_handle (object):
+                Backend handle for sending tasks
+
+            procs (int):
+                Number of process(es)/thread(s) for executing task in parallel.
+
+            task_num_cpus (int):
+                Number of CPUs to reserve per minibatch task for Ray
+
+            task_num_gpus (int):
+                Number of GPUs to reserve per minibatch task for Ray
+
+            adaptive (bool):
+                If True, minibatch sizes are adapted to their measured cost. Defaults to the Batcher attribute.
+
+        Yields:
+            The result of the task on each minibatch.
+        """
+        if procs is None:
+            procs = self.procs
+        if backend is None:
+            backend = self.backend
+        if backend_handle is None:
+            backend_handle = self.backend_handle
+        if task_num_cpus is None:
+            task_num_cpus = self.task_num_cpus
+        if task_num_gpus is None:
+            task_num_gpus = self.task_num_gpus
+        if max_in_flight is None:
+            max_in_flight = self.max_in_flight or 2 * max(1, procs)
+        max_in_flight = max(1, max_in_flight)
+        if minibatch_size is None:
+            minibatch_size = self.minibatch_size
+        if adaptive is None:
+            adaptive = self.adaptive_minibatch
+        if self._isolates(task, backend):
+            self.last_quarantine = []
+            results = self.stream_batches(
+                isolated_task(task, self.retry_policy),
+                data,
+                args,
+                backend=backend,
+                backend_handle=backend_handle,
+                input_split=input_split,
+                ordered=ordered,
+                max_in_flight=max_in_flight,
+                minibatch_size=minibatch_size,
+                procs=procs,
+                task_num_cpus=task_num_cpus,
+                task_num_gpus=task_num_gpus,
+                adaptive=adaptive,
+                description=description,
+            )
+            try:
+                yield from unwrap_isolated_stream(results, self.last_quarantine)
+            finally:
+                if self.last_quarantine:
+                    logger.warning(
+                        "%s: quarantined %s rows, e.g. row %s: %s",
+                        description,
+                        len(self.last_quarantine),
+                        self.last_quarantine[0]["position"],
+                        self.last_quarantine[0]["error"],
+                    )
+                self._save_quarantine(description)
+            return
+        task, args = self._bind_broadcasts(task, args, backend, backend_handle)
+        task = self._bind_thread_limits(task, backend, procs)
+        task = self._bind_placement(task, backend, procs)
+        if not input_split and self.use_shared_memory(data, backend):
+            with SharedData(data) as shared:
+                for result in self.stream_batches(
+                    shared_task(task),
+                    shared.split(minibatch_size),
+                    args,
+                    backend=backend,
+                    backend_handle=backend_handle,
+                    input_split=True,
+                    ordered=ordered,
+                    max_in_flight=max_in_flight,
+                    procs=procs,
+                    task_num_cpus=task_num_cpus,
+                    task_num_gpus=task_num_gpus,
+                    description=description,
+                ):
+                    yield load_shared_result(result)
+            return
+        logger.debug(
+            "Start streaming task, backend: %s, minibatch_size: %s, procs: %s, max_in_flight: %s, ordered: %s",
+            backend,
+            minibatch_size,
+            procs,
+            max_in_flight,
+            ordered,
+        )
+
+        sized = _is_chunk(data) or isinstance(data, (Sized, dict))
+        sizer = None
+        if adaptive and not input_split and backend != "asyncio":
+            sizer = AdaptiveBatchSizer(
+                minibatch_size,
+                target_seconds=self.target_batch_seconds,
+                max_size=int(ceil(_len_data(data) / max(1, procs))) if sized else None,
+            )
+        telemetry = self._new_telemetry(description, backend, procs)
+        if sizer is not None or telemetry is not None:
+            task = partial(run_measured, task, measure_sizes=telemetry is not None)
+        total = None
+        if sized and not input_split and sizer is None:
+            total = int(ceil(_len_data(data) / minibatch_size))
+        elif input_split and isinstance(data, Sized):
+            total = len(data)
+        rows: dict = {}
+        submitted: dict = {}
+        budget = self._memory_budget(backend)
+        inflight: dict = {}
+
+        def _params():
+            for index, data_batch in enumerate(
+                self.iter_batches(data, sizer or minibatch_size, input_split)
+            ):
+                minibatch = [data_batch] + args
+                if budget is not None:
+                    inflight[index] = estimate_nbytes(data_batch)
+                if sizer is not None:
+                    rows[index] = _len_data(data_batch)
+                    sizer.measure_payload(minibatch, rows[index])
+                if telemetry is not None:
+                    submitted[index] = time.time()
+                yield minibatch
+
+        def _completed(index, result):
+            if sizer is None and telemetry is None:
+                return result
+            result, record = result
+            if sizer is not None:
+                sizer.update(rows.pop(index), record["run_seconds"])
+            if telemetry is not None:
+                telemetry.add(index, record, submitted.pop(index))
+            return result
+
+        params = _params()
+        with tqdm(desc=description, total=total) as pbar:
+            if backend == "joblib":
+                from joblib import Parallel, delayed
+
+                if "return_as" in inspect.signature(Parallel).parameters:
+                    results = Parallel(
+                        n_jobs=procs, return_as="generator", pre_dispatch=max_in_flight
+                    )(delayed(task)(minibatch) for minibatch in params)
+                else:
+                    # joblib < 1.3 returns lists, run the minibatches in waves
+                    waves = iter(lambda: list(islice(params, max_in_flight)), [])
+                    results = chain.from_iterable(
+                        Parallel(n_jobs=procs)(delayed(task)(m) for m in wave)
+                        for wave in waves
+                    )
+                for index, result in enumerate(results):
+                    pbar.update(1)
+                    yield _completed(index, result)
+            else:
+                with self._submitter(
+                    backend, procs, backend_handle, task_num_cpus, task_num_gpus
+                ) as submit:
+                    pending: dict = {}
+                    completed: dict = {}
+                    num_submitted = num_yielded = 0
+                    exhausted = False
+                    while True:
+                        while (
+                            not exhausted
+                            and len(pending) + len(completed) < max_in_flight
+                        ):
+                            if (
+                                budget is not None
+                                and pending
+                                and budget.exceeded(sum(inflight.values()))
+                            ):
+                                # wait for completions, at least one minibatch is always in flight
+                                budget.throttle(sum(inflight.values()), len(pending))
+                                break
+                            try:
+                                minibatch = next(params)
+                            except StopIteration:
+                                exhausted = True
+                                break
+                            pending[submit(task, minibatch)] = num_submitted
+                            num_submitted += 1
+                        if not pending and not completed:
+                            break
+                        if pending:
+                            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                            for future in sorted(done, key=pending.__getitem__):
+                                index = pending.pop(future)
+                                completed[index] = _completed(index, future.result())
+                                if budget is not None:
+                                    inflight[index] = estimate_nbytes(completed[index])
+                                pbar.update(1)
+                        if ordered:
+                            while num_yielded in completed:
+                                inflight.pop(num_yielded, None)
+                                yield completed.pop(num_yielded)
+                                num_yielded += 1
+                        else:
+                            for index in sorted(completed):
+                                inflight.pop(index, None)
+                                yield completed.pop(index)
+        if telemetry is not None:
+            self._report_telemetry(telemetry)
+        if budget is not None and budget.num_throttled:
+            logger.info(
+                "%s: submission throttled %s times by the memory budget",
+                description,
+                budget.num_throttled,
+            )
+        if sizer is not None:
+            self.tuned_minibatch_size = sizer.size
+            logger.info(
+                "adaptive minibatch size: %s (set minibatch_size to %s in the joblib config to pin it)",
+                sizer.size,
+                sizer.size,
+            )
+
+    def _isolates(self, task: Callable, backend: str) -> bool:
+        """Return True if the task is to be wrapped to retry failed minibatches and isolate failing rows"""
+        policy = self.retry_policy
+        if not policy.retries and policy.on_error == "fail" or is_isolated(task):
+            return False
+        if backend == "asyncio":
+            logger.warning(
+                "retries and on_error=%s are not applied on the asyncio backend",
+                policy.on_error,
+            )
+            return False
+        return True
+
+    def _save_quarantine(self, description: str):
+        if self.last_quarantine and self.quarantine_dir:
+            path = save_quarantine(
+                self.last_quarantine, self.quarantine_dir, description
+            )
+            logger.info("saved the report of the quarantined rows to %s", path)
+
+    def _memory_budget(
+        self, backend: str, streaming: bool = True
+    ) -> Optional[MemoryBudget]:
+        if not self.max_inflight_bytes and not self.max_rss_bytes:
+            return None
+        # joblib dispatches on its own, and asyncio gathers all minibatches when not streaming
+        if backend == "joblib" or (backend == "asyncio" and not streaming):
+            logger.warning(
+                "max_inflight_bytes and max_rss_bytes are not applied on the %s backend%s",
+                backend,
+                "" if streaming else " unless streaming",
+            )
+            return None
+        return MemoryBudget(self.max_inflight_bytes, self.max_rss_bytes)
+
+    def _collect_stream(
+        self,
+        task: Callable,
+        data: Any,
+        args: List[Any],
+        budget: Optional[MemoryBudget],
+        merge_output: bool = False,
+        **kwargs,
+    ) -> Any:
+        """Collect the streamed results of the minibatches, spilling them to disk beyond the memory budget
+
+        With `merge_output`, the spilled results are merged one at a time, rather than
+        all loaded before merging.
+        """
+        if budget is None:
+            results = list(self.stream_batches(task, data, args, **kwargs))
+            if merge_output:
+                return self.merge_batches(self.collect_batches(results))
+            return results
+        spill = ResultSpill(self.spill_dir)
+        results: List[Any] = []
+        held_bytes = 0
+        try:
+            for result in self.stream_batches(task, data, args, **kwargs):
+                nbytes = estimate_nbytes(result)
+                if budget.exceeded(held_bytes + nbytes):
+                    results.append(spill.save(result, nbytes))
+                else:
+                    results.append(result)
+                    held_bytes += nbytes
+            if spill.num_spilled:
+                logger.info(
+                    "spilled %s of %s minibatch results (%s bytes) to disk",
+                    spill.num_spilled,
+                    len(results),
+                    spill.spilled_bytes,
+                )
+            if merge_output:
+                return merge_spilled(
+                    results,
+                    budget.max_inflight_bytes,
+                    load=lambda result: load_shared_result(spill.load(result)),
+                )
+            return [spill.load(result) for result in results]
+        finally:
+            spill.cleanup()
+
+    def _process_ray(
+        self,
+        task: Callable,
+        paral_params: List[Any],
+        backend_handle: Any,
+        procs: int,
+        task_num_cpus: int,
+        task_num_gpus: int,
+        description: str = "batch_apply",
+    ) -> List[Any]:
+        """Run the minibatches on Ray, keeping up to `max_in_flight` tasks submitted
+
+        The task and every minibatch are put in the object store, completions are
+        collected `procs // 2` at a time with `ray.wait`, and the results are fetched
+        with a single `ray.get` at the end.
+        """
+        ray = _ray_handle(backend_handle)
+        f_ray = _ray_task(ray, task_num_cpus, task_num_gpus)
+        max_in_flight = self.max_in_flight or 2 * max(1, procs)
+        num_returns = max(1, procs // 2)
+        task_ref = ray.put(task)
+        refs: List[Any] = []
+        pending: List[Any] = []
+        with tqdm(desc=description, total=len(paral_params)) as pbar:
+            for index in range(len(paral_params)):
+                if len(pending) >= max_in_flight:
+                    done, pending = ray.wait(
+                        pending,
+                        num_returns=min(num_returns, len(pending)),
+                        fetch_local=False,
+                    )
+                    pbar.update(len(done))
+                params_ref = ray.put(paral_params[index])
+                # drop the reference to the minibatch, the object store holds it now
+                paral_params[index] = None
+                ref = f_ray.remote(task_ref, params_ref)
+                refs.append(ref)
+                pending.append(ref)
+            while pending:
+                done, pending = ray.wait(
+                    pending,
+                    num_returns=min(num_returns, len(pending)),
+                    fetch_local=False,
+                )
+                pbar.update(len(done))
+        return ray.get(refs)
+
+    def _new_telemetry(
+        self, description: str, backend: str, procs: int
+    ) -> Optional[BatchTelemetry]:
+        if not self.telemetry:
+            return None
+        if backend == "asyncio":
+            logger.debug("minibatch telemetry is not recorded on the asyncio backend")
+            return None
+        return BatchTelemetry(description, backend, 1 if backend == "serial" else procs)
+
+    def _report_telemetry(self, telemetry: BatchTelemetry):
+        """Keep the telemetry of the run in `last_telemetry`, log it and save it in `telemetry_dir`"""
+        telemetry.finish()
+        self.last_telemetry = telemetry
+        telemetry.log()
+        if self.telemetry_dir:
+            path = telemetry.save(self.telemetry_dir)
+            logger.info("saved minibatch telemetry to %s", path)
+
+    def broadcast(self, value: Any) -> Broadcast:
+        """Broadcast a constant to the workers once, instead of with every minibatch
+
+        Arguments:
+            value (object):
+                Constant to broadcast, e.g. a lookup table, a model or a vocabulary
+
+        Returns:
+            handle (Broadcast):
+                Handle to pass in the task arguments, e.g. in the args or kwargs of Apply.
+                It is replaced with the value in the workers before the task runs.
+        """
+        handle = Broadcast(value)
+        self._add_broadcast(handle)
+        return handle
+
+    def unbroadcast(self, handle: Broadcast):
+        """Release a broadcast: it is no longer installed in new workers nor kept in this process
+
+        The persistent pool keeps running, and its workers keep the value until they exit.
+
+        Arguments:
+            handle (Broadcast):
+                Handle returned by `broadcast`
+        """
+        handle.destroy()
+
+    def clear_broadcasts(self):
+        """Release all the broadcasts of the batcher"""
+        for handle in list(self._broadcasts.values()):
+            handle.destroy()
+
+    def _add_broadcast(self, handle: Broadcast):
+        self._broadcasts[handle.key] = handle
+        self._broadcast_initargs = ({k: h.value for k, h in self._broadcasts.items()},)
+        handle.batchers.add(self)
+
+    def _remove_broadcast(self, key: str):
+        if self._broadcasts.pop(key, None) is not None:
+            self._broadcast_initargs = (
+                {k: h.value for k, h in self._broadcasts.items()},
+            )
+
+    def _bind_broadcasts(
+        self, task: Callable, args: List[Any], backend: str, backend_handle: Any
+    ):
+        """Return the task and arguments that resolve the broadcasts in the arguments on the backend"""
+        handles = list(find_broadcasts(args))
+        if not handles:
+            return task, args
+        for handle in handles:
+            if handle.key not in self._broadcasts:
+                self._add_broadcast(handle)
+        if backend in ["joblib", "p_tqdm"]:
+            # the workers of these backends cannot be initialized, send the values with every minibatch
+            return task, resolve_broadcasts(args)
+        if backend == "ray":
+            for handle in handles:
+                handle.put(_ray_handle(backend_handle))
+        return broadcast_task(task), args
+
+    def _inner_threads(self, backend: str, procs: int) -> Optional[int]:
+        """Return the BLAS and OpenMP threads per worker of a call, or None not to limit them"""
+        return resolve_inner_threads(
+            self.inner_threads, 1 if backend == "serial" else procs
+        )
+
+    def _bind_thread_limits(self, task: Callable, backend: str, procs: int) -> Callable:
+        """Return the task that limits the threads of the worker processes running it
+
+        The workers of the multiprocessing pools keep the limits, as they are not
+        shared with other work. The loky, joblib, p_tqdm and Ray workers restore them
+        after each minibatch.
+        """
+        threads = self._inner_threads(backend, procs)
+        if threads is None or backend in ["serial", "threading", "asyncio"]:
+            # the in-process backends do not run the task in worker processes
+            return task
+        if backend == "joblib" and procs <= 1:
+            # joblib runs a single job in this process
+            return task
+        return thread_limited_task(task, threads, restore=backend != "multiprocessing")
+
+    def _worker_placement(self, procs: int) -> Optional[WorkerPlacement]:
+        """Return the placement of the workers, planned for the number of workers"""
+        if self.placement is None:
+            return None
+        slots = plan_placement(self.placement, procs)
+        if self._placement is None or self._placement.slots != slots:
+            if self._placement is not None:
+                self._placement.cleanup()
+            self._placement = WorkerPlacement(slots)
+            logger.info("placing %s workers on cores %s", procs, slots)
+        return self._placement
+
+    def _bind_placement(self, task: Callable, backend: str, procs: int) -> Callable:
+        """Return the task that pins the worker processes running it, while it runs
+
+        The workers of the multiprocessing pools and the loky executor are pinned by
+        their initializer instead, as they are not shared with other work.
+        """
+        if self.placement is None or backend not in ["joblib", "p_tqdm", "ray"]:
+            return task
+        if backend == "joblib" and procs <= 1:
+            return task
+        return placed_task(task, self._worker_placement(procs))  # type: ignore
+
+    def _process_checkpointed(
+        self,
+        task: Callable,
+        batches: List[Any],
+        args: List[Any],
+        checkpoint_dir: str,
+        description: str = "batch_apply",
+        **kwargs,
+    ) -> List[Any]:
+        """Run the minibatches without a saved result, save each result, and load all results"""
+        checkpoint = BatchCheckpoint(
+            checkpoint_dir,
+            fingerprint(task, batches, args),
+            num_batches=len(batches),
+            description=description,
+        )
+        missing = checkpoint.missing()
+        if len(missing) < len(batches):
+            logger.info(
+                "resuming from checkpoint %s: %s of %s minibatches already done",
+                checkpoint.path,
+                len(batches) - len(missing),
+                len(batches),
+            )
+        if missing:
+            # save the results as they complete, so that none is lost on a crash
+            results = self.stream_batches(
+                indexed_task(task),
+                [(i, batches[i]) for i in missing],
+                args,
+                input_split=True,
+                ordered=False,
+                adaptive=False,
+                description=description,
+                **kwargs,
+            )
+            for index, result in results:
+                checkpoint.save(index, result)
+        return [checkpoint.load(i) for i in range(len(batches))]
+
+    @contextlib.contextmanager
+    def _submitter(
+        self,
+        backend: str,
+        procs: int,
+        backend_handle: Any,
+        task_num_cpus: int,
+        task_num_gpus: int,
+    ):
+        """Context manager yielding a function that submits a task and returns a future"""
+        if backend == "serial":
+            with thread_limits(self._inner_threads(backend, procs)):
+                yield _submit_serial
+        elif backend in ["multiprocessing", "p_tqdm"]:
+            with self._worker_pool(procs) as pool:
+                yield lambda task, params: _submit_to_pool(pool, task, params)
+        elif backend == "threading":
+            executor = ThreadPoolExecutor(max_workers=max(1, procs))
+            try:
+                with thread_limits(self._inner_threads(backend, procs)):
+                    yield executor.submit
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
+        elif backend == "loky":
+            yield self._loky_executor(procs).submit
+        elif backend == "asyncio":
+            event_loop = EventLoopThread(self.async_concurrency, self.async_timeout)
+            try:
+                yield event_loop.submit
+            finally:
+                event_loop.close()
+        elif backend == "ray":
+            backend_handle = _ray_handle(backend_handle)
+            f_ray = _ray_task(backend_handle, task_num_cpus, task_num_gpus)
+            task_refs: dict = {}
+
+            def _submit_ray(task, params):
+                # the task is put in the object store once, not shipped with every minibatch
+                if id(task) not in task_refs:
+                    task_refs[id(task)] = (task, backend_handle.put(task))
+                return f_ray.remote(task_refs[id(task)][1], params).future()
+
+            yield _submit_ray
+        else:
+            raise ValueError(f"Backend {backend} does not support streaming")
+
+    def start_pool(self, procs: Optional[int] = None):
+        """Start the persistent multiprocessing worker pool, or return the running one
+
+        Arguments:
+            procs (int):
+                Number of worker processes. A running pool of another size is restarted.
+
+        Returns:
+            pool (multiprocessing.pool.Pool):
+                The persistent worker pool
+        """
+        if procs is None:
+            procs = self.procs
+        procs = max(1, procs)
+        if self._pool is not None and self._pool_procs != procs:
+            logger.debug("restarting worker pool with %s processes", procs)
+            self.shutdown()
+        if self._pool is not None and not self._pool_broadcasts.issuperset(
+            self._broadcasts
+        ):
+            logger.debug("restarting worker pool to install new broadcasts")
+            self.shutdown()
+        if (
+            self._pool is not None
+            and self._pool_placement is not self._worker_placement(procs)
+        ):
+            logger.debug("restarting worker pool to place the workers")
+            self.shutdown()
+        if self._pool is None:
+            start = time.perf_counter()
+            self._pool = self._new_pool(procs)
+            self._warm_up(self._pool, procs, start)
+            self._pool_procs = procs
+            self._pool_broadcasts = frozenset(self._broadcasts)
+            self._pool_placement = self._worker_placement(procs)
+            logger.debug("started worker pool with %s processes", procs)
+        return self._pool
+
+    def shutdown(self, terminate: bool = False):
+        """Shut down the persistent worker pool
+
+        Arguments:
+            terminate (bool):
+                If True, stop the workers immediately without completing outstanding work.
+        """
+        if self._pool is None:
+            return
+        if terminate:
+            self._pool.terminate()
+        else:
+            self._pool.close()
+        self._pool.join()
+        self._pool = None
+        self._pool_procs = 0
+        self._pool_placement = None
+        if self._placement is not None:
+            self._placement.cleanup()
+            self._placement = None
+        logger.debug("shut down worker pool")
+
+    def recycle_pool(self):
+        """Restart the persistent worker pool if a worker exceeds `max_memory_per_child`"""
+        if self._pool is None or not self.max_memory_per_child:
+            return
+        for worker in list(getattr(self._pool, "_pool", [])):
+            rss = resident_memory(worker.pid)
+            if rss is not None and rss > self.max_memory_per_child:
+                logger.info(
+                    "recycling worker pool: worker %s uses %s bytes (max_memory_per_child: %s)",
+                    worker.pid,
+                    rss,
+                    self.max_memory_per_child,
+                )
+                procs = self._pool_procs
+                self.shutdown()
+                self.start_pool(procs)
+                return
+
+    def _new_pool(self, procs: int):
+        """Create a multiprocessing worker pool, installing the broadcasts in every worker"""
+        ctx = multiprocessing.get_context(self.start_method)
+        if ctx.get_start_method() == "forkserver":
+            # the worker initializer is defined in this module, so workers import it anyway
+            ctx.set_forkserver_preload([__name__] + list(self.preload_modules))
+        return ctx.Pool(
+            procs,
+            initializer=_init_worker,
+            initargs=self._broadcast_initargs
+            + (self.preload_modules, self._worker_placement(procs)),
+            maxtasksperchild=self.max_tasks_per_child,
+        )
+
+    def _warm_up(self, pool, procs: int, start: float):
+        """Wait until every worker of the persistent pool is ready
+
+        The pool is warmed up with one no-op task per worker, and the time until all
+        workers are ready is kept in `worker_startup_seconds` and logged. Pools created
+        for a single call are not warmed up, their workers start with the first minibatches.
+        """
+        pool.map(_worker_ready, range(procs), chunksize=1)
+        self.worker_startup_seconds = time.perf_counter() - start
+        logger.info(
+            "started %s %s workers in %.3fs",
+            procs,
+            multiprocessing.get_context(self.start_method).get_start_method(),
+            self.worker_startup_seconds,
+        )
+
+    def _loky_executor(self, procs: int):
+        """Return the reusable loky executor, installing the broadcasts in every worker"""
+        from loky import get_reusable_executor
+
+        if not self._broadcasts and not self.preload_modules and self.placement is None:
+            return get_reusable_executor(max_workers=max(1, procs))
+        # the same initargs object is passed until the broadcasts change, so the executor is reused
+        return get_reusable_executor(
+            max_workers=max(1, procs),
+            initializer=_init_worker,
+            initargs=self._broadcast_initargs
+            + (self.preload_modules, self._worker_placement(procs)),
+        )
+
+    @contextlib.contextmanager
+    def _worker_pool(self, procs: int):
+        """Context manager yielding the persistent worker pool, or a pool for a single call"""
+        if self.persistent_pool:
+            self.recycle_pool()
+            pool = self.start_pool(procs)
+            try:
+                yield pool
+            except (Exception, GeneratorExit):
+                raise
+            except BaseException:
+                # e.g. KeyboardInterrupt, the state of the workers is unknown
+                self.shutdown(terminate=True)
+                raise
+            return
+        pool = self._new_pool(max(1, procs))
+        try:
+            yield pool
+        except BaseException:
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+
     def __getstate__(self):
-        return dict(self.__dict__.items())
+        state = dict(self.__dict__.items())
+        state["_pool"] = None
+        state["_pool_procs"] = 0
+        state["_pool_broadcasts"] = frozenset()
+        state["_pool_placement"] = None
+        return state
 
     def __setstate__(self, params: dict):
         for key in params:
             setattr(self, key, params[key])
 
 
+def _is_chunk(data: Any) -> bool:
+    return isinstance(data, (pd.DataFrame, pd.Series, np.ndarray)) or ssp.issparse(data)
+
+
+def _len_data(data: Any) -> int:
+    return data.shape[0] if _is_chunk(data) else len(data)
+
+
+def _next_size(minibatch_size: Union[int, Callable[[], int]]) -> int:
+    return max(1, int(minibatch_size() if callable(minibatch_size) else minibatch_size))
+
+
+def _slice_batches(
+    data: Any, minibatch_size: Union[int, Callable[[], int]]
+) -> Iterator:
+    """Slice sized data into minibatches on demand"""
+    len_data = _len_data(data)
+    if isinstance(data, dict):
+        items = list(data.items())
+    start = 0
+    while start < len_data:
+        end = min(len_data, start + _next_size(minibatch_size))
+        if isinstance(data, pd.DataFrame):
+            yield data.iloc[start:end]
+        elif isinstance(data, dict):
+            yield dict(items[start:end])
+        else:
+            yield data[start:end]
+        start = end
+
+
+def _init_worker(
+    broadcast_values: dict,
+    preload_modules: Optional[List[str]] = None,
+    placement: Optional[WorkerPlacement] = None,
+):
+    """Initialize a worker: pin it, install the broadcasts and import the modules to preload"""
+    if placement is not None:
+        placement.pin()
+    install_broadcasts(broadcast_values)
+    for module in preload_modules or []:
+        importlib.import_module(module)
+
+
+def _worker_ready(_: Any) -> int:
+    return os.getpid()
+
+
+def _ray_handle(backend_handle: Any = None):
+    """Return the Ray module given as the backend handle, or import it"""
+    if backend_handle is not None:
+        return backend_handle
+    import ray  # type: ignore
+
+    return ray
+
+
+def _ray_task(ray: Any, num_cpus: int, num_gpus: int):
+    """Return the Ray remote function running a task on a minibatch"""
+
+    @ray.remote(num_cpus=num_cpus, num_gpus=num_gpus)
+    def f_ray(f, data):
+        return f(data)
+
+    return f_ray
+
+
+def _submit_serial(task: Callable, params: Any) -> Future:
+    future: Future = Future()
+    try:
+        future.set_result(task(params))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def _submit_to_pool(pool: Any, task: Callable, params: Any) -> Future:
+    future: Future = Future()
+    pool.apply_async(
+        task,
+        (params,),
+        callback=future.set_result,
+        error_callback=future.set_exception,
+    )
+    return future
+
+
 @contextlib.contextmanager
 def tqdm_joblib(tqdm_object):
     """Context manager to patch joblib to report into tqdm progress bar given as argument"""
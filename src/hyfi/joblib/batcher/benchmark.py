@@ -0,0 +1,615 @@
+"""Benchmark of the Batcher backends across operations, data types, sizes and functions"""
+
+import json
+import math
+import platform
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as ssp
+
+from hyfi.utils.logging import LOGGING
+
+from .apply import ROW_MODES, Apply
+from .apply_batch import ApplyBatch
+from .batcher import Batcher
+from .kernels import _KERNELS, kernel_key
+from .merge import merge_results
+
+logger = LOGGING.getLogger(__name__)
+
+BACKENDS = ("serial", "multiprocessing", "loky", "joblib", "p_tqdm", "ray")
+DATA_TYPES = ("list", "series", "dataframe", "ndarray", "csr")
+OPERATIONS = ("process_batches", "apply", "apply_batch")
+FUNCTIONS = ("cheap", "expensive")
+MERGE_TYPES = (
+    "list",
+    "dict",
+    "ndarray",
+    "csr",
+    "csc",
+    "series",
+    "dataframe",
+    "table",
+    "chunked_array",
+    "dataset",
+)
+
+# Iterations of busy work per row of the expensive functions
+EXPENSIVE_WORK = 200
+# Passes over each minibatch of the memory-bandwidth-bound function
+BANDWIDTH_PASSES = 8
+
+
+def make_data(data_type: str, size: int, seed: int = 0) -> Any:
+    """Make data of a type with `size` rows"""
+    rng = np.random.default_rng(seed)
+    values = rng.random(size)
+    if data_type == "list":
+        return values.tolist()
+    if data_type == "series":
+        return pd.Series(values)
+    if data_type == "dataframe":
+        return pd.DataFrame({"x": values, "y": rng.integers(0, 100, size)})
+    if data_type == "ndarray":
+        return values
+    if data_type == "csr":
+        return ssp.random(size, 100, density=0.05, format="csr", random_state=seed)
+    raise ValueError(f"data_type must be one of {DATA_TYPES}, got {data_type}")
+
+
+def _work(num_rows: int) -> float:
+    total = 0.0
+    for i in range(num_rows * EXPENSIVE_WORK):
+        total += math.sqrt(i)
+    return total
+
+
+def cheap_row(row: Any) -> Any:
+    return row
+
+
+def expensive_row(row: Any) -> Any:
+    _work(1)
+    return row
+
+
+def cheap_batch(batch: Any) -> Any:
+    return batch
+
+
+def expensive_batch(batch: Any) -> Any:
+    _work(batch.shape[0] if hasattr(batch, "shape") else len(batch))
+    return batch
+
+
+def cheap_task(params: List[Any]) -> Any:
+    return cheap_batch(params[0])
+
+
+def expensive_task(params: List[Any]) -> Any:
+    return expensive_batch(params[0])
+
+
+def bandwidth_batch(batch: np.ndarray) -> np.ndarray:
+    """Stream over a minibatch several times, bound by the memory bandwidth"""
+    total = np.zeros(batch.shape[0])
+    for _ in range(BANDWIDTH_PASSES):
+        total += (batch * 1.0001).sum(axis=1)
+    return total
+
+
+def series_row(row: pd.Series) -> float:
+    return row["x"] * row["y"]
+
+
+def namedtuple_row(row: Any) -> float:
+    return row.x * row.y
+
+
+def columns_row(x: float, y: float) -> float:
+    return x * y
+
+
+def dict_row(row: Dict[str, float]) -> float:
+    return row["x"] * row["y"]
+
+
+def weighted_sum(x: float, y: float) -> float:
+    return x * 0.5 + y * 2.0
+
+
+KERNEL_SIGNATURES = ["float64(float64, float64)"]
+
+
+_ROW_FUNCTIONS = {
+    "series": series_row,
+    "namedtuple": namedtuple_row,
+    "columns": columns_row,
+    "dict": dict_row,
+}
+
+
+_FUNCTIONS = {
+    "process_batches": {"cheap": cheap_task, "expensive": expensive_task},
+    "apply": {"cheap": cheap_row, "expensive": expensive_row},
+    "apply_batch": {"cheap": cheap_batch, "expensive": expensive_batch},
+}
+
+
+def _run(operation: str, function: str, batcher: Batcher, data: Any) -> Any:
+    func = _FUNCTIONS[operation][function]
+    if operation == "process_batches":
+        return batcher.process_batches(func, data, [], description="benchmark")
+    if operation == "apply":
+        return Apply(func, batcher, description="benchmark").transform(data)
+    return ApplyBatch(func, batcher).transform(data)
+
+
+def _new_batcher(backend: str, procs: int, minibatch_size: int) -> Optional[Batcher]:
+    backend_handle = None
+    if backend == "ray":
+        try:
+            import ray  # type: ignore
+        except ImportError:
+            logger.warning("ray is not installed, skipping the ray backend")
+            return None
+        if not ray.is_initialized():
+            ray.init(num_cpus=procs, include_dashboard=False, log_to_driver=False)
+        backend_handle = ray
+    return Batcher(
+        procs=procs,
+        minibatch_size=minibatch_size,
+        backend=backend,
+        backend_handle=backend_handle,
+        task_num_cpus=1,
+        verbose=0,
+    )
+
+
+def run_benchmark(
+    backends: Sequence[str] = BACKENDS,
+    data_types: Sequence[str] = DATA_TYPES,
+    sizes: Sequence[int] = (10_000,),
+    functions: Sequence[str] = FUNCTIONS,
+    operations: Sequence[str] = OPERATIONS,
+    procs: int = 2,
+    minibatch_size: int = 1_000,
+    repeats: int = 3,
+) -> List[Dict[str, Any]]:
+    """
+    Run the benchmark matrix, timing the best of `repeats` runs of every case.
+
+    Args:
+        backends: The backends of the Batcher.
+        data_types: The types of the data, of 'list', 'series', 'dataframe', 'ndarray' and 'csr'.
+        sizes: The numbers of rows of the data.
+        functions: 'cheap' (identity) and 'expensive' (busy work per row) functions.
+        operations: 'process_batches', 'apply' and 'apply_batch'.
+        procs: The number of workers.
+        minibatch_size: The size of the minibatches.
+        repeats: The number of runs of every case, after a warm-up run.
+
+    Returns:
+        A record per case, with the best time, the throughput in rows per second
+        and the latency in milliseconds per minibatch.
+    """
+    results = []
+    for backend in backends:
+        batcher = _new_batcher(backend, procs, minibatch_size)
+        if batcher is None:
+            continue
+        try:
+            for operation in operations:
+                for data_type in data_types:
+                    for size in sizes:
+                        data = make_data(data_type, size)
+                        num_batches = int(math.ceil(size / minibatch_size))
+                        for function in functions:
+                            _run(operation, function, batcher, data)  # warm up the pool
+                            timings = []
+                            for _ in range(max(1, repeats)):
+                                start = time.perf_counter()
+                                _run(operation, function, batcher, data)
+                                timings.append(time.perf_counter() - start)
+                            seconds = min(timings)
+                            results.append(
+                                {
+                                    "backend": backend,
+                                    "operation": operation,
+                                    "data_type": data_type,
+                                    "size": size,
+                                    "function": function,
+                                    "procs": procs,
+                                    "minibatch_size": minibatch_size,
+                                    "seconds": seconds,
+                                    "rows_per_second": (
+                                        size / seconds if seconds else None
+                                    ),
+                                    "ms_per_batch": 1000 * seconds / num_batches,
+                                }
+                            )
+                            logger.info(
+                                "%s %s %s[%s] %s: %.4fs",
+                                backend,
+                                operation,
+                                data_type,
+                                size,
+                                function,
+                                seconds,
+                            )
+        finally:
+            batcher.shutdown()
+    return results
+
+
+def run_placement_benchmark(
+    placements: Sequence[Any] = (None, "compact", "spread"),
+    backend: str = "multiprocessing",
+    procs: int = 2,
+    num_rows: int = 20_000,
+    num_columns: int = 512,
+    minibatch_size: int = 1_000,
+    repeats: int = 3,
+) -> List[Dict[str, Any]]:
+    """
+    Run a memory-bandwidth-bound `ApplyBatch` workload with each placement of the workers.
+
+    Args:
+        placements: The placements of the workers. See `Batcher`. None does not pin the workers.
+        backend: The backend of the Batcher.
+        procs: The number of workers.
+        num_rows: The number of rows of the float64 array.
+        num_columns: The number of columns of the float64 array.
+        minibatch_size: The size of the minibatches.
+        repeats: The number of runs of every placement, after a warm-up run.
+
+    Returns:
+        A record per placement, with the best time and the bandwidth in GB per second,
+        counting a read and a write of the minibatch per pass.
+    """
+    data = np.random.default_rng(0).random((num_rows, num_columns))
+    results = []
+    for placement in placements:
+        batcher = Batcher(
+            procs=procs,
+            minibatch_size=minibatch_size,
+            backend=backend,
+            placement=placement,
+            persistent_pool=True,
+        )
+        try:
+            ApplyBatch(bandwidth_batch, batcher).transform(data)  # warm up the pool
+            timings = []
+            for _ in range(max(1, repeats)):
+                start = time.perf_counter()
+                ApplyBatch(bandwidth_batch, batcher).transform(data)
+                timings.append(time.perf_counter() - start)
+        finally:
+            batcher.shutdown()
+        seconds = min(timings)
+        results.append(
+            {
+                "backend": backend,
+                "operation": "apply_batch",
+                "placement": str(placement),
+                "procs": procs,
+                "num_rows": num_rows,
+                "num_columns": num_columns,
+                "seconds": seconds,
+                "gb_per_second": 2 * BANDWIDTH_PASSES * data.nbytes / seconds / 1e9,
+            }
+        )
+        logger.info("placement %s: %.4fs", placement, seconds)
+    return results
+
+
+def run_row_mode_benchmark(
+    row_modes: Sequence[str] = ROW_MODES,
+    num_rows: int = 10_000,
+    minibatch_size: int = 1_000,
+    repeats: int = 3,
+) -> List[Dict[str, Any]]:
+    """
+    Time `Apply` on the rows of a DataFrame with each row mode, on the serial backend.
+
+    Args:
+        row_modes: The row modes. See `apply_rows`.
+        num_rows: The number of rows of the DataFrame.
+        minibatch_size: The size of the minibatches.
+        repeats: The number of runs of every row mode, after a warm-up run.
+
+    Returns:
+        A record per row mode, with the best time, the throughput in rows per second
+        and the speedup over passing a Series per row.
+    """
+    data = make_data("dataframe", num_rows)
+    batcher = Batcher(minibatch_size=minibatch_size, backend="serial", verbose=0)
+    results = []
+    for row_mode in row_modes:
+        apply = Apply(_ROW_FUNCTIONS[row_mode], batcher, row_mode=row_mode)
+        apply.transform(data)
+        timings = []
+        for _ in range(max(1, repeats)):
+            start = time.perf_counter()
+            apply.transform(data)
+            timings.append(time.perf_counter() - start)
+        seconds = min(timings)
+        results.append(
+            {
+                "operation": "apply",
+                "row_mode": row_mode,
+                "num_rows": num_rows,
+                "seconds": seconds,
+                "rows_per_second": num_rows / seconds if seconds else None,
+            }
+        )
+        logger.info("row mode %s: %.4fs", row_mode, seconds)
+    series = next((r["seconds"] for r in results if r["row_mode"] == "series"), None)
+    for result in results:
+        result["speedup"] = series / result["seconds"] if series else None
+    return results
+
+
+def run_kernel_benchmark(
+    num_rows: int = 100_000,
+    minibatch_size: int = 1_000,
+    repeats: int = 3,
+) -> List[Dict[str, Any]]:
+    """
+    Time the vectorize path of `Apply` with a cold and a warm cache of compiled ufuncs.
+
+    The cold runs remove the compiled ufunc from the cache first, so they include its
+    compilation. The warm runs reuse it.
+
+    Args:
+        num_rows: The number of rows of the data.
+        minibatch_size: The size of the minibatches.
+        repeats: The number of runs of every case.
+
+    Returns:
+        A record per case, 'cold' and 'warm', with the best time and the speedup
+        of the warm cache over the cold one. Empty if numba is not installed.
+    """
+    try:
+        import numba  # noqa: F401
+    except ImportError:
+        logger.warning("numba is not installed, skipping the kernel benchmark")
+        return []
+    rng = np.random.default_rng(0)
+    data = list(zip(rng.random(num_rows), rng.random(num_rows)))
+    batcher = Batcher(minibatch_size=minibatch_size, backend="serial", verbose=0)
+    apply = Apply(weighted_sum, batcher, vectorize=KERNEL_SIGNATURES)
+    key = kernel_key(weighted_sum, KERNEL_SIGNATURES, "cpu", False)
+    results = []
+    for cache in ("cold", "warm"):
+        timings = []
+        for _ in range(max(1, repeats)):
+            if cache == "cold":
+                _KERNELS.pop(key, None)
+            start = time.perf_counter()
+            apply.transform(data)
+            timings.append(time.perf_counter() - start)
+        seconds = min(timings)
+        results.append(
+            {
+                "operation": "apply",
+                "cache": cache,
+                "num_rows": num_rows,
+                "seconds": seconds,
+                "rows_per_second": num_rows / seconds if seconds else None,
+            }
+        )
+        logger.info("%s kernel cache: %.4fs", cache, seconds)
+    for result in results:
+        result["speedup"] = results[0]["seconds"] / result["seconds"]
+    return results
+
+
+def make_minibatches(
+    result_type: str, num_batches: int, rows: int, seed: int = 0
+) -> List[Any]:
+    """Make `num_batches` minibatch results of a type with `rows` rows each"""
+    rng = np.random.default_rng(seed)
+    arrays = [rng.random((rows, 4)) for _ in range(num_batches)]
+    if result_type == "list":
+        return [a[:, 0].tolist() for a in arrays]
+    if result_type == "dict":
+        return [
+            {i * rows + j: v for j, v in enumerate(a[:, 0])}
+            for i, a in enumerate(arrays)
+        ]
+    if result_type == "ndarray":
+        return arrays
+    if result_type in ("csr", "csc"):
+        return [ssp.random(rows, 100, density=0.05, format=result_type) for _ in arrays]
+    if result_type == "series":
+        return [pd.Series(a[:, 0]) for a in arrays]
+    if result_type == "dataframe":
+        return [pd.DataFrame(a, columns=["a", "b", "c", "d"]) for a in arrays]
+    if result_type in ("table", "chunked_array"):
+        import pyarrow as pa
+
+        if result_type == "table":
+            return [pa.table({"x": a[:, 0], "y": a[:, 1]}) for a in arrays]
+        return [pa.chunked_array([a[:, 0]]) for a in arrays]
+    if result_type == "dataset":
+        from datasets import Dataset
+
+        return [Dataset.from_dict({"x": a[:, 0], "y": a[:, 1]}) for a in arrays]
+    raise ValueError(f"result_type must be one of {MERGE_TYPES}, got {result_type}")
+
+
+def run_merge_benchmark(
+    result_types: Sequence[str] = MERGE_TYPES,
+    num_batches: int = 64,
+    rows: int = 1_000,
+    repeats: int = 3,
+) -> List[Dict[str, Any]]:
+    """
+    Time the merge of minibatch results into one instance, for each type of result.
+
+    Args:
+        result_types: The types of the results. See `MERGE_TYPES`.
+        num_batches: The number of minibatch results merged.
+        rows: The number of rows of every minibatch result.
+        repeats: The number of runs of every type.
+
+    Returns:
+        A record per type, with the best time and the throughput in rows per second.
+    """
+    results = []
+    for result_type in result_types:
+        try:
+            batches = make_minibatches(result_type, num_batches, rows)
+        except ImportError as e:
+            logger.warning("skipping the %s results: %s", result_type, e)
+            continue
+        timings = []
+        for _ in range(max(1, repeats)):
+            start = time.perf_counter()
+            merge_results(batches)
+            timings.append(time.perf_counter() - start)
+        seconds = min(timings)
+        results.append(
+            {
+                "operation": "merge",
+                "result_type": result_type,
+                "num_batches": num_batches,
+                "rows": rows,
+                "seconds": seconds,
+                "rows_per_second": num_batches * rows / seconds if seconds else None,
+            }
+        )
+        logger.info("merge %s: %.4fs", result_type, seconds)
+    return results
+
+
+def format_table(results: List[Dict[str, Any]], metric: str = "rows_per_second") -> str:
+    """Format a metric of the results as a table, with a column per backend"""
+    if not results:
+        return ""
+    table = pd.DataFrame(results).pivot_table(
+        index=["operation", "data_type", "size", "function"],
+        columns="backend",
+        values=metric,
+        sort=False,
+    )
+    return table.to_string(float_format=lambda v: f"{v:,.1f}")
+
+
+def format_placement_table(results: List[Dict[str, Any]]) -> str:
+    """Format the results of `run_placement_benchmark` as a table, with a row per placement"""
+    if not results:
+        return ""
+    table = pd.DataFrame(results).set_index("placement")
+    return table[["backend", "procs", "seconds", "gb_per_second"]].to_string(
+        float_format=lambda v: f"{v:,.3f}"
+    )
+
+
+def format_row_mode_table(results: List[Dict[str, Any]]) -> str:
+    """Format the results of `run_row_mode_benchmark` as a table, with a row per row mode"""
+    if not results:
+        return ""
+    table = pd.DataFrame(results).set_index("row_mode")
+    return table[["num_rows", "seconds", "rows_per_second", "speedup"]].to_string(
+        formatters={
+            "seconds": "{:.4f}".format,
+            "rows_per_second": "{:,.0f}".format,
+            "speedup": "{:.1f}x".format,
+        }
+    )
+
+
+def format_kernel_table(results: List[Dict[str, Any]]) -> str:
+    """Format the results of `run_kernel_benchmark` as a table, with a row per cache state"""
+    if not results:
+        return ""
+    table = pd.DataFrame(results).set_index("cache")
+    return table[["num_rows", "seconds", "rows_per_second", "speedup"]].to_string(
+        formatters={
+            "seconds": "{:.4f}".format,
+            "rows_per_second": "{:,.0f}".format,
+            "speedup": "{:.1f}x".format,
+        }
+    )
+
+
+def format_merge_table(results: List[Dict[str, Any]]) -> str:
+    """Format the results of `run_merge_benchmark` as a table, with a row per result type"""
+    if not results:
+        return ""
+    table = pd.DataFrame(results).set_index("result_type")
+    return table[["num_batches", "rows", "seconds", "rows_per_second"]].to_string(
+        formatters={"seconds": "{:.4f}".format, "rows_per_second": "{:,.0f}".format}
+    )
+
+
+def save_baseline(results: List[Dict[str, Any]], path: Union[str, Path]) -> Path:
+    """Save the results as a JSON baseline, with the versions and the platform"""
+    from hyfi._version import __version__
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    baseline = {
+        "created": datetime.now().isoformat(),
+        "hyfi_version": __version__,
+        "python_version": sys.version.split()[0],
+        "platform": platform.platform(),
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=2)
+    return path
+
+
+def compare_baseline(
+    results: List[Dict[str, Any]],
+    path: Union[str, Path],
+    tolerance: float = 0.2,
+) -> List[Dict[str, Any]]:
+    """
+    Compare the results with a JSON baseline.
+
+    Args:
+        results: The results of `run_benchmark`.
+        path: The path of the baseline saved by `save_baseline`.
+        tolerance: The fraction of the baseline throughput below which a case regressed.
+
+    Returns:
+        The cases whose throughput is below the baseline by more than the tolerance,
+        with the baseline throughput and the ratio to it.
+    """
+    with open(path) as f:
+        baseline = json.load(f)
+    keys = (
+        "backend",
+        "operation",
+        "data_type",
+        "size",
+        "function",
+        "procs",
+        "minibatch_size",
+    )
+    previous = {tuple(r.get(k) for k in keys): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        before = previous.get(tuple(result.get(k) for k in keys))
+        if not before or not before["rows_per_second"] or not result["rows_per_second"]:
+            continue
+        ratio = result["rows_per_second"] / before["rows_per_second"]
+        if ratio < 1 - tolerance:
+            regressions.append(
+                dict(
+                    result,
+                    baseline_rows_per_second=before["rows_per_second"],
+                    ratio=ratio,
+                )
+            )
+    return regressions
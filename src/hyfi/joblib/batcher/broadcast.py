@@ -0,0 +1,120 @@
+"""Constants broadcast once per worker and referenced by handles in the task arguments"""
+
+import uuid
+import weakref
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, List
+
+from hyfi.utils.logging import LOGGING
+
+logger = LOGGING.getLogger(__name__)
+
+# Values of the broadcasts installed in this process, by key
+_REGISTRY: Dict[str, Any] = {}
+
+
+class Broadcast(object):
+    """
+    A handle to a constant, e.g. a lookup table, a model or a vocabulary.
+
+    Only the key of the handle is pickled with each minibatch. The value is installed
+    once in every worker by the pool initializer, or put once in the Ray object store.
+    Handles in the task arguments are replaced with their values before the task runs.
+
+    Args:
+        value: The constant to broadcast.
+
+    Attributes:
+        key: The key of the constant.
+        ref: The Ray object reference of the constant, once put in the object store.
+        batchers: The batchers installing the constant in their workers.
+    """
+
+    def __init__(self, value: Any):
+        self.key = uuid.uuid4().hex
+        self.ref: Any = None
+        self.batchers: weakref.WeakSet = weakref.WeakSet()
+        _REGISTRY[self.key] = value
+
+    @property
+    def value(self) -> Any:
+        """The constant, fetched from the Ray object store at the first access if needed"""
+        if self.key not in _REGISTRY:
+            if self.ref is None:
+                raise KeyError(f"Broadcast {self.key} is not installed in this process")
+            import ray  # type: ignore
+
+            _REGISTRY[self.key] = ray.get(self.ref)
+        return _REGISTRY[self.key]
+
+    def put(self, backend_handle: Any):
+        """Put the constant in the Ray object store, once"""
+        if self.ref is None:
+            self.ref = backend_handle.put(self.value)
+
+    def destroy(self):
+        """Release the constant in this process, and stop installing it in new workers"""
+        for batcher in list(self.batchers):
+            batcher._remove_broadcast(self.key)
+        self.batchers = weakref.WeakSet()
+        _REGISTRY.pop(self.key, None)
+        self.ref = None
+
+    def __getstate__(self):
+        return {"key": self.key, "ref": self.ref}
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self.batchers = weakref.WeakSet()
+
+    def __repr__(self):
+        return f"Broadcast({self.key})"
+
+
+def install_broadcasts(values: Dict[str, Any]):
+    """Install the values of broadcasts in a worker. Used as the pool initializer."""
+    _REGISTRY.update(values)
+
+
+def find_broadcasts(obj: Any, depth: int = 2) -> Iterator[Broadcast]:
+    """Yield the broadcasts in the task arguments, looking into nested lists, tuples and dicts"""
+    if isinstance(obj, Broadcast):
+        yield obj
+    elif depth >= 0 and isinstance(obj, (list, tuple)):
+        for item in obj:
+            yield from find_broadcasts(item, depth - 1)
+    elif depth >= 0 and isinstance(obj, dict):
+        for item in obj.values():
+            yield from find_broadcasts(item, depth - 1)
+
+
+def resolve_broadcasts(obj: Any, depth: int = 2) -> Any:
+    """Replace the broadcasts in the task arguments with their values"""
+    if isinstance(obj, Broadcast):
+        return obj.value
+    if depth >= 0 and isinstance(obj, (list, tuple)):
+        items = [resolve_broadcasts(item, depth - 1) for item in obj]
+        return type(obj)(*items) if hasattr(obj, "_fields") else type(obj)(items)
+    if depth >= 0 and isinstance(obj, dict):
+        return {k: resolve_broadcasts(v, depth - 1) for k, v in obj.items()}
+    return obj
+
+
+def wraps_task(task: Callable, runner: Callable) -> bool:
+    """Return True if the task, or a task it wraps, is a partial of the runner"""
+    while isinstance(task, partial):
+        if task.func is runner:
+            return True
+        task = next((arg for arg in task.args if callable(arg)), None)  # type: ignore
+    return False
+
+
+def broadcast_task(task: Callable) -> Callable:
+    """Wrap a task so that the broadcasts in its arguments are replaced with their values"""
+    if wraps_task(task, run_with_broadcasts):
+        return task
+    return partial(run_with_broadcasts, task)
+
+
+def run_with_broadcasts(task: Callable, params: List[Any]) -> Any:
+    return task([params[0]] + resolve_broadcasts(list(params[1:])))
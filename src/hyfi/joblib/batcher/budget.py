@@ -0,0 +1,219 @@
+"""Memory budget of Batcher runs: throttling submission and spilling results to disk"""
+
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import uuid
+from pathlib import Path
+from typing import Any, Callable, List, Optional
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as ssp
+
+from hyfi.utils.logging import LOGGING
+
+from .merge import merge_results
+
+logger = LOGGING.getLogger(__name__)
+
+
+def resident_memory(pid: int) -> Optional[int]:
+    """Return the resident memory of a process in bytes, or None if unavailable"""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def estimate_nbytes(obj: Any) -> int:
+    """Estimate the size of a minibatch or a result in memory, without copying it"""
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        # deep, so that the strings of object columns are counted, not their pointers
+        return int(np.sum(obj.memory_usage(index=True, deep=True)))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if ssp.issparse(obj):
+        obj = obj.tocsr()
+        return obj.data.nbytes + obj.indices.nbytes + obj.indptr.nbytes
+    if isinstance(obj, (list, tuple)) and obj:
+        # extrapolate from a sample of the items
+        sample = obj[:: max(1, len(obj) // 100)]
+        return sys.getsizeof(obj) + int(
+            sum(sys.getsizeof(item) for item in sample) * len(obj) / len(sample)
+        )
+    return sys.getsizeof(obj)
+
+
+class MemoryBudget(object):
+    """
+    A memory budget, as bytes of minibatches and results in flight or a resident memory ceiling.
+
+    Args:
+        max_inflight_bytes: The maximum estimated bytes of submitted minibatches and
+            completed results that are not yet consumed.
+        max_rss_bytes: The maximum resident memory of this process in bytes.
+
+    Attributes:
+        num_throttled: The number of times submission was throttled.
+    """
+
+    def __init__(
+        self,
+        max_inflight_bytes: Optional[int] = None,
+        max_rss_bytes: Optional[int] = None,
+    ):
+        self.max_inflight_bytes = max_inflight_bytes
+        self.max_rss_bytes = max_rss_bytes
+        self.num_throttled = 0
+
+    def exceeded(self, inflight_bytes: int) -> bool:
+        """Return True if the bytes in flight or the resident memory are over the budget"""
+        if self.max_inflight_bytes and inflight_bytes > self.max_inflight_bytes:
+            return True
+        if self.max_rss_bytes:
+            rss = resident_memory(os.getpid())
+            if rss is not None and rss > self.max_rss_bytes:
+                return True
+        return False
+
+    def throttle(self, inflight_bytes: int, num_pending: int):
+        """Record that submission waits for completions, logging the first time"""
+        if self.num_throttled == 0:
+            logger.info(
+                "memory budget reached (%s bytes in flight in %s minibatches, rss %s bytes), "
+                "throttling submission",
+                inflight_bytes,
+                num_pending,
+                resident_memory(os.getpid()),
+            )
+        self.num_throttled += 1
+
+
+class SpilledResult(object):
+    """A minibatch result spilled to a pickle file, with the shape and dtype of arrays"""
+
+    def __init__(self, path: Path, shape: Optional[tuple] = None, dtype: Any = None):
+        self.path = path
+        self.shape = shape
+        self.dtype = dtype
+
+    def load(self) -> Any:
+        with open(self.path, "rb") as f:
+            result = pickle.load(f)
+        self.path.unlink()
+        return result
+
+
+class ResultSpill(object):
+    """
+    Spills minibatch results to pickle files in a temporary directory.
+
+    Args:
+        spill_dir: The directory in which the temporary directory is created.
+            Defaults to the system temporary directory.
+
+    Attributes:
+        num_spilled: The number of results spilled.
+        spilled_bytes: The estimated size of the results spilled.
+    """
+
+    def __init__(self, spill_dir: Optional[str] = None):
+        self.spill_dir = spill_dir
+        self.path: Optional[Path] = None
+        self.num_spilled = 0
+        self.spilled_bytes = 0
+
+    def save(self, result: Any, nbytes: int = 0) -> SpilledResult:
+        if self.path is None:
+            if self.spill_dir:
+                Path(self.spill_dir).mkdir(parents=True, exist_ok=True)
+            self.path = Path(tempfile.mkdtemp(prefix="hyfi-spill-", dir=self.spill_dir))
+            logger.info("spilling minibatch results to %s", self.path)
+        path = self.path / f"{uuid.uuid4().hex}.pkl"
+        with open(path, "wb") as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.num_spilled += 1
+        self.spilled_bytes += nbytes
+        if isinstance(result, np.ndarray):
+            return SpilledResult(path, result.shape, result.dtype)
+        return SpilledResult(path)
+
+    @staticmethod
+    def load(result: Any) -> Any:
+        """Load a result if it was spilled"""
+        return result.load() if isinstance(result, SpilledResult) else result
+
+    def cleanup(self):
+        if self.path is not None:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.path = None
+
+
+def merge_spilled(
+    results: List[Any],
+    max_bytes: Optional[int] = None,
+    load: Callable[[Any], Any] = ResultSpill.load,
+) -> Any:
+    """
+    Merge minibatch results, some of them spilled, loading one spilled result at a time.
+
+    Arrays are copied into a preallocated output, and lists and dicts are extended. DataFrames
+    and Series are concatenated in groups of at most `max_bytes`, and the groups once at the
+    end, so every row is copied twice at most and the loaded results are released group by
+    group. The other types are loaded at once and merged.
+
+    Args:
+        results: The results, or their spilled handles. The list is emptied as they are merged.
+        max_bytes: The bytes of results held before concatenating DataFrames and Series.
+        load: The function loading a result or its spilled handle.
+    """
+    if not results:
+        return merge_results(results)
+    first = load(results[0])
+    results[0] = first
+    if isinstance(first, np.ndarray) and first.ndim > 0:
+        shapes = [r.shape for r in results]
+        dtypes = [r.dtype for r in results]
+        if all(shape is not None for shape in shapes):
+            total = sum(shape[0] for shape in shapes)
+            out = np.empty((total,) + first.shape[1:], dtype=np.result_type(*dtypes))
+            start = 0
+            for i in range(len(results)):
+                result = load(results[i])
+                results[i] = None
+                out[start : start + result.shape[0]] = result
+                start += result.shape[0]
+            results.clear()
+            return out
+    if isinstance(first, (pd.DataFrame, pd.Series)):
+        merged: List[Any] = []
+        group: List[Any] = []
+        group_bytes = 0
+        for i in range(len(results)):
+            group.append(load(results[i]))
+            results[i] = None
+            group_bytes += estimate_nbytes(group[-1])
+            if max_bytes and group_bytes > max_bytes:
+                merged.append(pd.concat(group))
+                group, group_bytes = [], 0
+        results.clear()
+        return pd.concat(merged + group)
+    if isinstance(first, dict):
+        merged_dict: dict = {}
+        for i in range(len(results)):
+            merged_dict.update(load(results[i]))
+            results[i] = None
+        results.clear()
+        return merged_dict
+    if isinstance(first, list):
+        merged_list: List[Any] = []
+        for i in range(len(results)):
+            merged_list.extend(load(results[i]))
+            results[i] = None
+        results.clear()
+        return merged_list
+    return merge_results([load(result) for result in results])
@@ -0,0 +1,236 @@
+"""Checkpointing of minibatch results, to resume a run after a crash"""
+
+import hashlib
+import inspect
+import json
+import os
+import pickle
+from functools import partial
+from pathlib import Path
+from types import CodeType, ModuleType
+from typing import Any, Callable, List, Sequence, Set, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as ssp
+
+from .broadcast import resolve_broadcasts
+
+
+def fingerprint(task: Any, batches: Sequence[Any], args: Sequence[Any]) -> str:
+    """Return a fingerprint of the task, its arguments and the minibatches of the input
+
+    Functions are identified by their code, defaults, closures and the functions they
+    reference, and partials by their arguments, so a rerun of the same code on the same
+    data, split into the same minibatches, has the same fingerprint, and a change to
+    any of them does not reuse the results of another function.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(callable_identity(task).encode())
+    for arg in resolve_broadcasts(list(args)):
+        _update_value(h, arg, set())
+    h.update(str(len(batches)).encode())
+    for batch in batches:
+        _update_hash(h, batch)
+    return h.hexdigest()
+
+
+def callable_identity(func: Any, global_values: bool = False) -> str:
+    """Return a string identifying a function by its name and a digest of its behaviour
+
+    The digest covers the code, the defaults and the closure cells of functions, the
+    functions they reference as globals, and the arguments and keywords of partials, by
+    value. With `global_values`, the other referenced globals are hashed by value too,
+    e.g. for code that freezes them when compiled; otherwise only their names are.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    _update_callable(h, func, set(), global_values)
+    return f"{_qualified_name(func)}:{h.hexdigest()}"
+
+
+def _qualified_name(func: Any) -> str:
+    while isinstance(func, partial):
+        func = func.func
+    module = getattr(func, "__module__", None) or type(func).__module__
+    name = getattr(func, "__qualname__", None) or type(func).__qualname__
+    return f"{module}.{name}"
+
+
+def _update_callable(h: Any, func: Any, seen: Set[int], global_values: bool = False):
+    if id(func) in seen:
+        # a recursive function, or a function referenced twice
+        h.update(_qualified_name(func).encode())
+        return
+    seen.add(id(func))
+    if isinstance(func, partial):
+        h.update(b"partial")
+        _update_callable(h, func.func, seen, global_values)
+        for arg in func.args:
+            _update_value(h, arg, seen, global_values)
+        for key, value in sorted(func.keywords.items()):
+            h.update(key.encode())
+            _update_value(h, value, seen, global_values)
+        return
+    h.update(_qualified_name(func).encode())
+    if inspect.ismethod(func):
+        _update_value(h, func.__self__, seen, global_values)
+        func = func.__func__
+    code = getattr(func, "__code__", None)
+    if not isinstance(code, CodeType):
+        if not isinstance(func, type) and not inspect.isbuiltin(func):
+            # a callable object, identified by the code of its class and its state
+            _update_callable(h, type(func).__call__, seen, global_values)
+            _update_pickle(h, func)
+        return
+    _update_code(h, code)
+    _update_value(h, func.__defaults__, seen, global_values)
+    _update_value(h, func.__kwdefaults__, seen, global_values)
+    for cell in func.__closure__ or ():
+        try:
+            contents = cell.cell_contents
+        except ValueError:  # an empty cell
+            contents = None
+        _update_value(h, contents, seen, global_values)
+    namespace = getattr(func, "__globals__", {})
+    for name in _global_names(code):
+        if name not in namespace:
+            continue
+        h.update(name.encode())
+        value = namespace[name]
+        if global_values or callable(value) or isinstance(value, ModuleType):
+            _update_value(h, value, seen, global_values)
+
+
+def _update_code(h: Any, code: CodeType):
+    h.update(code.co_code)
+    h.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            _update_code(h, const)
+        elif isinstance(const, frozenset):
+            # the order of a frozenset depends on the hash seed of the process
+            h.update(repr(sorted(const, key=repr)).encode())
+        else:
+            h.update(repr(const).encode())
+
+
+def _global_names(code: CodeType) -> List[str]:
+    names = list(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            names.extend(_global_names(const))
+    return names
+
+
+def _update_value(h: Any, obj: Any, seen: Set[int], global_values: bool = False):
+    """Update the hash with a value, hashing the functions in it by their behaviour"""
+    if isinstance(obj, ModuleType):
+        h.update(obj.__name__.encode())
+    elif isinstance(obj, type):
+        h.update(_qualified_name(obj).encode())
+    elif callable(obj) and not isinstance(obj, (pd.DataFrame, pd.Series)):
+        _update_callable(h, obj, seen, global_values)
+    elif isinstance(obj, (list, tuple)) and any(callable(v) for v in obj):
+        for value in obj:
+            _update_value(h, value, seen, global_values)
+    elif isinstance(obj, dict) and any(callable(v) for v in obj.values()):
+        for key, value in obj.items():
+            _update_hash(h, key)
+            _update_value(h, value, seen, global_values)
+    else:
+        _update_hash(h, obj)
+
+
+def _update_hash(h: Any, obj: Any):
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        h.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+        h.update(pickle.dumps(list(getattr(obj, "columns", [obj.name]))))
+    elif isinstance(obj, np.ndarray) and obj.dtype.kind in "biufcmM":
+        h.update(str((obj.dtype.str, obj.shape)).encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif ssp.issparse(obj):
+        obj = obj.tocsr()
+        for array in (obj.data, obj.indices, obj.indptr):
+            h.update(np.ascontiguousarray(array).tobytes())
+    elif callable(obj) and not isinstance(obj, type):
+        h.update(callable_identity(obj).encode())
+    else:
+        _update_pickle(h, obj)
+
+
+def _update_pickle(h: Any, obj: Any):
+    try:
+        h.update(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        h.update(repr(obj).encode())
+
+
+class BatchCheckpoint(object):
+    """Persists the result of each finished minibatch as a pickle shard with a manifest
+
+    Args:
+        checkpoint_dir: The directory holding the checkpoints of all runs.
+        fingerprint: The fingerprint of the run, naming its subdirectory.
+        num_batches: The number of minibatches of the run.
+        description: The description of the run, recorded in the manifest.
+    """
+
+    def __init__(
+        self,
+        checkpoint_dir: Union[str, Path],
+        fingerprint: str,
+        num_batches: int,
+        description: str = "",
+    ):
+        self.path = Path(checkpoint_dir) / fingerprint
+        self.num_batches = num_batches
+        self.path.mkdir(parents=True, exist_ok=True)
+        manifest = self.path / "manifest.json"
+        if not manifest.exists():
+            self._write(
+                manifest,
+                json.dumps(
+                    {
+                        "fingerprint": fingerprint,
+                        "num_batches": num_batches,
+                        "description": description,
+                    },
+                    indent=2,
+                ).encode(),
+            )
+
+    def shard_path(self, index: int) -> Path:
+        return self.path / f"batch-{index:06d}.pkl"
+
+    def missing(self) -> List[int]:
+        """Return the indices of the minibatches without a saved result"""
+        return [i for i in range(self.num_batches) if not self.shard_path(i).exists()]
+
+    def save(self, index: int, result: Any):
+        """Save the result of a minibatch atomically"""
+        self._write(
+            self.shard_path(index),
+            pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL),
+        )
+
+    def load(self, index: int) -> Any:
+        """Load the saved result of a minibatch"""
+        with open(self.shard_path(index), "rb") as f:
+            return pickle.load(f)
+
+    @staticmethod
+    def _write(path: Path, content: bytes):
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+
+def indexed_task(task: Callable) -> Callable:
+    """Wrap a task to run on an (index, minibatch) pair and return the index with the result"""
+    return partial(run_indexed, task)
+
+
+def run_indexed(task: Callable, params: List[Any]) -> Tuple[int, Any]:
+    index, batch = params[0]
+    return index, task([batch] + list(params[1:]))
@@ -0,0 +1,66 @@
+"""Cache of numba ufuncs compiled for the vectorize path of Apply"""
+
+import threading
+from typing import Any, Callable, Dict, Tuple
+
+from hyfi.utils.logging import LOGGING
+
+from .checkpoint import callable_identity
+
+logger = LOGGING.getLogger(__name__)
+
+VECTORIZE_TARGETS = ("cpu", "parallel")
+
+_KERNELS: Dict[Tuple, Callable] = {}
+_LOCK = threading.Lock()
+
+
+def kernel_key(func: Callable, signatures: Any, target: str, cache: bool) -> Tuple:
+    """Return the key of a compiled ufunc: the function identity, the signatures and options
+
+    The identity covers the code, the closure cells and the referenced globals of the
+    function by value, as numba freezes them into the compiled code.
+    """
+    if isinstance(signatures, (list, tuple)):
+        signatures = tuple(str(s) for s in signatures)
+    else:
+        signatures = str(signatures)
+    return (callable_identity(func, global_values=True), signatures, target, cache)
+
+
+def compile_vectorized(
+    func: Callable,
+    signatures: Any,
+    target: str = "cpu",
+    cache: bool = False,
+) -> Callable:
+    """
+    Returns the ufunc compiled from a function with `numba.vectorize`, compiling it once per process.
+
+    Args:
+        func: The function to compile.
+        signatures: The signature or list of signatures to compile, e.g. ["float64(float64, float64)"].
+        target: 'cpu' for a single thread or 'parallel' for multiple threads.
+        cache: Whether numba also caches the compiled code on disk, so that other processes
+            and later runs load it instead of compiling it again.
+
+    Returns:
+        The compiled ufunc.
+    """
+    if target not in VECTORIZE_TARGETS:
+        raise ValueError(f"target must be one of {VECTORIZE_TARGETS}, got {target}")
+    key = kernel_key(func, signatures, target, cache)
+    kernel = _KERNELS.get(key)
+    if kernel is not None:
+        return kernel
+    with _LOCK:
+        kernel = _KERNELS.get(key)
+        if kernel is None:
+            from numba import vectorize
+
+            logger.debug("compiling %s for %s (target=%s)", key[0], key[1], target)
+            kernel = vectorize(signatures, target=target, cache=cache, fastmath=True)(
+                func
+            )
+            _KERNELS[key] = kernel
+    return kernel
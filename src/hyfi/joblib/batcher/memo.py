@@ -0,0 +1,135 @@
+"""Memoization of function results across minibatches, worker processes and runs"""
+
+import hashlib
+import pickle
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from hyfi.utils.logging import LOGGING
+
+logger = LOGGING.getLogger(__name__)
+
+
+def deduplicate(data: Any) -> Optional[Tuple[List[Any], np.ndarray]]:
+    """Return the unique values of the data and the index of each value among them
+
+    Returns None if the data is not a one-dimensional sequence of hashable values.
+    """
+    if isinstance(data, pd.Series):
+        values = data
+    elif isinstance(data, (list, tuple)) or (
+        isinstance(data, np.ndarray) and data.ndim == 1
+    ):
+        values = pd.Series(data, dtype=object)
+    else:
+        return None
+    try:
+        codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    except TypeError:  # unhashable values
+        return None
+    return list(uniques), codes
+
+
+def expand(data: Any, unique_results: Sequence[Any], codes: np.ndarray) -> Any:
+    """Expand the results of the unique values back to the shape of the data"""
+    results = np.empty(len(unique_results), dtype=object)
+    for i, result in enumerate(unique_results):
+        results[i] = result
+    results = results[codes].tolist()
+    if isinstance(data, pd.Series):
+        return pd.Series(results, index=data.index, name=data.name)
+    return results
+
+
+class MemoStore(object):
+    """A disk-backed store of function results, evicting the least recently used
+
+    Results are pickled into a SQLite database, so they persist between runs.
+    When the total size of the pickled results exceeds `max_bytes`, the least
+    recently read or written results are evicted.
+
+    Args:
+        memo_dir: The directory of the database.
+        namespace: The prefix of all keys, identifying the function and its arguments.
+        max_bytes: The maximum total size of the pickled results in bytes.
+    """
+
+    def __init__(
+        self,
+        memo_dir: Union[str, Path],
+        namespace: str = "",
+        max_bytes: int = 1024 * 1024 * 1024,
+    ):
+        Path(memo_dir).mkdir(parents=True, exist_ok=True)
+        self.path = Path(memo_dir) / "memo.sqlite"
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS memo "
+                "(key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS memo_accessed ON memo(accessed)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=60)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def key(self, value: Any) -> str:
+        h = hashlib.blake2b(self.namespace.encode(), digest_size=16)
+        h.update(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        return h.hexdigest()
+
+    def get_many(self, values: Sequence[Any]) -> Dict[int, Any]:
+        """Return the stored results of the values, by position of the value"""
+        keys = [self.key(v) for v in values]
+        positions = {k: i for i, k in enumerate(keys)}
+        found: Dict[int, Any] = {}
+        with self._connect() as conn:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start : start + 500]
+                rows = conn.execute(
+                    f"SELECT key, value FROM memo WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                for key, value in rows:
+                    found[positions[key]] = pickle.loads(value)
+                conn.executemany(
+                    "UPDATE memo SET accessed = ? WHERE key = ?",
+                    [(time.time(), key) for key, _ in rows],
+                )
+        return found
+
+    def set_many(self, values: Sequence[Any], results: Sequence[Any]):
+        """Store the results of the values and evict the least recently used results"""
+        now = time.time()
+        rows = []
+        for value, result in zip(values, results):
+            blob = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+            rows.append((self.key(value), blob, len(blob), now))
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO memo (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM memo").fetchone()[0]
+        excess = total - self.max_bytes
+        if excess <= 0:
+            return
+        evicted = []
+        for key, size in conn.execute("SELECT key, size FROM memo ORDER BY accessed"):
+            if excess <= 0:
+                break
+            evicted.append((key,))
+            excess -= size
+        conn.executemany("DELETE FROM memo WHERE key = ?", evicted)
+        logger.debug("evicted %s results from %s", len(evicted), self.path)
@@ -0,0 +1,73 @@
+"""Type-aware merging of minibatch results"""
+
+from itertools import chain
+from typing import Any, List, Sequence
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as ssp
+
+
+def merge_results(data: Sequence[Any]) -> Any:
+    """Merge a list of minibatch results into one instance of the same type
+
+    Arguments:
+        data (list):
+            List of minibatch results. All results are expected to be of the type of the first one.
+
+    Returns:
+        data (list, numpy.ndarray, scipy.sparse matrix, pandas.DataFrame, pandas.Series,
+            pyarrow.Table, pyarrow.ChunkedArray, datasets.Dataset, dict):
+            Single instance merged from the given results. Lists, tuples and other
+            iterables are flattened into a list.
+    """
+    if len(data) == 0:
+        return []
+    first = data[0]
+    if ssp.issparse(first):
+        return ssp.vstack(data, format=first.format)
+    if isinstance(first, (pd.DataFrame, pd.Series)):
+        return pd.concat(data)
+    if isinstance(first, np.ndarray):
+        return concatenate_arrays(data)
+    if isinstance(first, np.generic):
+        return np.asarray(data)
+    module = type(first).__module__.split(".")[0]
+    if module == "pyarrow":
+        return _merge_arrow(data)
+    if module == "datasets":
+        from datasets import concatenate_datasets
+
+        return concatenate_datasets(list(data))
+    if isinstance(first, dict):
+        return {k: v for batch in data for k, v in batch.items()}
+    return list(chain.from_iterable(data))
+
+
+def concatenate_arrays(arrays: Sequence[np.ndarray]) -> np.ndarray:
+    """Concatenate arrays along the first axis into a single preallocated output"""
+    if arrays[0].ndim == 0:
+        return np.stack(arrays)
+    total = sum(a.shape[0] for a in arrays)
+    out = np.empty((total,) + arrays[0].shape[1:], dtype=np.result_type(*arrays))
+    start = 0
+    for a in arrays:
+        out[start : start + a.shape[0]] = a
+        start += a.shape[0]
+    return out
+
+
+def _merge_arrow(data: Sequence[Any]) -> Any:
+    import pyarrow as pa
+
+    first = data[0]
+    if isinstance(first, pa.Table):
+        return pa.concat_tables(data)
+    if isinstance(first, pa.RecordBatch):
+        return pa.Table.from_batches(data)
+    if isinstance(first, pa.ChunkedArray):
+        chunks: List[Any] = [chunk for array in data for chunk in array.chunks]
+        return pa.chunked_array(chunks, type=first.type)
+    if isinstance(first, pa.Array):
+        return pa.chunked_array(data, type=first.type)
+    return list(chain.from_iterable(data))
@@ -0,0 +1,289 @@
+"""Retries of failed minibatches, and bisection of failing minibatches to quarantine bad rows"""
+
+import json
+import os
+import re
+import time
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as ssp
+
+from hyfi.utils.logging import LOGGING
+
+from .merge import merge_results
+
+logger = LOGGING.getLogger(__name__)
+
+ERROR_POLICIES = ("fail", "skip", "default")
+
+
+class RetryPolicy(object):
+    """
+    How failed minibatches are retried, and how the rows failing them are handled.
+
+    A failed minibatch is retried up to `retries` times, waiting `backoff` seconds
+    before the first retry and doubling the wait before each next one. If it still fails,
+    then with the 'skip' and 'default' policies, the minibatch is bisected until the rows
+    failing it are isolated, and the rest of the rows are processed.
+
+    Args:
+        retries: The number of retries of a failed minibatch.
+        backoff: The wait before the first retry in seconds.
+        on_error: What to do with the rows failing the task after the retries.
+            - 'fail': raise the error of the minibatch.
+            - 'skip': leave the rows out of the results.
+            - 'default': substitute `default` for the result of each row.
+        default: The result substituted for the failing rows with the 'default' policy.
+    """
+
+    def __init__(
+        self,
+        retries: int = 0,
+        backoff: float = 0.5,
+        on_error: str = "fail",
+        default: Any = None,
+    ):
+        if on_error not in ERROR_POLICIES:
+            raise ValueError(
+                f"on_error must be one of {ERROR_POLICIES}, got {on_error}"
+            )
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self.on_error = on_error
+        self.default = default
+
+    def __repr__(self):
+        return (
+            f"RetryPolicy(retries={self.retries}, backoff={self.backoff}, "
+            f"on_error={self.on_error})"
+        )
+
+
+class IsolatedResult(object):
+    """The result of a minibatch with the rows quarantined while computing it"""
+
+    def __init__(self, result: Any, quarantined: List[Dict[str, Any]], num_rows: int):
+        self.result = result
+        self.quarantined = quarantined
+        self.num_rows = num_rows
+
+
+def isolated_task(task: Callable, policy: RetryPolicy) -> Callable:
+    """Wrap a task so that failed minibatches are retried and their failing rows quarantined"""
+    return partial(run_isolated, task, policy)
+
+
+def is_isolated(task: Callable) -> bool:
+    """Return True if the task, or a task it wraps, is already isolated"""
+    while isinstance(task, partial):
+        if task.func is run_isolated:
+            return True
+        task = next((arg for arg in task.args if callable(arg)), None)  # type: ignore
+    return False
+
+
+def run_isolated(
+    task: Callable, policy: RetryPolicy, params: List[Any]
+) -> IsolatedResult:
+    batch = params[0]
+    num_rows = _num_rows(batch)
+    for attempt in range(policy.retries + 1):
+        try:
+            return IsolatedResult(task(params), [], num_rows)
+        except Exception as e:
+            error = e
+            if attempt < policy.retries:
+                logger.warning(
+                    "minibatch of %s rows failed (%r), retry %s of %s",
+                    num_rows,
+                    e,
+                    attempt + 1,
+                    policy.retries,
+                )
+                time.sleep(policy.backoff * 2**attempt)
+    if policy.on_error == "fail" or num_rows is None:
+        raise error
+    quarantined: List[Dict[str, Any]] = []
+    parts = _bisect(task, params, policy, 0, num_rows, error, quarantined)
+    like = next((part for part in parts if not isinstance(part, _FailedRow)), None)
+    parts = [
+        (
+            _default_rows(part.batch, policy.default, like)
+            if isinstance(part, _FailedRow)
+            else part
+        )
+        for part in parts
+    ]
+    return IsolatedResult(
+        merge_results(parts) if parts else None, quarantined, num_rows
+    )
+
+
+def _bisect(
+    task: Callable,
+    params: List[Any],
+    policy: RetryPolicy,
+    offset: int,
+    num_rows: int,
+    error: Exception,
+    quarantined: List[Dict[str, Any]],
+) -> List[Any]:
+    """
+    Split a failing minibatch in halves, run each, and recurse into the failing halves.
+
+    Returns the results of the halves in order, with a `_FailedRow` in place of every
+    failing row to substitute, as the type of the default depends on the other results.
+    """
+    batch = params[0]
+    if num_rows == 1:
+        quarantined.append(_quarantine_entry(batch, offset, error))
+        if policy.on_error == "skip":
+            return []
+        return [_FailedRow(batch)]
+    parts: List[Any] = []
+    middle = num_rows // 2
+    for start, stop in ((0, middle), (middle, num_rows)):
+        half = [_slice(batch, start, stop)] + list(params[1:])
+        try:
+            parts.append(task(half))
+        except Exception as e:
+            parts.extend(
+                _bisect(
+                    task, half, policy, offset + start, stop - start, e, quarantined
+                )
+            )
+    return parts
+
+
+class _FailedRow(object):
+    """A failing row of a minibatch, substituted with the default once all rows are run"""
+
+    def __init__(self, batch: Any):
+        self.batch = batch
+
+
+def _num_rows(batch: Any) -> Optional[int]:
+    if isinstance(batch, (pd.DataFrame, pd.Series, np.ndarray)) or ssp.issparse(batch):
+        return batch.shape[0]
+    if isinstance(batch, (list, tuple, dict)):
+        return len(batch)
+    return None
+
+
+def _slice(batch: Any, start: int, stop: int) -> Any:
+    if isinstance(batch, (pd.DataFrame, pd.Series)):
+        return batch.iloc[start:stop]
+    if isinstance(batch, dict):
+        return dict(list(batch.items())[start:stop])
+    return batch[start:stop]
+
+
+def _default_rows(batch: Any, default: Any, like: Any = None) -> Any:
+    """The default in place of a failing row, of the type of the results `like` it"""
+    index = batch.index if isinstance(batch, (pd.DataFrame, pd.Series)) else None
+    if isinstance(like, pd.DataFrame):
+        return pd.DataFrame(
+            default, index=index if index is not None else [0], columns=like.columns
+        )
+    if isinstance(like, pd.Series):
+        return pd.Series([default], index=index, name=like.name)
+    if isinstance(like, np.ndarray) and like.ndim > 0:
+        return np.full((1,) + like.shape[1:], default)
+    if isinstance(like, dict) and isinstance(batch, dict):
+        return {key: default for key in batch}
+    if like is None and index is not None:
+        return pd.Series([default], index=index)
+    if like is None and isinstance(batch, np.ndarray):
+        return np.asarray([default])
+    return [default]
+
+
+def _quarantine_entry(batch: Any, offset: int, error: Exception) -> Dict[str, Any]:
+    entry: Dict[str, Any] = {"row": offset, "error": repr(error)}
+    if isinstance(batch, (pd.DataFrame, pd.Series)):
+        entry["index"] = batch.index[0]
+        value = batch.iloc[0]
+    elif isinstance(batch, dict):
+        entry["index"], value = next(iter(batch.items()))
+    else:
+        value = batch[0]
+    entry["value"] = repr(value)[:200]
+    return entry
+
+
+def unwrap_isolated(
+    results: List[Any], description: str = "batch_apply"
+) -> Tuple[List[Any], List[Dict[str, Any]]]:
+    """
+    Unwrap the results of isolated minibatches.
+
+    Returns:
+        The results of the minibatches, with the failing rows skipped or substituted,
+        and the quarantined rows, with the index of their minibatch and their position in the data.
+    """
+    unwrapped = []
+    quarantined = []
+    position = 0
+    for index, result in enumerate(results):
+        if not isinstance(result, IsolatedResult):
+            unwrapped.append(result)
+            continue
+        for entry in result.quarantined:
+            entry = dict(entry, batch=index, position=position + entry["row"])
+            quarantined.append(entry)
+        if result.result is not None:
+            unwrapped.append(result.result)
+        position += result.num_rows or 0
+    if quarantined:
+        logger.warning(
+            "%s: quarantined %s rows, e.g. row %s: %s",
+            description,
+            len(quarantined),
+            quarantined[0]["position"],
+            quarantined[0]["error"],
+        )
+    return unwrapped, quarantined
+
+
+def unwrap_isolated_stream(
+    results: Iterable[Any], quarantined: List[Dict[str, Any]]
+) -> Iterator[Any]:
+    """
+    Unwrap the results of isolated minibatches as they are streamed.
+
+    The quarantined rows are appended to `quarantined`, with the index of their
+    minibatch and their position, in the order the results are streamed.
+    """
+    position = 0
+    for index, result in enumerate(results):
+        if not isinstance(result, IsolatedResult):
+            yield result
+            continue
+        for entry in result.quarantined:
+            quarantined.append(
+                dict(entry, batch=index, position=position + entry["row"])
+            )
+        position += result.num_rows or 0
+        if result.result is not None:
+            yield result.result
+
+
+def save_quarantine(
+    quarantined: List[Dict[str, Any]],
+    quarantine_dir: Union[str, Path],
+    description: str = "batch_apply",
+) -> Path:
+    """Save the report of the quarantined rows as JSON in the directory and return its path"""
+    quarantine_dir = Path(quarantine_dir)
+    quarantine_dir.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    name = re.sub(r"[^\w.-]+", "_", description)
+    path = quarantine_dir / f"quarantine-{name}-{stamp}-{os.getpid()}.json"
+    with open(path, "w") as f:
+        json.dump(quarantined, f, indent=2, default=str)
+    return path
@@ -0,0 +1,116 @@
+"""Guided and dynamic scheduling of minibatches, balanced by row count or by cost"""
+
+from math import ceil
+from typing import Any, Callable, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+SCHEDULES = ("static", "dynamic", "guided")
+
+
+def row_costs(data: Any, cost: Union[str, Callable[[Any], Any]]) -> np.ndarray:
+    """
+    Returns the cost of every row of the data.
+
+    Args:
+        data: The data to split into minibatches.
+        cost: A column of the DataFrame holding the cost of every row, or a function of
+            the data returning the cost of every row, e.g. `lambda df: df.text.str.len()`.
+
+    Returns:
+        A float array of the non-negative cost of every row.
+    """
+    if callable(cost):
+        costs = cost(data)
+    elif isinstance(data, pd.DataFrame):
+        costs = data[cost]
+    else:
+        raise ValueError(f"cost must be a function for {type(data).__name__} data")
+    costs = np.asarray(costs, dtype=float)
+    if costs.shape != (len(data),):
+        raise ValueError(
+            f"expected {len(data)} row costs, got an array of shape {costs.shape}"
+        )
+    return np.clip(np.nan_to_num(costs), 0, None)
+
+
+def plan_chunks(
+    num_rows: int,
+    procs: int,
+    minibatch_size: int,
+    schedule: str = "guided",
+    costs: Optional[np.ndarray] = None,
+    min_chunk_size: int = 1,
+) -> List[int]:
+    """
+    Plans the sizes of the minibatches of a schedule.
+
+    - 'static' and 'dynamic': `ceil(num_rows / minibatch_size)` minibatches, of equal row
+      counts, or of equal total cost when costs are given, splitting the cheap ones of
+      more than `minibatch_size` rows. With 'dynamic', the minibatches are handed out to
+      the workers on demand.
+    - 'guided': minibatches holding half of the remaining rows (or cost) over the number
+      of workers, at most `minibatch_size` and at least `min_chunk_size` rows. The sizes
+      decrease toward the end, so the last minibatches finish together.
+
+    Args:
+        num_rows: The number of rows of the data.
+        procs: The number of workers.
+        minibatch_size: The maximum number of rows of a minibatch.
+        schedule: One of 'static', 'dynamic' or 'guided'.
+        costs: The cost of every row.
+        min_chunk_size: The minimum number of rows of a guided minibatch.
+
+    Returns:
+        The number of rows of every minibatch, in order.
+    """
+    if schedule not in SCHEDULES:
+        raise ValueError(f"schedule must be one of {SCHEDULES}, got {schedule}")
+    if num_rows == 0:
+        return []
+    minibatch_size = max(1, minibatch_size)
+    procs = max(1, procs)
+    if costs is None:
+        costs = np.ones(num_rows)
+    cumulative = np.cumsum(costs)
+    total = cumulative[-1]
+    if total <= 0:
+        costs, cumulative, total = None, np.arange(1, num_rows + 1), num_rows
+
+    if schedule in ("static", "dynamic"):
+        num_chunks = int(ceil(num_rows / minibatch_size))
+        targets = total * np.arange(1, num_chunks) / num_chunks
+        ends = np.searchsorted(cumulative, targets, side="left") + 1
+        ends = np.append(ends, num_rows)
+        return _capped(_sizes(ends), minibatch_size)
+
+    ends = []
+    start = 0
+    min_chunk_size = max(1, min(min_chunk_size, minibatch_size))
+    while start < num_rows:
+        done = cumulative[start - 1] if start else 0.0
+        target = done + (total - done) / (2 * procs)
+        end = int(np.searchsorted(cumulative, target, side="left")) + 1
+        end = min(max(end, start + min_chunk_size), start + minibatch_size, num_rows)
+        ends.append(end)
+        start = end
+    return _sizes(np.asarray(ends))
+
+
+def _sizes(ends: np.ndarray) -> List[int]:
+    ends = np.maximum.accumulate(np.asarray(ends, dtype=int))
+    sizes = np.diff(np.concatenate([[0], ends]))
+    return [int(size) for size in sizes if size > 0]
+
+
+def _capped(sizes: List[int], minibatch_size: int) -> List[int]:
+    """Split the minibatches of more than `minibatch_size` rows into even ones"""
+    capped = []
+    for size in sizes:
+        num_splits = int(ceil(size / minibatch_size))
+        capped.extend(
+            size // num_splits + (1 if i < size % num_splits else 0)
+            for i in range(num_splits)
+        )
+    return capped
@@ -0,0 +1,328 @@
+"""Shared-memory transport for minibatches of DataFrames, Series and ndarrays
+
+Numeric data is copied once into `multiprocessing.shared_memory` blocks, and workers
+receive only small descriptors holding the block name and the (offset, length) of their
+minibatch, from which they rebuild zero-copy, read-only views.
+Numeric results are sent back the same way, in blocks named after the minibatch, so
+that the parent releases the blocks of the results it did not load, e.g. after an error.
+"""
+
+import os
+from functools import partial
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from hyfi.utils.logging import LOGGING
+
+logger = LOGGING.getLogger(__name__)
+
+_NUMERIC_KINDS = "biufc"
+_ALIGNMENT = 64
+# The process that started its own resource tracker when attaching to a block
+_TRACKER_OWNER: Optional[int] = None
+
+
+def is_numeric_dtype(dtype: Any) -> bool:
+    """Return True if the dtype is a plain numpy numeric (or boolean) dtype"""
+    return isinstance(dtype, np.dtype) and dtype.kind in _NUMERIC_KINDS
+
+
+def supports_shared_memory(data: Any) -> bool:
+    """Return True if the data has numeric buffers that can be shared"""
+    if isinstance(data, np.ndarray):
+        return is_numeric_dtype(data.dtype)
+    if isinstance(data, pd.Series):
+        return is_numeric_dtype(data.dtype)
+    if isinstance(data, pd.DataFrame):
+        return any(is_numeric_dtype(dtype) for dtype in data.dtypes)
+    return False
+
+
+class SharedSlice:
+    """Descriptor of a minibatch of data stored in shared memory
+
+    Attributes:
+        name (str): Name of the shared memory block
+        kind (str): One of 'ndarray', 'series' or 'dataframe'
+        layout (list): Tuples of (column, dtype, shape, offset) of the arrays in the block
+        start (int): Offset of the first row of the minibatch
+        end (int): Offset after the last row of the minibatch
+        extra (Any): Data that is not shared, e.g. the index and non-numeric columns of the minibatch
+    """
+
+    def __init__(
+        self,
+        name: str,
+        kind: str,
+        layout: List[Tuple[Any, str, Tuple[int, ...], int]],
+        start: int,
+        end: int,
+        extra: Any = None,
+    ):
+        self.name = name
+        self.kind = kind
+        self.layout = layout
+        self.start = start
+        self.end = end
+        self.extra = extra
+
+    def __len__(self):
+        return self.end - self.start
+
+    def load(self, shm: shared_memory.SharedMemory) -> Any:
+        """Rebuild the minibatch as read-only views on the attached shared memory block"""
+        arrays = {}
+        for column, dtype, shape, offset in self.layout:
+            # frombuffer holds an export of the buffer, so the block cannot be closed under the views
+            array = np.frombuffer(
+                shm.buf, dtype=np.dtype(dtype), count=int(np.prod(shape)), offset=offset
+            ).reshape(shape)
+            array = array[self.start : self.end]
+            array.flags.writeable = False
+            arrays[column] = array
+        return _build(self.kind, arrays, self.extra)
+
+
+class SharedResult(SharedSlice):
+    """Descriptor of a minibatch result written by a worker into shared memory"""
+
+    def load(self) -> Any:  # type: ignore
+        """Copy the result out of shared memory and release the block"""
+        shm = shared_memory.SharedMemory(name=self.name)
+        try:
+            arrays = {}
+            for column, dtype, shape, offset in self.layout:
+                arrays[column] = np.ndarray(
+                    shape, dtype=np.dtype(dtype), buffer=shm.buf, offset=offset
+                ).copy()
+            return _build(self.kind, arrays, self.extra)
+        finally:
+            shm.close()
+            shm.unlink()
+
+
+class SharedData:
+    """Context manager that copies the numeric buffers of the data into shared memory once
+
+    Arguments:
+        data (numpy.ndarray, pandas.Series, pandas.DataFrame):
+            Data to share with the workers
+    """
+
+    def __init__(self, data: Any):
+        self.data = data
+        self.shm: Optional[shared_memory.SharedMemory] = None
+        self.starts: List[int] = []
+        self.kind, arrays, self.extra = _decompose(data)
+        self.shm, self.layout = _write_arrays(arrays)
+        logger.debug(
+            "copied %s arrays (%s bytes) into shared memory %s",
+            len(self.layout),
+            self.shm.size,
+            self.shm.name,
+        )
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def slice(self, start: int, end: int) -> SharedSlice:
+        """Return the descriptor of the rows from start to end"""
+        extra = self.extra
+        if self.kind == "series":
+            extra = (extra[0][start:end], extra[1])
+        elif self.kind == "dataframe":
+            index, columns, others = extra
+            extra = (index[start:end], columns, others.iloc[start:end])
+        self.starts.append(start)
+        return SharedSlice(self.shm.name, self.kind, self.layout, start, end, extra)  # type: ignore
+
+    def split(self, minibatch_size: int) -> List[SharedSlice]:
+        """Return the descriptors of the minibatches of the data"""
+        return [
+            self.slice(start, min(len(self), start + minibatch_size))
+            for start in range(0, len(self), minibatch_size)
+        ]
+
+    def unlink(self):
+        """Release the shared memory block, and the blocks of the results not loaded"""
+        if self.shm is None:
+            return
+        name = self.shm.name
+        self.shm.close()
+        # the workers check that the block exists after writing a result, so a result is
+        # either released here or by its worker
+        self.shm.unlink()
+        self.shm = None
+        num_released = 0
+        for start in self.starts:
+            try:
+                result_shm = shared_memory.SharedMemory(name=_result_name(name, start))
+            except FileNotFoundError:
+                continue
+            result_shm.close()
+            result_shm.unlink()
+            num_released += 1
+        if num_released:
+            logger.debug(
+                "released %s shared results that were not loaded", num_released
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.unlink()
+
+
+def shared_task(task: Callable) -> Callable:
+    """Wrap a task so that it accepts and returns shared memory descriptors"""
+    return partial(run_shared_task, task)
+
+
+def run_shared_task(task: Callable, params: List[Any]) -> Any:
+    """Attach to the shared minibatch, run the task and share its result if numeric"""
+    descriptor = params[0]
+    if not isinstance(descriptor, SharedSlice):
+        return task(params)
+    shm = _attach(descriptor.name)
+    try:
+        result = task([descriptor.load(shm)] + list(params[1:]))
+        if supports_shared_memory(result):
+            kind, arrays, extra = _decompose(result)
+            if kind != "dataframe" or extra[2].shape[1] == 0:
+                name = _result_name(descriptor.name, descriptor.start)
+                try:
+                    result_shm, layout = _write_arrays(arrays, name=name)
+                except FileExistsError:
+                    # the minibatch was already run, e.g. by a worker that crashed
+                    return result
+                if not _exists(descriptor.name):
+                    # the parent released the data, e.g. after an error, and will not load it
+                    result_shm.close()
+                    result_shm.unlink()
+                    return None
+                # the parent process takes over the ownership of the block
+                resource_tracker.unregister(result_shm._name, "shared_memory")  # type: ignore
+                result_shm.close()
+                size = result.shape[0]
+                result = SharedResult(result_shm.name, kind, layout, 0, size, extra)
+        return result
+    finally:
+        _detach(shm)
+
+
+def load_shared_result(result: Any) -> Any:
+    """Materialize a result returned as a shared memory descriptor"""
+    return result.load() if isinstance(result, SharedResult) else result
+
+
+def load_shared_results(results: List[Any]) -> List[Any]:
+    """Materialize the results returned as shared memory descriptors"""
+    return [load_shared_result(x) for x in results]
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """Attach to a block owned by the parent, unregistering it from the resource tracker
+
+    Otherwise, a worker with its own resource tracker, e.g. a loky worker, would unlink
+    the block when it exits. The workers of multiprocessing share the tracker of the
+    parent instead, which keeps the block registered until the parent unlinks it.
+    """
+    global _TRACKER_OWNER
+    if resource_tracker._resource_tracker._fd is None:  # type: ignore
+        # no tracker inherited from the parent, attaching starts one for this process
+        _TRACKER_OWNER = os.getpid()
+    shm = shared_memory.SharedMemory(name=name)
+    if _TRACKER_OWNER == os.getpid():
+        resource_tracker.unregister(shm._name, "shared_memory")  # type: ignore
+    return shm
+
+
+def _result_name(name: str, start: int) -> str:
+    """Return the name of the block of the result of the minibatch starting at `start`"""
+    return f"{name.lstrip('/')}_r{start}"
+
+
+def _exists(name: str) -> bool:
+    try:
+        shm = _attach(name)
+    except FileNotFoundError:
+        return False
+    shm.close()
+    return True
+
+
+def _detach(shm: shared_memory.SharedMemory):
+    """Close the handle to a block, or drop it without unmapping the block if views remain
+
+    The views built on the block keep its memoryview, and thereby the mapping, alive,
+    e.g. when the result of the task refers to its input. The mapping is released
+    once the last view is garbage collected, whereas closing the block would leave
+    such views dangling.
+    """
+    try:
+        shm.close()
+        return
+    except BufferError:
+        pass
+    if not all(hasattr(shm, attr) for attr in ("_buf", "_mmap", "_fd")):
+        # the internals of SharedMemory changed, keep the handle open until the worker exits
+        logger.debug("cannot detach from shared memory %s with views on it", shm.name)
+        return
+    shm._buf = None  # type: ignore
+    shm._mmap = None  # type: ignore
+    if shm._fd >= 0:  # type: ignore
+        os.close(shm._fd)  # type: ignore
+        shm._fd = -1  # type: ignore
+
+
+def _decompose(data: Any) -> Tuple[str, Dict[Any, np.ndarray], Any]:
+    if isinstance(data, np.ndarray):
+        return "ndarray", {None: data}, None
+    if isinstance(data, pd.Series):
+        return "series", {None: data.to_numpy()}, (data.index, data.name)
+    # the columns are keyed by position, as their names may be duplicated
+    numeric = [i for i, dtype in enumerate(data.dtypes) if is_numeric_dtype(dtype)]
+    others = data.iloc[:, [i for i in range(data.shape[1]) if i not in numeric]]
+    arrays = {i: data.iloc[:, i].to_numpy() for i in numeric}
+    return "dataframe", arrays, (data.index, data.columns, others)
+
+
+def _build(kind: str, arrays: Dict[Any, np.ndarray], extra: Any) -> Any:
+    if kind == "ndarray":
+        return arrays[None]
+    if kind == "series":
+        index, name = extra
+        return pd.Series(arrays[None], index=index, name=name, copy=False)
+    index, columns, others = extra
+    other_columns = iter(range(others.shape[1]))
+    frame = pd.DataFrame(
+        {
+            i: arrays[i] if i in arrays else others.iloc[:, next(other_columns)].array
+            for i in range(len(columns))
+        },
+        index=index,
+        copy=False,
+    )
+    frame.columns = columns
+    return frame
+
+
+def _write_arrays(
+    arrays: Dict[Any, np.ndarray],
+    name: Optional[str] = None,
+) -> Tuple[shared_memory.SharedMemory, List[Tuple[Any, str, Tuple[int, ...], int]]]:
+    layout = []
+    offset = 0
+    for column, array in arrays.items():
+        layout.append((column, array.dtype.str, array.shape, offset))
+        offset += -(-array.nbytes // _ALIGNMENT) * _ALIGNMENT
+    shm = shared_memory.SharedMemory(name=name, create=True, size=max(1, offset))
+    for (_, dtype, shape, offset), array in zip(layout, arrays.values()):
+        np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)[...] = (
+            array
+        )
+    return shm, layout
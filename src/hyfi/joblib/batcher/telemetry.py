@@ -0,0 +1,200 @@
+"""Per-minibatch telemetry of Batcher runs"""
+
+import json
+import os
+import pickle
+import re
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import numpy as np
+
+from hyfi.utils.logging import LOGGING
+
+logger = LOGGING.getLogger(__name__)
+
+
+def run_measured(task: Callable, params: Any, measure_sizes: bool = True):
+    """Run a task on a minibatch and return its result with a record of the run
+
+    The record holds the worker PID, the start and end wall-clock times, the run time,
+    and, if `measure_sizes`, the pickled sizes of the minibatch and the result.
+    """
+    start = time.time()
+    start_counter = time.perf_counter()
+    result = task(params)
+    run_seconds = time.perf_counter() - start_counter
+    record = {
+        "pid": os.getpid(),
+        "start": start,
+        "end": start + run_seconds,
+        "run_seconds": run_seconds,
+    }
+    if measure_sizes:
+        record["input_bytes"] = _pickled_size(params)
+        record["output_bytes"] = _pickled_size(result)
+    return result, record
+
+
+def _pickled_size(obj: Any) -> Optional[int]:
+    try:
+        return len(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:  # e.g. the backend serializes lambdas with cloudpickle
+        return None
+
+
+class BatchTelemetry(object):
+    """
+    Collects the records of the minibatches of a run and reports on them.
+
+    The queue wait of a minibatch is the time from its submission to the start of its run.
+    Utilization is the total run time of the minibatches over the wall-clock time of the
+    run times the number of workers. Stragglers are the minibatches that ran more than
+    `straggler_factor` times the median run time.
+
+    Args:
+        description: The description of the run.
+        backend: The backend of the run.
+        procs: The number of workers of the run.
+        straggler_factor: The run time over the median run time above which a minibatch is a straggler.
+
+    Attributes:
+        records: The records of the minibatches, by index.
+    """
+
+    def __init__(
+        self,
+        description: str,
+        backend: str,
+        procs: int,
+        straggler_factor: float = 2.0,
+    ):
+        self.description = description
+        self.backend = backend
+        self.procs = max(1, procs)
+        self.straggler_factor = straggler_factor
+        self.started = time.time()
+        self.finished: Optional[float] = None
+        self.records: Dict[int, Dict[str, Any]] = {}
+
+    def add(self, index: int, record: Dict[str, Any], submitted: float):
+        """Add the record of a minibatch submitted at the given wall-clock time"""
+        record = dict(record, index=index)
+        record["queue_wait_seconds"] = max(0.0, record["start"] - submitted)
+        self.records[index] = record
+
+    def finish(self):
+        self.finished = time.time()
+
+    def summary(self) -> Dict[str, Any]:
+        """Return the summary of the run, with the straggler report"""
+        records = [self.records[i] for i in sorted(self.records)]
+        wall_seconds = (self.finished or time.time()) - self.started
+        summary: Dict[str, Any] = {
+            "description": self.description,
+            "backend": self.backend,
+            "procs": self.procs,
+            "num_batches": len(records),
+            "wall_seconds": wall_seconds,
+        }
+        if not records:
+            return summary
+        run = np.array([r["run_seconds"] for r in records])
+        wait = np.array([r["queue_wait_seconds"] for r in records])
+        workers = min(self.procs, len(records))
+        median = float(np.median(run))
+        stragglers = sorted(
+            (r for r in records if r["run_seconds"] > self.straggler_factor * median),
+            key=lambda r: r["run_seconds"],
+            reverse=True,
+        )
+        pids: Dict[int, Dict[str, float]] = {}
+        for r in records:
+            stats = pids.setdefault(r["pid"], {"batches": 0, "run_seconds": 0.0})
+            stats["batches"] += 1
+            stats["run_seconds"] += r["run_seconds"]
+        summary.update(
+            {
+                "busy_seconds": float(run.sum()),
+                "utilization": (
+                    float(run.sum() / (wall_seconds * workers))
+                    if wall_seconds > 0
+                    else None
+                ),
+                "run_seconds": _percentiles(run),
+                "queue_wait_seconds": _percentiles(wait),
+                "input_bytes": _total(records, "input_bytes"),
+                "output_bytes": _total(records, "output_bytes"),
+                "workers": {str(pid): stats for pid, stats in pids.items()},
+                "stragglers": {
+                    "factor": self.straggler_factor,
+                    "tail_ratio": float(run.max() / median) if median > 0 else None,
+                    "batches": [
+                        {k: r[k] for k in ("index", "pid", "run_seconds")}
+                        for r in stragglers[:10]
+                    ],
+                    "num_batches": len(stragglers),
+                },
+            }
+        )
+        return summary
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "summary": self.summary(),
+            "batches": [self.records[i] for i in sorted(self.records)],
+        }
+
+    def save(self, telemetry_dir: Union[str, Path]) -> Path:
+        """Save the telemetry as JSON in the directory and return the path of the file"""
+        telemetry_dir = Path(telemetry_dir)
+        telemetry_dir.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.fromtimestamp(self.started).strftime("%Y%m%d-%H%M%S-%f")
+        name = re.sub(r"[^\w.-]+", "_", self.description)
+        path = telemetry_dir / f"telemetry-{name}-{stamp}-{os.getpid()}.json"
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2, default=str)
+        return path
+
+    def log(self):
+        """Log a one-line summary of the run"""
+        s = self.summary()
+        if not s["num_batches"]:
+            return
+        logger.info(
+            "%s: %s minibatches on %s (%s procs) in %.2fs, utilization %.0f%%, "
+            "run p50/p95/max %.3f/%.3f/%.3fs, queue wait mean %.3fs, "
+            "pickled in/out %s/%s bytes, %s stragglers (max/median %.1fx)",
+            s["description"],
+            s["num_batches"],
+            s["backend"],
+            s["procs"],
+            s["wall_seconds"],
+            100 * (s["utilization"] or 0),
+            s["run_seconds"]["p50"],
+            s["run_seconds"]["p95"],
+            s["run_seconds"]["max"],
+            s["queue_wait_seconds"]["mean"],
+            s["input_bytes"],
+            s["output_bytes"],
+            s["stragglers"]["num_batches"],
+            s["stragglers"]["tail_ratio"] or 0,
+        )
+
+
+def _percentiles(values: np.ndarray) -> Dict[str, float]:
+    return {
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "max": float(values.max()),
+    }
+
+
+def _total(records: List[Dict[str, Any]], key: str) -> Optional[int]:
+    values = [r.get(key) for r in records]
+    if any(v is None for v in values):
+        return None
+    return int(sum(values))
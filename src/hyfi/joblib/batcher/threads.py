@@ -0,0 +1,162 @@
+"""Limits of the BLAS and OpenMP threads of the workers, against oversubscription"""
+
+import contextlib
+import os
+import sys
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
+
+from hyfi.utils.logging import LOGGING
+
+from .broadcast import wraps_task
+
+logger = LOGGING.getLogger(__name__)
+
+THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "BLIS_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+)
+
+# The thread limit applied in this worker process, if any
+_WORKER_LIMIT: Optional[int] = None
+
+
+def available_cores() -> int:
+    """Return the number of cores this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def resolve_inner_threads(
+    inner_threads: Optional[Union[int, str]], procs: int
+) -> Optional[int]:
+    """
+    Resolve the number of BLAS and OpenMP threads per worker.
+
+    Args:
+        inner_threads: The number of threads, 'auto' to divide the cores among the workers,
+            or None not to limit the threads.
+        procs: The number of workers.
+
+    Returns:
+        The number of threads per worker, or None.
+    """
+    if inner_threads is None:
+        return None
+    if inner_threads == "auto":
+        return max(1, available_cores() // max(1, procs))
+    try:
+        threads = int(inner_threads)
+    except (TypeError, ValueError):
+        raise ValueError(
+            f"inner_threads must be 'auto', a number or None, got {inner_threads}"
+        ) from None
+    if threads < 1:
+        raise ValueError(f"inner_threads must be at least 1, got {threads}")
+    return threads
+
+
+def _set_numba_threads(threads: int) -> Optional[int]:
+    """Set the threads of numba if its threading layer is launched, returning the previous number
+
+    Getting or setting the threads launches the threading layer, which must not be
+    started in a process that forks workers afterwards, so numba is left alone until
+    it launches the layer itself for a parallel function.
+    """
+    numba = sys.modules.get("numba")
+    parallel = sys.modules.get("numba.np.ufunc.parallel")
+    if numba is None or not getattr(parallel, "_is_initialized", False):
+        return None
+    previous = numba.get_num_threads()
+    numba.set_num_threads(min(threads, numba.config.NUMBA_NUM_THREADS))
+    return previous
+
+
+def limit_threads(threads: int):
+    """
+    Limit the BLAS and OpenMP threads of this worker process, for the rest of its life.
+
+    The environment variables apply to the libraries loaded afterwards. The libraries
+    already loaded, e.g. inherited by forked workers, are limited with threadpoolctl
+    if it is installed.
+    """
+    global _WORKER_LIMIT
+    if _WORKER_LIMIT == threads:
+        return
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        logger.debug(
+            "threadpoolctl is not installed, only new thread pools are limited"
+        )
+    else:
+        threadpool_limits(limits=threads)
+    _set_numba_threads(threads)
+    _WORKER_LIMIT = threads
+
+
+@contextlib.contextmanager
+def thread_limits(threads: Optional[int]) -> Iterator[None]:
+    """Limit the BLAS and OpenMP threads of this process in the context, and restore them after"""
+    if threads is None:
+        yield
+        return
+    environ: Dict[str, Optional[str]] = {
+        name: os.environ.get(name) for name in THREAD_ENV_VARS
+    }
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(threads)
+    numba_threads = _set_numba_threads(threads)
+    limiter: Any = None
+    try:
+        from threadpoolctl import threadpool_limits
+
+        limiter = threadpool_limits(limits=threads)
+    except ImportError:
+        logger.debug(
+            "threadpoolctl is not installed, only new thread pools are limited"
+        )
+    try:
+        yield
+    finally:
+        if limiter is not None:
+            limiter.restore_original_limits()
+        if numba_threads is not None:
+            sys.modules["numba"].set_num_threads(numba_threads)
+        for name, value in environ.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def thread_limited_task(task: Callable, threads: int, restore: bool = True) -> Callable:
+    """
+    Wrap a task so that the threads of the worker running it are limited first.
+
+    Args:
+        task: The task to wrap.
+        threads: The number of BLAS and OpenMP threads of the worker.
+        restore: Restore the limits after each minibatch, for workers shared with
+            other work. The workers of a pool the batcher owns keep them instead.
+    """
+    if wraps_task(task, run_thread_limited):
+        return task
+    return partial(run_thread_limited, task, threads, restore)
+
+
+def run_thread_limited(
+    task: Callable, threads: int, restore: bool, params: List[Any]
+) -> Any:
+    if not restore:
+        limit_threads(threads)
+        return task(params)
+    with thread_limits(threads):
+        return task(params)
@@ -1,4 +1,14 @@
-from typing import Callable, Mapping, Optional, Sequence, Union
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Sized,
+    Union,
+)
 
 import pandas as pd
 from tqdm.auto import tqdm
@@ -8,7 +18,7 @@ from hyfi.composer import BaseConfig, PrivateAttr
 from hyfi.utils.logging import LOGGING
 
 from .batcher import batcher
-from .batcher.apply import decorator_apply
+from .batcher.apply import Apply, ApplyColumns, decorator_apply
 from .batcher.batcher import Batcher
 
 logger = LOGGING.getLogger(__name__)
@@ -25,6 +35,32 @@ class JobLib(BaseConfig):
     minibatch_size: int = 1_000
     num_workers: int = 1
     num_gpus: int = 0
+    max_in_flight: Optional[int] = None
+    transport: str = "pickle"
+    persistent_pool: bool = False
+    max_tasks_per_child: Optional[int] = 2
+    max_memory_per_child: Optional[int] = None
+    adaptive_minibatch: bool = False
+    target_batch_seconds: float = 1.0
+    async_concurrency: int = 100
+    async_timeout: Optional[float] = None
+    checkpoint_dir: Optional[str] = None
+    start_method: Optional[str] = None
+    preload_modules: List[str] = []
+    telemetry: bool = False
+    telemetry_dir: Optional[str] = None
+    max_inflight_bytes: Optional[int] = None
+    max_rss_bytes: Optional[int] = None
+    spill_dir: Optional[str] = None
+    schedule: str = "static"
+    cost: Optional[str] = None
+    retries: int = 0
+    retry_backoff: float = 0.5
+    on_error: str = "fail"
+    error_default: Optional[Any] = None
+    quarantine_dir: Optional[str] = None
+    inner_threads: Optional[Union[int, str]] = None
+    placement: Optional[Union[str, List[List[int]]]] = None
 
     _initilized_: bool = PrivateAttr(False)
     _batcher_instance_: Optional[Batcher] = PrivateAttr(None)
@@ -48,6 +84,8 @@ class JobLib(BaseConfig):
                 ray.init(**ray_cfg)
                 backend_handle = ray
 
+            if core.global_batcher is not None:
+                core.global_batcher.shutdown()
             core.global_batcher = batcher.Batcher(
                 backend_handle=backend_handle,
                 backend=self.backend,
@@ -55,8 +93,36 @@ class JobLib(BaseConfig):
                 minibatch_size=self.minibatch_size,
                 task_num_cpus=self.num_workers,
                 task_num_gpus=self.num_gpus,
+                max_in_flight=self.max_in_flight,
+                transport=self.transport,
+                persistent_pool=self.persistent_pool,
+                max_tasks_per_child=self.max_tasks_per_child,
+                max_memory_per_child=self.max_memory_per_child,
+                adaptive_minibatch=self.adaptive_minibatch,
+                target_batch_seconds=self.target_batch_seconds,
+                async_concurrency=self.async_concurrency,
+                async_timeout=self.async_timeout,
+                checkpoint_dir=self.checkpoint_dir,
+                start_method=self.start_method,
+                preload_modules=self.preload_modules,
+                telemetry=self.telemetry,
+                telemetry_dir=self.telemetry_dir,
+                max_inflight_bytes=self.max_inflight_bytes,
+                max_rss_bytes=self.max_rss_bytes,
+                spill_dir=self.spill_dir,
+                schedule=self.schedule,
+                cost=self.cost,
+                retries=self.retries,
+                retry_backoff=self.retry_backoff,
+                on_error=self.on_error,
+                error_default=self.error_default,
+                quarantine_dir=self.quarantine_dir,
+                inner_threads=self.inner_threads,
+                placement=self.placement,
                 verbose=self.verbose,
             )
+            if self.persistent_pool and backend == "multiprocessing":
+                core.global_batcher.start_pool()
             self._batcher_instance_ = core.global_batcher
             logger.info("initialized batcher with %s", core.global_batcher)
         self._initilized_ = True
@@ -66,7 +132,9 @@ class JobLib(BaseConfig):
         backend = self.backend
         if core.global_batcher:
             logger.debug("stopping batcher")
-            del core.global_batcher
+            core.global_batcher.shutdown()
+            core.global_batcher = None
+        self._batcher_instance_ = None
 
         logger.debug("stopping distributed framework")
         if self.initialize_backend and backend == "ray":
@@ -88,37 +156,123 @@ class BATCHER:
     @staticmethod
     def apply(
         func: Callable,
-        series: Union[pd.Series, pd.DataFrame, Sequence, Mapping],
+        series: Union[pd.Series, pd.DataFrame, Sequence, Mapping, Iterable],
         description: Optional[str] = None,
         use_batcher: bool = True,
         minibatch_size: Optional[int] = None,
         num_workers: Optional[int] = None,
+        stream: bool = False,
+        ordered: bool = True,
+        max_in_flight: Optional[int] = None,
+        memoize: bool = False,
         **kwargs,
     ):
-        batcher_instance = JobLib()._batcher_instance_
+        batcher_instance = core.global_batcher
+        if stream:
+            # Stream the results of each minibatch, so that any iterable,
+            # e.g. a generator of DataFrame chunks, is processed in bounded memory.
+            if not use_batcher or batcher_instance is None:
+                batcher_instance = batcher.Batcher(
+                    backend="serial", minibatch_size=minibatch_size or 1_000
+                )
+            # the procs are passed to the stream, which runs after this returns
+            procs = batcher_instance.procs if num_workers is None else int(num_workers)
+            if minibatch_size is None:
+                minibatch_size = batcher_instance.minibatch_size
+            if procs > 1 and isinstance(series, Sized):
+                minibatch_size = min(int(len(series) / procs) + 1, minibatch_size)
+                logger.info(f"Using batcher with minibatch size: {minibatch_size}")
+            return Apply(
+                func,
+                batcher_instance,
+                description=description or "batch_apply",
+            ).stream(
+                series,
+                ordered=ordered,
+                max_in_flight=max_in_flight,
+                minibatch_size=minibatch_size,
+                procs=procs,
+            )
         if use_batcher and batcher_instance is not None:
             batcher_minibatch_size = batcher_instance.minibatch_size
+            batcher_procs = batcher_instance.procs
             if minibatch_size is None:
                 minibatch_size = batcher_minibatch_size
-            if num_workers is not None:
-                batcher_instance.procs = int(num_workers)
-            if batcher_instance.procs > 1:
-                batcher_instance.minibatch_size = min(
-                    int(len(series) / batcher_instance.procs) + 1, minibatch_size
-                )
-                logger.info(
-                    f"Using batcher with minibatch size: {batcher_instance.minibatch_size}"
-                )
-                results = decorator_apply(
-                    func,
-                    batcher_instance,
-                    description=description,  # type: ignore
-                )(series)
-                if batcher_instance is not None:
-                    batcher_instance.minibatch_size = batcher_minibatch_size
-                return results
+            try:
+                if num_workers is not None:
+                    batcher_instance.procs = int(num_workers)
+                if batcher_instance.procs > 1:
+                    batcher_instance.minibatch_size = min(
+                        int(len(series) / batcher_instance.procs) + 1, minibatch_size
+                    )
+                    logger.info(
+                        f"Using batcher with minibatch size: {batcher_instance.minibatch_size}"
+                    )
+                    return decorator_apply(
+                        func,
+                        batcher_instance,
+                        description=description,  # type: ignore
+                        memoize=memoize,
+                    )(series)
+            finally:
+                batcher_instance.minibatch_size = batcher_minibatch_size
+                batcher_instance.procs = batcher_procs
 
         if batcher_instance is None:
             logger.warning("batcher is not initialized")
         tqdm.pandas(desc=description)
         return series.progress_apply(func)  # type: ignore
+
+    @staticmethod
+    def apply_columns(
+        func: Union[Callable, Mapping[str, Callable]],
+        data: pd.DataFrame,
+        columns: Optional[Sequence[str]] = None,
+        description: Optional[str] = None,
+        use_batcher: bool = True,
+        minibatch_size: Optional[int] = None,
+        num_workers: Optional[int] = None,
+        **kwargs,
+    ) -> pd.DataFrame:
+        """
+        Apply a function, or a function per column, to several columns of a dataframe.
+
+        With the batcher, each minibatch is sent once with all the columns,
+        and the results are merged once, instead of once per column.
+
+        Returns:
+            A dataframe of the results, with a column per column.
+        """
+        batcher_instance = core.global_batcher
+        applier = ApplyColumns(
+            func,
+            batcher_instance,
+            columns=columns,
+            description=description or "batch_apply_columns",
+        )
+        if use_batcher and batcher_instance is not None:
+            batcher_procs = batcher_instance.procs
+            if minibatch_size is None:
+                minibatch_size = batcher_instance.minibatch_size
+            try:
+                if num_workers is not None:
+                    batcher_instance.procs = int(num_workers)
+                if batcher_instance.procs > 1:
+                    minibatch_size = min(
+                        int(len(data) / batcher_instance.procs) + 1, minibatch_size
+                    )
+                    logger.info(f"Using batcher with minibatch size: {minibatch_size}")
+                    return applier.transform(data, minibatch_size=minibatch_size)
+            finally:
+                batcher_instance.procs = batcher_procs
+
+        if batcher_instance is None:
+            logger.warning("batcher is not initialized")
+        tqdm.pandas(desc=description)
+        return pd.DataFrame(
+            {
+                column: data[column].progress_apply(function)  # type: ignore
+                for column, function in applier.functions.items()
+            },
+            index=data.index,
+        )
@@ -119,7 +119,19 @@ def dataframe_external_funcs(data: pd.DataFrame, config: DataframePipe):
         logger.warning("No function found for %s", config)
         return data
     with elapsed_timer(format_time=True) as elapsed:
-        if config.columns:
+        if len(config.columns) > 1 and config.use_batcher:
+            # send each minibatch once with all the columns, and merge the results once
+            logger.info("processing columns: %s", config.columns)
+            results = BATCHER.apply_columns(
+                _fn,
+                data,
+                columns=config.columns,
+                use_batcher=config.use_batcher,
+                num_workers=config.num_workers,
+            )
+            for key in config.columns:
+                data[key] = results[key]
+        elif config.columns:
             for key in config.columns:
                 logger.info("processing column: %s", key)
                 data[key] = (
@@ -85,6 +85,8 @@ class Project(BaseConfig, Composer):
         self.env.HYFI_VERBOSE = self.verbose
 
         if self.joblib:
+            if self.joblib.telemetry and not self.joblib.telemetry_dir and self.path:
+                self.joblib.telemetry_dir = str(self.path.log_dir / "telemetry")
             self.joblib.init_backend()
         else:
             logger.warning("JoblibConfig not initialized")
@@ -2,11 +2,27 @@
 Load data from a file or a list of files
 """
 
+import operator
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import chain
 from pathlib import Path
-from typing import Dict, Mapping, Optional, Sequence, Union
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Union,
+)
 
 import datasets as hfds
+import numpy as np
 import pandas as pd
 from datasets.arrow_dataset import Dataset
 from datasets.dataset_dict import DatasetDict, IterableDatasetDict
@@ -41,9 +57,15 @@ class DSLoad:
         concatenate: Optional[bool] = False,
         use_cached: bool = False,
         verbose: Optional[bool] = False,
+        columns: Optional[Sequence[str]] = None,
+        filters: Optional[Any] = None,
         **kwargs,
     ) -> Union[Dict[str, pd.DataFrame], Dict[str, DatasetType]]:
-        """Load data from a file or a list of files"""
+        """Load data from a file or a list of files
+
+        With the pandas path, only the `columns` are read, and only the rows matching
+        the `filters` are kept. See `load_dataframe`.
+        """
         if path in ["dataframe", "df", "pandas"]:
             data = DSLoad.load_dataframes(
                 data_files,
@@ -53,6 +75,8 @@ class DSLoad:
                 concatenate=concatenate,
                 use_cached=use_cached,
                 verbose=verbose,
+                columns=columns,
+                filters=filters,
                 **kwargs,
             )
             if data is not None:
@@ -86,9 +110,29 @@ class DSLoad:
         ignore_index: bool = False,
         use_cached: bool = False,
         verbose: bool = False,
+        chunksize: Optional[int] = None,
+        num_workers: int = 1,
+        backend: str = "threading",
+        columns: Optional[Sequence[str]] = None,
+        filters: Optional[Any] = None,
         **kwargs,
-    ) -> Optional[Union[Dict[str, pd.DataFrame], pd.DataFrame]]:
-        """Load data from a file or a list of files"""
+    ) -> Optional[
+        Union[
+            Dict[str, Union[pd.DataFrame, Iterator[pd.DataFrame]]],
+            pd.DataFrame,
+            Iterator[pd.DataFrame],
+        ]
+    ]:
+        """Load data from a file or a list of files
+
+        With `num_workers` > 1, the files are loaded concurrently by a pool of threads, or
+        of processes with the 'multiprocessing' backend, keeping the order of the files.
+        Threads suit parquet files, as pyarrow decodes them without holding the GIL.
+
+        With `chunksize`, each file is read lazily as an iterator of DataFrames of at most
+        `chunksize` rows, and the files to concatenate are chained in order, so that files
+        larger than memory are processed in bounded memory.
+        """
         if not data_files:
             logger.warning("No data_files provided")
             return {}
@@ -102,15 +146,32 @@ class DSLoad:
             **kwargs,
         )
 
+        if columns is not None:
+            kwargs["columns"] = columns
+        if filters is not None:
+            kwargs["filters"] = filters
+        if chunksize:
+            return DSLoad._load_dataframe_chunks(
+                filepaths,
+                filetype=filetype,
+                split=split,
+                concatenate=concatenate,
+                ignore_index=ignore_index,
+                chunksize=chunksize,
+                verbose=verbose,
+                **kwargs,
+            )
         if isinstance(filepaths, dict):
             data = {
-                name: pd.concat(
-                    [
-                        DSLoad.load_dataframe(
-                            f, verbose=verbose, filetype=filetype, **kwargs
-                        )
-                        for f in files
-                    ],
+                name: _concat_frames(
+                    _load_files(
+                        files,
+                        num_workers=num_workers,
+                        backend=backend,
+                        filetype=filetype,
+                        verbose=verbose,
+                        **kwargs,
+                    ),
                     ignore_index=ignore_index,
                 )
                 for name, files in filepaths.items()
@@ -118,23 +179,66 @@ class DSLoad:
             data = {k: v for k, v in data.items() if v is not None}
             return data
         else:
-            data = {
-                os.path.basename(f): DSLoad.load_dataframe(
-                    f, verbose=verbose, filetype=filetype, **kwargs
+            data = dict(
+                zip(
+                    map(os.path.basename, filepaths),
+                    _load_files(
+                        filepaths,
+                        num_workers=num_workers,
+                        backend=backend,
+                        filetype=filetype,
+                        verbose=verbose,
+                        **kwargs,
+                    ),
                 )
-                for f in filepaths
-            }
+            )
             data = {k: v for k, v in data.items() if v is not None}
             if len(data) == 1:
                 data = list(data.values())[0]
             elif len(data) > 1:
                 if concatenate or split:
-                    data = pd.concat(data.values(), ignore_index=ignore_index)
+                    data = _concat_frames(
+                        list(data.values()), ignore_index=ignore_index
+                    )
             else:
                 logger.warning(f"No files found for {data_files}")
                 return None
             return {split: data} if split else data
 
+    @staticmethod
+    def _load_dataframe_chunks(
+        filepaths: Union[Dict[str, Sequence[str]], Sequence[str]],
+        filetype: Optional[str] = None,
+        split: Optional[str] = None,
+        concatenate: bool = False,
+        ignore_index: bool = False,
+        chunksize: int = 100_000,
+        verbose: bool = False,
+        **kwargs,
+    ) -> Optional[Union[Dict[str, Iterator[pd.DataFrame]], Iterator[pd.DataFrame]]]:
+        """Load the files as iterators of DataFrame chunks, chaining the files to concatenate"""
+
+        def _chunks(f: str) -> Iterator[pd.DataFrame]:
+            return DSLoad.load_dataframe(  # type: ignore
+                f, verbose=verbose, filetype=filetype, chunksize=chunksize, **kwargs
+            )
+
+        if isinstance(filepaths, dict):
+            return {
+                name: _chain_chunks(map(_chunks, files), ignore_index)
+                for name, files in filepaths.items()
+            }
+        if not filepaths:
+            logger.warning("No files found")
+            return None
+        if len(filepaths) == 1:
+            data = _chunks(filepaths[0])
+        elif concatenate or split:
+            data = _chain_chunks(map(_chunks, filepaths), ignore_index)
+        else:
+            return {os.path.basename(f): _chunks(f) for f in filepaths}
+        return {split: data} if split else data
+
     @staticmethod
     def load_dataframe(
         data_file: Union[str, Path],
@@ -143,9 +247,23 @@ class DSLoad:
         columns: Optional[Sequence[str]] = None,
         index_col: Union[str, int, Sequence[str], Sequence[int], None] = None,
         verbose: bool = False,
+        chunksize: Optional[int] = None,
+        filters: Optional[Any] = None,
         **kwargs,
-    ) -> pd.DataFrame:
-        """Load a dataframe from a file"""
+    ) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
+        """Load a dataframe from a file
+
+        With `chunksize`, return an iterator of DataFrames of at most `chunksize` rows
+        instead, reading CSV and TSV files with `pandas.read_csv(chunksize=...)` and
+        parquet files by record batches, so that only one chunk is in memory at a time.
+
+        Only the `columns` are decoded: they are pushed down to the parquet reader, and
+        passed to `pandas.read_csv` as `usecols`. The `filters` keep the matching rows,
+        in the DNF form of `pyarrow.parquet.read_table`, e.g. `[("year", ">=", 2020)]`,
+        or as a `pyarrow.dataset.Expression` for parquet files. Parquet files skip the
+        row groups whose statistics rule the filters out; CSV files are filtered after
+        each read.
+        """
         dtype = kwargs.pop("dtype", None)
         if isinstance(dtype, list):
             dtype = {k: "str" for k in dtype}
@@ -170,6 +288,21 @@ class DSLoad:
             raise ValueError("`file` should be a csv or a parquet file.")
         if verbose:
             logger.info(f"Loading data from {filepath}")
+        columns = _as_columns(columns)
+        filters = _normalize_filters(filters)
+        if chunksize:
+            return _iter_dataframe_chunks(
+                filepath,
+                filetype,
+                chunksize,
+                columns=columns,
+                index_col=index_col,
+                dtype=dtype,
+                parse_dates=parse_dates,
+                verbose=verbose,
+                filters=filters,
+                **kwargs,
+            )
         with elapsed_timer(format_time=True) as elapsed:
             if "csv" in filetype or "tsv" in filetype:
                 delimiter = kwargs.pop("delimiter", "\t") if "tsv" in filetype else None
@@ -179,15 +312,22 @@ class DSLoad:
                     dtype=dtype,
                     parse_dates=parse_dates,
                     delimiter=delimiter,
+                    usecols=_csv_usecols(columns, index_col, filters, parse_dates),
                 )
+                data = _filter_frame(data, filters)
             elif "parquet" in filetype:
                 engine = kwargs.pop("engine", "pyarrow")
                 if engine not in ["pyarrow", "fastparquet"]:
                     engine = "auto"
-                data = pd.read_parquet(filepath, engine=engine)  # type: ignore
+                data = pd.read_parquet(
+                    filepath,
+                    engine=engine,  # type: ignore
+                    columns=_parquet_columns(filepath, columns),
+                    filters=filters,
+                )
             else:
                 raise ValueError("filetype must be .csv or .parquet")
-            if isinstance(columns, list):
+            if columns is not None:
                 columns = [c for c in columns if c in data.columns]
                 data = data[columns]
             if verbose:
@@ -279,3 +419,280 @@ class DSLoad:
                 logger.info("Number of records: %s", len(data))
 
         return data
+
+
+def _iter_dataframe_chunks(
+    filepath: str,
+    filetype: str,
+    chunksize: int,
+    columns: Optional[Sequence[str]] = None,
+    index_col: Union[str, int, Sequence[str], Sequence[int], None] = None,
+    dtype: Optional[Union[str, Dict[str, str]]] = None,
+    parse_dates: Union[bool, Sequence[str]] = False,
+    verbose: bool = False,
+    filters: Optional[Any] = None,
+    **kwargs,
+) -> Iterator[pd.DataFrame]:
+    """Yield the DataFrame chunks of a file"""
+    num_chunks = 0
+    num_rows = 0
+    with elapsed_timer(format_time=True) as elapsed:
+        if "parquet" in filetype:
+            if filepath.startswith("http"):
+                # read remote files at once, as pyarrow only streams from seekable files
+                data = pd.read_parquet(filepath, columns=columns, filters=filters)
+                chunks: Iterable[pd.DataFrame] = (
+                    data.iloc[start : start + chunksize]
+                    for start in range(0, len(data), chunksize)
+                )
+            else:
+                import pyarrow.dataset as pds
+                import pyarrow.parquet as pq
+
+                dataset = pds.dataset(filepath, format="parquet")
+                if isinstance(filters, list):
+                    filters = pq.filters_to_expression(filters)
+                chunks = (
+                    batch.to_pandas()
+                    for batch in dataset.to_batches(
+                        columns=_parquet_columns(dataset.schema.names, columns),
+                        filter=filters,
+                        batch_size=chunksize,
+                    )
+                    if batch.num_rows
+                )
+        else:
+            delimiter = kwargs.pop("delimiter", "\t") if "tsv" in filetype else None
+            chunks = pd.read_csv(
+                filepath,
+                index_col=index_col,
+                dtype=dtype,
+                parse_dates=parse_dates,
+                delimiter=delimiter,
+                usecols=_csv_usecols(columns, index_col, filters, parse_dates),
+                chunksize=chunksize,
+            )
+            chunks = (_filter_frame(chunk, filters) for chunk in chunks)
+        for chunk in chunks:
+            if columns is not None:
+                chunk = chunk[[c for c in columns if c in chunk.columns]]
+            num_chunks += 1
+            num_rows += len(chunk)
+            yield chunk
+        if verbose:
+            logger.info(
+                " >> loaded %s rows in %s chunks from %s, elapsed time: %s",
+                num_rows,
+                num_chunks,
+                filepath,
+                elapsed(),
+            )
+
+
+_FILTER_OPS = {
+    "=": operator.eq,
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "in": lambda s, v: s.isin(v),
+    "not in": lambda s, v: ~s.isin(v),
+}
+
+
+def _as_columns(columns: Optional[Sequence[str]]) -> Optional[List[str]]:
+    if columns is None:
+        return None
+    return [columns] if isinstance(columns, str) else list(columns)
+
+
+def _normalize_filters(filters: Optional[Any]) -> Optional[Any]:
+    """Turn the predicates of DNF filters, e.g. lists read from a config, into tuples"""
+    if not isinstance(filters, Sequence) or isinstance(filters, str):
+        return filters
+
+    def _predicate(item: Any) -> Any:
+        item = list(item)
+        if item and isinstance(item[0], str):
+            col, op, value = item
+            if not isinstance(value, str) and isinstance(value, Iterable):
+                value = list(value)
+            return (col, op, value)
+        return [_predicate(i) for i in item]
+
+    filters = [_predicate(item) for item in filters]
+    return filters or None
+
+
+def _filter_columns(filters: Optional[Any]) -> List[str]:
+    if not isinstance(filters, list):
+        return []
+    conjunctions = filters if isinstance(filters[0], list) else [filters]
+    return [col for conjunction in conjunctions for col, _, _ in conjunction]
+
+
+def _csv_usecols(
+    columns: Optional[List[str]],
+    index_col: Union[str, int, Sequence[str], Sequence[int], None],
+    filters: Optional[Any],
+    parse_dates: Union[bool, Sequence[Any], Dict[str, Any]] = False,
+) -> Optional[Callable[[str], bool]]:
+    """Return the `usecols` of `read_csv`: the columns, the index, and the columns
+    filtered or parsed as dates
+
+    The keys of a `dtype` dict are not added, as `read_csv` ignores those of the columns
+    it does not read.
+    """
+    if columns is None:
+        return None
+    index_cols = [index_col] if isinstance(index_col, (str, int)) else index_col or []
+    date_cols = _date_columns(parse_dates)
+    if any(isinstance(col, int) for col in list(index_cols) + date_cols):
+        # positions count the columns of the file, so read them all
+        return None
+    keep = set(columns) | set(index_cols) | set(_filter_columns(filters))
+    keep |= set(date_cols)
+    return lambda col: col in keep
+
+
+def _date_columns(parse_dates: Union[bool, Sequence[Any], Dict[str, Any]]) -> List[Any]:
+    """Return the columns of the `parse_dates` of `read_csv`, flattening combined ones"""
+    if isinstance(parse_dates, bool) or not parse_dates:
+        return []
+    if isinstance(parse_dates, str):
+        return [parse_dates]
+    if isinstance(parse_dates, dict):
+        parse_dates = list(parse_dates.values())
+    date_cols: List[Any] = []
+    for col in parse_dates:
+        if isinstance(col, (list, tuple)):
+            date_cols.extend(col)
+        else:
+            date_cols.append(col)
+    return date_cols
+
+
+def _parquet_columns(
+    source: Union[str, Sequence[str]], columns: Optional[List[str]]
+) -> Optional[List[str]]:
+    """Return the columns to read that exist in a parquet file or directory, or in the names
+    of its schema"""
+    if columns is None:
+        return None
+    if isinstance(source, str):
+        if source.startswith("http"):
+            return columns
+        import pyarrow.dataset as pds
+
+        # a dataset also reads the schema of partitioned directories, with their partition keys
+        source = pds.dataset(source, format="parquet", partitioning="hive").schema.names
+    return [c for c in columns if c in source]
+
+
+def _filter_frame(data: pd.DataFrame, filters: Optional[Any]) -> pd.DataFrame:
+    """Keep the rows of a DataFrame matching DNF filters"""
+    if filters is None:
+        return data
+    if not isinstance(filters, list):
+        raise ValueError(
+            "filters of CSV files must be lists of (column, op, value) tuples"
+        )
+    conjunctions = filters if isinstance(filters[0], list) else [filters]
+    mask = pd.Series(False, index=data.index)
+    for conjunction in conjunctions:
+        matches = pd.Series(True, index=data.index)
+        for col, op, value in conjunction:
+            if op not in _FILTER_OPS:
+                raise ValueError(f"op must be one of {list(_FILTER_OPS)}, got {op}")
+            values = data.index if col == data.index.name else data[col]
+            matches &= np.asarray(_FILTER_OPS[op](values, value))
+        mask |= matches
+    return data[mask]
+
+
+def _chain_chunks(
+    iterators: Iterable[Iterator[pd.DataFrame]], ignore_index: bool = False
+) -> Iterator[pd.DataFrame]:
+    """Chain the chunks of several files, numbering the rows across the files if `ignore_index`"""
+    start = 0
+    for chunk in chain.from_iterable(iterators):
+        if ignore_index:
+            chunk = chunk.set_axis(pd.RangeIndex(start, start + len(chunk)))
+            start += len(chunk)
+        yield chunk
+
+
+def _load_timed(filepath: str, **kwargs) -> tuple:
+    """Load a dataframe from a file, returning it with the seconds it took"""
+    start = time.perf_counter()
+    data = DSLoad.load_dataframe(filepath, **kwargs)
+    return data, time.perf_counter() - start
+
+
+def _load_files(
+    filepaths: Sequence[str],
+    num_workers: int = 1,
+    backend: str = "threading",
+    verbose: bool = False,
+    **kwargs,
+) -> list:
+    """Load the files, concurrently with several workers, in the order of the files"""
+    if backend not in ["threading", "multiprocessing"]:
+        raise ValueError(
+            f"backend must be 'threading' or 'multiprocessing', got {backend}"
+        )
+    num_workers = max(1, min(num_workers, len(filepaths)))
+    start = time.perf_counter()
+    if num_workers == 1:
+        loaded = [_load_timed(f, verbose=verbose, **kwargs) for f in filepaths]
+    else:
+        pool = ThreadPoolExecutor if backend == "threading" else ProcessPoolExecutor
+        with pool(max_workers=num_workers) as executor:
+            futures = [
+                executor.submit(_load_timed, f, verbose=verbose, **kwargs)
+                for f in filepaths
+            ]
+            loaded = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+    if verbose:
+        num_bytes = 0
+        for f, (data, seconds) in zip(filepaths, loaded):
+            size = os.path.getsize(f) if os.path.exists(f) else 0
+            num_bytes += size
+            logger.info(
+                " >> %s: %s rows, %.1f MB in %.3fs (%.0f rows/s, %.1f MB/s)",
+                os.path.basename(f),
+                len(data),
+                size / 1e6,
+                seconds,
+                len(data) / seconds if seconds else 0,
+                size / 1e6 / seconds if seconds else 0,
+            )
+        logger.info(
+            " >> loaded %s files, %.1f MB in %.3fs with %s %s workers (%.1f MB/s)",
+            len(filepaths),
+            num_bytes / 1e6,
+            elapsed,
+            num_workers,
+            backend,
+            num_bytes / 1e6 / elapsed if elapsed else 0,
+        )
+    return [data for data, _ in loaded]
+
+
+def _concat_frames(
+    frames: Sequence[pd.DataFrame], ignore_index: bool = False
+) -> Optional[pd.DataFrame]:
+    """Concatenate the frames at once, numbering the rows from the precomputed total if `ignore_index`"""
+    frames = [frame for frame in frames if frame is not None]
+    if not frames:
+        return None
+    if len(frames) == 1:
+        data = frames[0]
+    else:
+        data = pd.concat(frames, copy=False)
+    if ignore_index:
+        data = data.set_axis(pd.RangeIndex(sum(len(frame) for frame in frames)))
+    return data
@@ -60,7 +60,8 @@ class IOLIBs:
         else:
             file = os.path.join(base_dir, pattern)
             files = glob(file, recursive=recursive)
-        return files
+        # sorted, as the order of directory listings depends on the filesystem
+        return sorted(files)
 
     @staticmethod
     def get_filepaths(
@@ -0,0 +1,150 @@
+from typing import Dict, NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from hyfi.joblib.batcher.apply import (
+    ROW_MODES,
+    Apply,
+    ApplyColumns,
+    apply_rows,
+    resolve_row_mode,
+)
+from hyfi.joblib.batcher.batcher import Batcher
+
+
+def total_row(row):
+    return row.price * row.qty
+
+
+def total_columns(price, qty):
+    return price * qty
+
+
+def total_dict(row: Dict[str, float]):
+    return row["price"] * row["qty"]
+
+
+class Order(NamedTuple):
+    price: float
+    qty: int
+
+
+def total_tuple(row: Order):
+    return row.price * row.qty
+
+
+def orders(num_rows=10):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(
+        {"price": rng.random(num_rows), "qty": rng.integers(1, 10, num_rows)},
+        index=range(100, 100 + num_rows),
+    )
+
+
+def test_row_modes():
+    data = orders()
+    expected = data.price * data.qty
+    columns = data.columns
+    assert resolve_row_mode(total_row, columns) == "series"
+    assert resolve_row_mode(total_columns, columns) == "columns"
+    assert resolve_row_mode(total_dict, columns) == "dict"
+    assert resolve_row_mode(total_tuple, columns) == "namedtuple"
+    b = Batcher(minibatch_size=3, backend="serial")
+    assert Apply(total_row, b).row_mode == ["series"]
+    for func in (total_row, total_columns, total_dict, total_tuple):
+        result = Apply(func, b, row_mode="auto").transform(data)
+        assert np.allclose(result, expected) and result.index.equals(data.index)
+    for mode in ("series", "namedtuple"):
+        result = Apply(total_row, b, row_mode=mode).transform(data)
+        assert np.allclose(result, expected)
+
+
+def test_apply_rows():
+    data = orders(1_000)
+    expected = data.price * data.qty
+    funcs = {
+        "series": total_row,
+        "namedtuple": total_row,
+        "columns": total_columns,
+        "dict": total_dict,
+    }
+    # sourcery skip: no-loop-in-tests
+    for mode in ROW_MODES:
+        result = apply_rows(data, funcs[mode], [], {}, mode)
+        assert np.allclose(result, expected) and result.index.equals(data.index)
+
+
+def weighted(x, y):
+    return x * 0.5 + y * 2.0
+
+
+def test_vectorize_kernel_cache():
+    from hyfi.joblib.batcher import kernels
+
+    signatures = ["float64(float64, float64)"]
+    rng = np.random.default_rng(0)
+    data = list(zip(rng.random(10_000), rng.random(10_000)))
+    expected = [weighted(x, y) for x, y in data]
+    b = Batcher(minibatch_size=100, backend="threading", procs=4)
+
+    kernels._KERNELS.clear()
+    result = Apply(weighted, b, vectorize=signatures).transform(data)
+    assert np.allclose(result, expected)
+    assert len(kernels._KERNELS) == 1
+    # the parallel target is compiled once per worker, not in this process
+    b = Batcher(minibatch_size=5_000, backend="multiprocessing", procs=2)
+    result = Apply(
+        weighted, b, vectorize=signatures, vectorize_target="parallel"
+    ).transform(data)
+    assert np.allclose(result, expected)
+    assert len(kernels._KERNELS) == 1
+
+
+def scaler(factor):
+    return lambda x: x * factor
+
+
+def test_kernel_key():
+    import math
+
+    from hyfi.joblib.batcher.kernels import compile_vectorized
+
+    signatures = ["float64(float64)"]
+    x = np.linspace(0, 1, 5)
+    sin = compile_vectorized(lambda v: math.sin(v), signatures)
+    cos = compile_vectorized(lambda v: math.cos(v), signatures)
+    assert np.allclose(sin(x), np.sin(x))
+    assert np.allclose(cos(x), np.cos(x))
+    assert np.allclose(compile_vectorized(scaler(2), signatures)(x), 2 * x)
+    assert np.allclose(compile_vectorized(scaler(3), signatures)(x), 3 * x)
+
+
+def double(x):
+    return x * 2
+
+
+def test_apply_columns():
+    data = orders(1_000)
+    b = Batcher(minibatch_size=100, backend="multiprocessing", procs=2)
+    result = ApplyColumns(double, b, columns=["price", "qty"]).transform(data)
+    assert result.index.equals(data.index)
+    assert result.price.equals(data.price * 2) and result.qty.equals(data.qty * 2)
+    result = ApplyColumns({"qty": double, "price": round}, b).transform(data)
+    assert list(result.columns) == ["qty", "price"]
+    assert result.price.equals(data.price.apply(round))
+    # a single pass gives the results of a pass per column
+    per_column = pd.concat(
+        [Apply(double, b).transform(data[c]).rename(c) for c in ("price", "qty")],
+        axis=1,
+    )
+    assert ApplyColumns(double, b, columns=["price", "qty"]).transform(data).equals(
+        per_column
+    )
+
+
+if __name__ == "__main__":
+    test_row_modes()
+    test_apply_rows()
+    test_vectorize_kernel_cache()
+    test_apply_columns()
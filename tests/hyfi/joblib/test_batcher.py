@@ -1,5 +1,13 @@
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
 from hyfi.joblib.batcher.apply import Apply
 from hyfi.joblib.batcher.apply_batch import ApplyBatch
+from hyfi.joblib.batcher.batcher import Batcher
+from hyfi.joblib.batcher.memo import MemoStore
 from hyfi.joblib import JobLib
 
 
@@ -24,5 +32,662 @@ def test_bacher_backends():
         batcher_test(backend)
 
 
+def worker_pid(x):
+    import os
+
+    return os.getpid()
+
+
+def test_batcher_apply_uses_global_batcher():
+    import os
+
+    from hyfi.joblib import BATCHER
+
+    joblib = JobLib(
+        backend="multiprocessing",
+        initialize_backend=True,
+        num_workers=2,
+        minibatch_size=2,
+    )
+    joblib.initialize()
+    series = pd.Series(range(10))
+    assert os.getpid() not in set(BATCHER.apply(worker_pid, series))
+    # the minibatches are sized by the workers when streaming too
+    results = BATCHER.apply(worker_pid, series, stream=True, minibatch_size=100)
+    assert [len(r) for r in results] == [6, 4]
+    # the workers given per call are not kept by the global batcher
+    BATCHER.apply(worker_pid, series, num_workers=3)
+    list(BATCHER.apply(worker_pid, series, num_workers=3, stream=True))
+    BATCHER.apply_columns(
+        worker_pid, pd.DataFrame({"x": series}), columns=["x"], num_workers=3
+    )
+    assert joblib._batcher_instance_.procs == 2
+    assert joblib._batcher_instance_.minibatch_size == 2
+    joblib.stop_backend()
+    assert set(BATCHER.apply(worker_pid, series)) == {os.getpid()}
+
+
+def test_stream_batches():
+    def chunks():
+        for i in range(5):
+            yield pd.DataFrame({"x": np.arange(i * 10, (i + 1) * 10)})
+
+    # sourcery skip: no-loop-in-tests
+    for backend in ["serial", "multiprocessing", "loky", "joblib"]:
+        b = Batcher(minibatch_size=4, backend=backend, procs=2, max_in_flight=2)
+        results = list(ApplyBatch(np.sum, b).stream(chunks()))
+        assert len(results) == 15
+        assert sum(r.iloc[0] for r in results) == sum(range(50))
+        results = list(Apply(np.power, b, [2]).stream(range(10), ordered=False))
+        assert sorted(x for r in results for x in r) == [x**2 for x in range(10)]
+    b = Batcher(minibatch_size=3, backend="multiprocessing", procs=2)
+    results = list(Apply(np.power, b, [2]).stream(pd.Series(range(10))))
+    assert pd.concat(results).tolist() == [x**2 for x in range(10)]
+
+
+def select_numeric(data):
+    return data[["a", "b"]] * 2
+
+
+def fail_last(batch):
+    if batch.index[-1] == 27:
+        raise ValueError("last minibatch")
+    return batch * 2
+
+
+def identity_batch(batch):
+    return batch
+
+
+def test_shared_memory_transport():
+    df = pd.DataFrame(
+        {"a": np.arange(10), "b": np.linspace(0, 1, 10), "s": list("abcdefghij")},
+        index=np.arange(10) * 3,
+    )
+    # sourcery skip: no-loop-in-tests
+    for backend in ["multiprocessing", "loky"]:
+        b = Batcher(minibatch_size=3, backend=backend, procs=2, transport="shared_memory")
+        assert b.use_shared_memory(df)
+        assert ApplyBatch(select_numeric, b).transform(df).equals(select_numeric(df))
+        assert ApplyBatch(np.negative, b).transform(df[["a"]]).equals(-df[["a"]])
+        results = list(ApplyBatch(np.sqrt, b).stream(df["b"]))
+        assert pd.concat(results).equals(np.sqrt(df["b"]))
+        # duplicate column names
+        dup = pd.concat([df, df[["a", "s"]]], axis=1)
+        assert ApplyBatch(identity_batch, b).transform(dup).equals(dup)
+
+    # the blocks of the results completed before an error are released
+    import os
+
+    before = set(os.listdir("/dev/shm"))
+    b = Batcher(minibatch_size=3, backend="multiprocessing", procs=2)
+    b.transport = "shared_memory"
+    with pytest.raises(ValueError):
+        ApplyBatch(fail_last, b).transform(df["b"])
+    stream = ApplyBatch(np.sqrt, b).stream(df["b"])
+    next(stream)
+    stream.close()
+    assert set(os.listdir("/dev/shm")) <= before
+
+
+def test_persistent_pool():
+    from hyfi import core
+    from hyfi.joblib import BATCHER
+
+    joblib = JobLib(
+        backend="multiprocessing",
+        initialize_backend=True,
+        num_workers=2,
+        minibatch_size=2,
+        persistent_pool=True,
+        max_tasks_per_child=10,
+        max_memory_per_child=1 << 40,
+    )
+    joblib.initialize()
+    b = core.global_batcher
+    pool = b._pool
+    assert pool is not None
+    series = pd.Series(range(10))
+    # sourcery skip: no-loop-in-tests
+    for _ in range(3):
+        results = BATCHER.apply(np.sqrt, series)
+        assert results.equals(np.sqrt(series))
+        assert b._pool is pool
+    b.max_memory_per_child = 1
+    b.recycle_pool()
+    assert b._pool is not pool
+    joblib.stop_backend()
+    assert b._pool is None
+    assert core.global_batcher is None
+
+
+def test_threading_backend():
+    df = pd.DataFrame({"x": np.arange(100, dtype=float)})
+    buffers = set()
+
+    def column_sum(data):
+        # a local function cannot be pickled, so this only runs on threads
+        buffers.add(np.shares_memory(data["x"].to_numpy(), df["x"].to_numpy()))
+        return pd.Series([data["x"].sum()])
+
+    b = Batcher(minibatch_size=10, backend="threading", procs=4)
+    assert ApplyBatch(column_sum, b).transform(df).sum() == df["x"].sum()
+    assert buffers == {True}
+    results = list(ApplyBatch(column_sum, b).stream(df, ordered=False))
+    assert len(results) == 10
+
+
+def slow_identity(x):
+    import time
+
+    time.sleep(0.001)
+    return x
+
+
+def test_adaptive_minibatch():
+    b = Batcher(
+        minibatch_size=2,
+        backend="threading",
+        procs=2,
+        adaptive_minibatch=True,
+        target_batch_seconds=0.05,
+    )
+    data = list(range(1000))
+    assert Apply(slow_identity, b).transform(data) == data
+    assert b.tuned_minibatch_size is not None
+    assert 10 < b.tuned_minibatch_size <= 500
+
+
+_AWAITING = {"now": 0, "peak": 0}
+
+
+async def async_double(x):
+    import asyncio
+
+    _AWAITING["now"] += 1
+    _AWAITING["peak"] = max(_AWAITING["peak"], _AWAITING["now"])
+    await asyncio.sleep(0.01)
+    _AWAITING["now"] -= 1
+    return x * 2
+
+
+async def async_sum(batch):
+    import asyncio
+
+    await asyncio.sleep(0.05)
+    return [sum(batch)]
+
+
+def test_asyncio_backend():
+    import asyncio
+
+    b = Batcher(minibatch_size=50, backend="asyncio", async_concurrency=20)
+    data = list(range(200))
+    assert Apply(async_double, b).transform(data) == [x * 2 for x in data]
+    # the rows are awaited concurrently, at most async_concurrency at a time
+    assert 1 < _AWAITING["peak"] <= 20
+    b.minibatch_size = 10
+    assert ApplyBatch(async_sum, b).transform(data) == [
+        sum(data[i : i + 10]) for i in range(0, 200, 10)
+    ]
+    series = pd.Series(data)
+    assert Apply(async_double, b).transform(series).equals(series * 2)
+    results = list(Apply(async_double, b).stream(data, ordered=False))
+    assert sorted(x for r in results for x in r) == [x * 2 for x in data]
+    b.async_timeout = 0.001
+    with pytest.raises(asyncio.TimeoutError):
+        Apply(async_double, b).transform(data)
+
+
+def crashing_square(params):
+    import os
+    import uuid
+
+    batch, crash_at, calls_dir = params
+    open(os.path.join(calls_dir, uuid.uuid4().hex), "w").close()
+    if crash_at in batch and os.path.exists(os.path.join(calls_dir, "..", "crash")):
+        raise RuntimeError("crashed")
+    return [x * x for x in batch]
+
+
+def test_checkpoint_resume(tmp_path):
+    calls_dir = tmp_path / "calls"
+    calls_dir.mkdir()
+    (tmp_path / "crash").touch()
+    b = Batcher(procs=2, minibatch_size=10, backend="multiprocessing")
+    b.checkpoint_dir = str(tmp_path / "checkpoints")
+    data = list(range(100))
+    args = [55, str(calls_dir)]
+    with pytest.raises(RuntimeError):
+        b.process_batches(crashing_square, data, args)
+    saved = list((tmp_path / "checkpoints").glob("*/batch-*.pkl"))
+    assert 0 < len(saved) < 10
+    assert list((tmp_path / "checkpoints").glob("*/manifest.json"))
+
+    (tmp_path / "crash").unlink()
+    num_calls = len(list(calls_dir.iterdir()))
+    assert b.process_batches(crashing_square, data, args) == [x * x for x in data]
+    assert len(list(calls_dir.iterdir())) - num_calls == 10 - len(saved)
+
+
+def scale(x, factor=1):
+    return x * factor
+
+
+def test_checkpoint_fingerprint(tmp_path):
+    from functools import partial
+
+    b = Batcher(minibatch_size=5, backend="serial")
+    b.checkpoint_dir = str(tmp_path / "checkpoints")
+    data = list(range(10))
+    assert Apply(lambda x: x + 1, b).transform(data) == [x + 1 for x in data]
+    assert Apply(lambda x: x * 100, b).transform(data) == [x * 100 for x in data]
+    assert Apply(partial(scale, factor=2), b).transform(data) == [2 * x for x in data]
+    assert Apply(partial(scale, factor=3), b).transform(data) == [3 * x for x in data]
+
+
+MEMO_CALLS = []
+
+
+def count_upper(x):
+    MEMO_CALLS.append(x)
+    return x.upper()
+
+
+def test_memoized_apply(tmp_path):
+    b = Batcher(minibatch_size=10, backend="threading")
+    words = ["spam", "eggs", "ham", "spam", "eggs"] * 200
+    series = pd.Series(words, index=range(1000, 2000), name="word")
+    result = Apply(count_upper, b, memoize=True).transform(series)
+    assert result.equals(series.str.upper())
+    assert len(MEMO_CALLS) == 3
+
+    MEMO_CALLS.clear()
+    memo_dir = str(tmp_path / "memo")
+    assert Apply(count_upper, b, memo_dir=memo_dir).transform(words[:4]) == [
+        "SPAM",
+        "EGGS",
+        "HAM",
+        "SPAM",
+    ]
+    assert Apply(count_upper, b, memo_dir=memo_dir).transform(words + ["bacon"])[
+        -1
+    ] == "BACON"
+    assert sorted(MEMO_CALLS) == ["bacon", "eggs", "ham", "spam"]
+
+    assert Apply(lambda x: x + "!", b, memo_dir=memo_dir).transform(["ham"]) == [
+        "ham!"
+    ]
+    assert Apply(lambda x: x + "?", b, memo_dir=memo_dir).transform(["ham"]) == [
+        "ham?"
+    ]
+
+    store = MemoStore(memo_dir, max_bytes=0)
+    store.set_many(["x"], ["X"])
+    assert store.get_many(["x", "spam"]) == {}
+
+
+def lookup(x, table, default=None):
+    return table.get(x, default)
+
+
+def test_broadcast():
+    import pickle
+
+    table = {i: f"word{i}" for i in range(100_000)}
+    data = list(range(0, 200_000, 1_000))
+    expected = [table.get(x, "?") for x in data]
+    # sourcery skip: no-loop-in-tests
+    for backend in ["serial", "threading", "multiprocessing", "loky", "joblib"]:
+        b = Batcher(minibatch_size=10, backend=backend, procs=2, persistent_pool=True)
+        handle = b.broadcast(table)
+        apply = Apply(lookup, b, args=[handle], kwargs={"default": b.broadcast("?")})
+        assert apply.transform(data) == expected
+        assert apply.transform(data) == expected
+        assert sorted(sum(apply.stream(data, ordered=False), [])) == sorted(expected)
+        b.shutdown()
+
+    params = [data[:10]] + apply.task_args
+    shipped = len(pickle.dumps(params))
+    inline = len(pickle.dumps([data[:10], lookup, [table]] + apply.task_args[2:]))
+    assert shipped * 100 < inline
+
+    from hyfi.joblib.batcher.broadcast import _REGISTRY
+
+    b = Batcher(minibatch_size=10, backend="multiprocessing", procs=2, persistent_pool=True)
+    first, second = b.broadcast(table), b.broadcast({})
+    assert Apply(lookup, b, args=[first]).transform(data[:5]) == expected[:5]
+    pool = b._pool
+    b.unbroadcast(first)
+    assert first.key not in _REGISTRY and first.key not in b._broadcast_initargs[0]
+    assert list(b._broadcast_initargs[0]) == [second.key]
+    assert Apply(lookup, b, args=[second, "?"]).transform(data[:5]) == ["?"] * 5
+    assert b._pool is pool
+    b.clear_broadcasts()
+    assert not b._broadcasts and second.key not in _REGISTRY
+    b.shutdown()
+
+    from hyfi.joblib.batcher.broadcast import broadcast_task
+    from hyfi.joblib.batcher.shared import shared_task
+
+    # the shared-memory path binds the task again, without wrapping it twice
+    task = shared_task(broadcast_task(lookup))
+    assert broadcast_task(task) is task
+
+
+def test_ray_backend():
+    ray = pytest.importorskip("ray")
+    ray.init(num_cpus=2, include_dashboard=False, ignore_reinit_error=True)
+    try:
+        b = Batcher(minibatch_size=5, backend="ray", procs=2, backend_handle=ray)
+        data = list(range(100))
+        assert Apply(np.power, b, [2]).transform(data) == [x**2 for x in data]
+        series = pd.Series(data)
+        assert Apply(np.power, b, [2]).transform(series).equals(series**2)
+        # functions of the test module are not importable in the Ray workers
+        exponent = b.broadcast(3)
+        assert Apply(np.power, b, [exponent]).transform(data) == [x**3 for x in data]
+        results = list(Apply(np.power, b, [2]).stream(data, ordered=False))
+        assert sorted(sum(results, [])) == [x**2 for x in data]
+    finally:
+        ray.shutdown()
+
+
+def test_start_method():
+    import multiprocessing
+
+    data = list(range(20))
+    # sourcery skip: no-loop-in-tests
+    for method in multiprocessing.get_all_start_methods():
+        b = Batcher(
+            minibatch_size=5,
+            procs=2,
+            start_method=method,
+            preload_modules=["pandas", "scipy.sparse"],
+            persistent_pool=True,
+        )
+        assert Apply(np.power, b, [2]).transform(data) == [x**2 for x in data]
+        assert b.worker_startup_seconds is not None
+        b.shutdown()
+        # forkserver workers are forked from the warm fork server from now on
+        b.start_pool()
+        b.shutdown()
+    with pytest.raises(ValueError):
+        Batcher(start_method="teleport")
+
+
+def sleep_square(x):
+    import time
+
+    time.sleep(0.2 if x == 7 else 0.01)
+    return x * x
+
+
+def test_telemetry(tmp_path):
+    import json
+
+    data = list(range(40))
+    # sourcery skip: no-loop-in-tests
+    for backend in ["serial", "multiprocessing", "threading"]:
+        b = Batcher(
+            minibatch_size=4, backend=backend, procs=2, telemetry_dir=str(tmp_path)
+        )
+        assert Apply(sleep_square, b).transform(data) == [x * x for x in data]
+        summary = b.last_telemetry.summary()
+        assert summary["num_batches"] == 10
+        assert summary["input_bytes"] > 0 and summary["output_bytes"] > 0
+        assert 0 < summary["utilization"] <= 1
+        assert [s["index"] for s in summary["stragglers"]["batches"]] == [1]
+    b.adaptive_minibatch = True
+    assert Apply(sleep_square, b).transform(data) == [x * x for x in data]
+    files = list(tmp_path.glob("telemetry-*.json"))
+    assert len(files) == 4
+    report = json.loads(files[0].read_text())
+    assert {"queue_wait_seconds", "pid", "run_seconds"} <= set(report["batches"][0])
+
+
+def grow(batch):
+    return pd.concat([batch] * 4)
+
+
+def test_memory_budget(tmp_path, caplog):
+    import logging
+
+    df = pd.DataFrame({"x": np.arange(2_000), "y": np.random.rand(2_000)})
+    # minibatches of ~2.4 KB, results of ~9.6 KB
+    b = Batcher(
+        minibatch_size=100,
+        procs=2,
+        max_inflight_bytes=5_000,
+        spill_dir=str(tmp_path),
+    )
+    with caplog.at_level(logging.INFO):
+        result = ApplyBatch(grow, b).transform(df)
+    assert len(result) == 4 * len(df)
+    assert result.groupby(level=0).size().eq(4).all()
+    assert result.index.unique().equals(df.index)
+    assert "throttling submission" in caplog.text
+    assert "spilled" in caplog.text
+    assert not list(tmp_path.iterdir())
+
+    from hyfi.joblib.batcher.budget import ResultSpill, estimate_nbytes, merge_spilled
+
+    text = pd.Series(["x" * 1_000] * 100)
+    assert estimate_nbytes(text) > 100_000
+    spill = ResultSpill(str(tmp_path))
+    # sourcery skip: no-loop-in-tests
+    for parts in (
+        [np.arange(3), np.arange(3, 5), np.arange(5, 9)],
+        [[1, 2], [3], [4, 5]],
+        [df.iloc[:500], df.iloc[500:1_200], df.iloc[1_200:]],
+    ):
+        expected = b.merge_batches(parts)
+        results = [parts[0], spill.save(parts[1]), spill.save(parts[2])]
+        merged = merge_spilled(results, max_bytes=10_000)
+        assert np.array_equal(np.asarray(merged), np.asarray(expected))
+    spill.cleanup()
+
+    b = Batcher(minibatch_size=100, procs=2, backend="joblib", max_rss_bytes=1)
+    with caplog.at_level(logging.WARNING):
+        ApplyBatch(grow, b).transform(df)
+    assert "not applied on the joblib backend" in caplog.text
+
+
+def costly_rows(batch):
+    import time
+
+    time.sleep(0.0005 * batch["cost"].sum())
+    return batch["x"] * 2
+
+
+def test_guided_schedule():
+    from hyfi.joblib.batcher.schedule import plan_chunks
+
+    sizes = plan_chunks(1_000, 4, 100, "guided")
+    assert sum(sizes) == 1_000 and max(sizes) <= 100 and sizes[-1] < sizes[0]
+    costs = np.array([10.0] * 10 + [1.0] * 90)
+    sizes = plan_chunks(100, 2, 50, "dynamic", costs)
+    assert sizes == [10, 45, 45]
+    costs = np.ones(100_000)
+    costs[0] = 1e6
+    sizes = plan_chunks(100_000, 8, 1_000, "dynamic", costs)
+    assert sum(sizes) == 100_000 and max(sizes) <= 1_000 and sizes[0] == 1
+
+    # the first tenth of the rows costs 20 times more than the others
+    df = pd.DataFrame({"x": np.arange(400), "cost": [20] * 40 + [1] * 360})
+    costs = df["cost"].to_numpy(dtype=float)
+    # sourcery skip: no-loop-in-tests
+    for schedule, cost in [("static", None), ("dynamic", "cost"), ("guided", "cost")]:
+        b = Batcher(
+            minibatch_size=100,
+            backend="threading",
+            procs=4,
+            schedule=schedule,
+            cost=cost,
+        )
+        result = ApplyBatch(costly_rows, b).transform(df)
+        assert result.equals(df["x"] * 2)
+    # the costly rows are spread over more, smaller minibatches
+    assert plan_chunks(400, 4, 100, "static") == [100] * 4
+    sizes = plan_chunks(400, 4, 100, "dynamic", costs)
+    assert sizes[0] < 40 and len(sizes) > 4
+    sizes = plan_chunks(400, 4, 100, "guided", costs)
+    assert sizes[0] < 40 and max(sizes) <= 100
+
+
+def inverse(x):
+    return 1 / x
+
+
+_ATTEMPTS = {"count": 0}
+
+
+def flaky_task(params):
+    _ATTEMPTS["count"] += 1
+    if _ATTEMPTS["count"] == 1:
+        raise ConnectionError("transient")
+    return params[0]
+
+
+def inverse_frame(batch):
+    return pd.DataFrame({"inverse": batch["x"].map(inverse), "x": batch["x"]})
+
+
+def test_fault_isolation(tmp_path):
+    data = pd.Series([1.0, 2.0, 0.0, 4.0] * 25)
+    b = Batcher(minibatch_size=10, backend="multiprocessing", procs=2)
+    with pytest.raises(ZeroDivisionError):
+        Apply(inverse, b).transform(data)
+
+    b = Batcher(
+        minibatch_size=10,
+        backend="multiprocessing",
+        procs=2,
+        on_error="skip",
+        quarantine_dir=str(tmp_path),
+    )
+    result = Apply(inverse, b).transform(data)
+    assert result.index.equals(data[data != 0].index)
+    assert len(b.last_quarantine) == 25
+    assert [q["position"] for q in b.last_quarantine] == list(range(2, 100, 4))
+    assert "ZeroDivisionError" in b.last_quarantine[0]["error"]
+    assert len(list(tmp_path.glob("quarantine-*.json"))) == 1
+
+    b = Batcher(minibatch_size=10, backend="serial", on_error="default", error_default=-1)
+    result = Apply(inverse, b).transform(list(data))
+    assert len(result) == 100 and result[2] == -1 and result[3] == 0.25
+
+    # the default rows take the type and the columns of the other results
+    frame = pd.DataFrame({"x": data})
+    result = ApplyBatch(inverse_frame, b).transform(frame)
+    assert list(result.columns) == ["inverse", "x"] and result.index.equals(frame.index)
+    assert (result.loc[2] == -1).all() and result.loc[3, "inverse"] == 0.25
+
+    b = Batcher(minibatch_size=10, backend="serial", retries=2, retry_backoff=0.01)
+    assert b.process_batches(flaky_task, list(range(30)), []) == list(range(30))
+    assert _ATTEMPTS["count"] == 4 and b.last_quarantine == []
+
+    b = Batcher(minibatch_size=10, backend="threading", procs=2, on_error="skip")
+    results = list(Apply(inverse, b).stream(data))
+    assert pd.concat(results).index.equals(data[data != 0].index)
+    assert [q["position"] for q in b.last_quarantine] == list(range(2, 100, 4))
+
+
+def thread_env(params):
+    import os
+
+    return [os.environ.get("OMP_NUM_THREADS")] * len(params[0])
+
+
+def test_inner_threads():
+    import os
+
+    before = os.environ.get("OMP_NUM_THREADS")
+    # sourcery skip: no-loop-in-tests
+    for backend in ["serial", "threading", "multiprocessing", "loky", "joblib", "p_tqdm"]:
+        b = Batcher(minibatch_size=5, backend=backend, procs=2, inner_threads=1)
+        assert b.process_batches(thread_env, list(range(10)), []) == ["1"] * 10
+        assert os.environ.get("OMP_NUM_THREADS") == before
+    from hyfi.joblib.batcher.threads import thread_limited_task
+
+    # the workers shared with other work are not left limited
+    assert thread_limited_task(thread_env, 1)([[0]]) == ["1"]
+    assert os.environ.get("OMP_NUM_THREADS") == before
+    b = Batcher(minibatch_size=5, backend="multiprocessing", procs=2, inner_threads="auto")
+    assert b.process_batches(thread_env, list(range(10)), []) == [
+        str(max(1, b._inner_threads("multiprocessing", 2)))
+    ] * 10
+    with pytest.raises(ValueError):
+        Batcher(inner_threads="all")
+
+    from hyfi.joblib.batcher.shared import shared_task
+    from hyfi.joblib.batcher.threads import thread_limits
+
+    # the shared-memory path binds the task again, without wrapping it twice
+    task = shared_task(thread_limited_task(thread_env, 1))
+    assert thread_limited_task(task, 2) is task
+
+    # numba's threading layer is not launched by limiting the threads
+    import numba  # noqa: F401
+
+    with thread_limits(1):
+        pass
+    assert not sys.modules["numba.np.ufunc.parallel"]._is_initialized
+
+
+def worker_cores(params):
+    import os
+
+    return [sorted(os.sched_getaffinity(0))] * len(params[0])
+
+
+def test_placement():
+    from hyfi.joblib.batcher.affinity import plan_placement
+
+    nodes = {0: [0, 1, 2, 3], 1: [4, 5, 6, 7]}
+    assert plan_placement("compact", 4, nodes) == [[0], [1], [2], [3]]
+    assert plan_placement("spread", 4, nodes) == [[0], [4], [1], [5]]
+    assert plan_placement([[0, 1], 2], 4) == [[0, 1], [2]]
+    with pytest.raises(ValueError):
+        Batcher(placement="scatter")
+
+    import os
+
+    core = min(os.sched_getaffinity(0))
+    available = sorted(os.sched_getaffinity(0))
+    # sourcery skip: no-loop-in-tests
+    for backend in ["multiprocessing", "loky", "p_tqdm", "joblib"]:
+        b = Batcher(minibatch_size=5, backend=backend, procs=2, placement=[[core]])
+        assert b.process_batches(worker_cores, list(range(10)), []) == [[core]] * 10
+        b.shutdown()
+    # the workers shared with other work are not left pinned
+    b = Batcher(minibatch_size=5, backend="joblib", procs=2)
+    assert b.process_batches(worker_cores, list(range(10)), []) == [available] * 10
+    b = Batcher(minibatch_size=5, backend="multiprocessing", procs=2, persistent_pool=True)
+    b.placement = [[core]]
+    assert b.process_batches(worker_cores, list(range(10)), []) == [[core]] * 10
+    b.placement = None
+    assert b.process_batches(worker_cores, list(range(10)), []) == [available] * 10
+    b.shutdown()
+    b = Batcher(minibatch_size=5, backend="multiprocessing", procs=2, placement="spread")
+    results = b.process_batches(worker_cores, list(range(10)), [])
+    assert all(cores in b._worker_placement(2).slots for cores in results)
+
+    from hyfi.joblib.batcher.affinity import WorkerPlacement, placed_task
+    from hyfi.joblib.batcher.shared import shared_task
+
+    # the shared-memory path binds the task again, without wrapping it twice
+    task = shared_task(placed_task(worker_cores, b._worker_placement(2)))
+    assert placed_task(task, b._worker_placement(2)) is task
+    b.shutdown()
+
+    # the workers on other machines, e.g. of a Ray cluster, are not placed
+    placement = WorkerPlacement([[core]])
+    placement.node = "elsewhere"
+    assert placed_task(worker_cores, placement)([[0]]) == [available]
+    assert os.listdir(placement.claim_dir) == []
+    placement.cleanup()
+
+
 if __name__ == "__main__":
     test_bacher_backends()
@@ -0,0 +1,77 @@
+from hyfi.joblib.batcher.benchmark import (
+    DATA_TYPES,
+    MERGE_TYPES,
+    compare_baseline,
+    format_kernel_table,
+    format_merge_table,
+    format_placement_table,
+    format_row_mode_table,
+    format_table,
+    run_benchmark,
+    run_kernel_benchmark,
+    run_merge_benchmark,
+    run_placement_benchmark,
+    run_row_mode_benchmark,
+    save_baseline,
+)
+
+
+def test_benchmark(tmp_path):
+    # a smoke-sized matrix; run the benchmark module for real measurements
+    results = run_benchmark(
+        backends=["serial", "multiprocessing"],
+        data_types=DATA_TYPES,
+        sizes=[200],
+        minibatch_size=100,
+        repeats=1,
+    )
+    assert len(results) == 2 * 3 * len(DATA_TYPES) * 2
+    table = format_table(results, "rows_per_second")
+    assert all(data_type in table for data_type in DATA_TYPES)
+
+    path = save_baseline(results, tmp_path / "baseline.json")
+    assert compare_baseline(results, path) == []
+    slower = [dict(r, rows_per_second=r["rows_per_second"] / 2) for r in results]
+    assert len(compare_baseline(slower, path)) == len(results)
+
+
+def test_placement_benchmark():
+    results = run_placement_benchmark(
+        placements=[None, "compact", "spread"],
+        num_rows=200,
+        num_columns=16,
+        minibatch_size=100,
+        repeats=1,
+    )
+    assert "spread" in format_placement_table(results)
+    assert [r["placement"] for r in results] == ["None", "compact", "spread"]
+    assert all(r["gb_per_second"] > 0 for r in results)
+
+
+def test_merge_benchmark():
+    results = run_merge_benchmark(num_batches=8, rows=100, repeats=1)
+    assert [r["result_type"] for r in results] == list(MERGE_TYPES)
+    assert all(r["rows_per_second"] > 0 for r in results)
+    assert "dataframe" in format_merge_table(results)
+
+
+def test_row_mode_benchmark():
+    results = run_row_mode_benchmark(num_rows=200, minibatch_size=100, repeats=1)
+    assert [r["row_mode"] for r in results] == ["series", "namedtuple", "columns", "dict"]
+    assert results[0]["speedup"] == 1.0
+    assert "namedtuple" in format_row_mode_table(results)
+
+
+def test_kernel_benchmark():
+    results = run_kernel_benchmark(num_rows=1_000, minibatch_size=100, repeats=1)
+    assert [r["cache"] for r in results] == ["cold", "warm"]
+    assert results[1]["seconds"] < results[0]["seconds"]
+    assert "warm" in format_kernel_table(results)
+
+
+if __name__ == "__main__":
+    test_benchmark()
+    test_placement_benchmark()
+    test_merge_benchmark()
+    test_row_mode_benchmark()
+    test_kernel_benchmark()
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import scipy.sparse as ssp
+from datasets import Dataset
+
+from hyfi.joblib.batcher.batcher import Batcher
+from hyfi.joblib.batcher.merge import merge_results
+
+
+def minibatches(num_batches=8, rows=1_000):
+    arrays = [np.arange(rows * 4, dtype=float).reshape(rows, 4) for _ in range(num_batches)]
+    return {
+        "list": [list(range(rows)) for _ in range(num_batches)],
+        "ndarray": arrays,
+        "csr_matrix": [ssp.csr_matrix(a) for a in arrays],
+        "csc_matrix": [ssp.csc_matrix(a) for a in arrays],
+        "Series": [pd.Series(a[:, 0]) for a in arrays],
+        "DataFrame": [pd.DataFrame(a) for a in arrays],
+        "Table": [pa.table({"x": a[:, 0]}) for a in arrays],
+        "ChunkedArray": [pa.chunked_array([a[:, 0]]) for a in arrays],
+        "Dataset": [Dataset.from_dict({"x": a[:, 0]}) for a in arrays],
+    }
+
+
+def test_merge_results():
+    batches = minibatches(num_batches=3, rows=5)
+    assert merge_results(batches["list"]) == list(range(5)) * 3
+    merged = merge_results(batches["ndarray"])
+    assert isinstance(merged, np.ndarray) and merged.shape == (15, 4)
+    merged = merge_results(batches["csc_matrix"])
+    assert merged.format == "csc" and merged.shape == (15, 4)
+    assert merge_results(batches["csr_matrix"]).format == "csr"
+    assert len(merge_results(batches["Series"])) == 15
+    assert merge_results(batches["DataFrame"]).shape == (15, 4)
+    assert merge_results(batches["Table"]).num_rows == 15
+    merged = merge_results(batches["ChunkedArray"])
+    assert isinstance(merged, pa.ChunkedArray) and len(merged) == 15
+    merged = merge_results(batches["Dataset"])
+    assert isinstance(merged, Dataset) and merged.num_rows == 15
+    assert merge_results([{"a": 1}, {"b": 2}]) == {"a": 1, "b": 2}
+    assert merge_results([np.int64(1), np.int64(2)]).tolist() == [1, 2]
+    assert merge_results([]) == []
+
+
+def test_merge_batches():
+    b = Batcher(backend="serial")
+    # sourcery skip: no-loop-in-tests
+    for batches in minibatches(num_batches=64, rows=100).values():
+        merged = b.merge_batches(batches)
+        num_rows = merged.shape[0] if hasattr(merged, "shape") else len(merged)
+        assert num_rows == 64 * 100
+
+
+if __name__ == "__main__":
+    test_merge_results()
+    test_merge_batches()
@@ -0,0 +1,138 @@
+import pandas as pd
+
+from hyfi.main import HyFI
+from hyfi.utils.datasets.load import _csv_usecols
+
+
+def write_shards(tmp_path, num_shards=3, num_rows=250):
+    for i in range(num_shards):
+        data = pd.DataFrame(
+            {"id": range(i * num_rows, (i + 1) * num_rows), "text": f"shard-{i}"}
+        )
+        data.to_csv(tmp_path / f"shard-{i}.csv", index=False)
+        data.to_parquet(tmp_path / f"shard-{i}.parquet", row_group_size=100)
+
+
+def test_load_dataframe_chunks(tmp_path):
+    write_shards(tmp_path)
+    # sourcery skip: no-loop-in-tests
+    for ext in ("csv", "parquet"):
+        chunks = HyFI.load_dataframe(
+            f"shard-0.{ext}", data_dir=str(tmp_path), chunksize=100, columns=["id"]
+        )
+        sizes = [len(chunk) for chunk in chunks]
+        assert sizes == [100, 100, 50]
+
+    chunks = HyFI.load_dataframes(
+        [f"shard-{i}.parquet" for i in range(3)],
+        data_dir=str(tmp_path),
+        concatenate=True,
+        ignore_index=True,
+        chunksize=100,
+    )
+    data = pd.concat(chunks)
+    assert data.id.tolist() == list(range(750))
+    assert data.index.equals(pd.RangeIndex(750))
+
+
+def test_load_dataframes_parallel(tmp_path, caplog):
+    write_shards(tmp_path, num_shards=8)
+    serial = HyFI.load_dataframes(
+        "shard-*.parquet", data_dir=str(tmp_path), concatenate=True
+    )
+    assert serial.id.tolist() == list(range(8 * 250))
+    # sourcery skip: no-loop-in-tests
+    for backend in ("threading", "multiprocessing"):
+        with caplog.at_level("INFO"):
+            data = HyFI.load_dataframes(
+                "shard-*.csv",
+                data_dir=str(tmp_path),
+                concatenate=True,
+                ignore_index=True,
+                num_workers=4,
+                backend=backend,
+                verbose=True,
+            )
+        assert data.id.tolist() == serial.id.tolist()
+        assert data.index.equals(pd.RangeIndex(len(serial)))
+    assert "shard-7.csv: 250 rows" in caplog.text
+
+
+def test_load_dataframe_pushdown(tmp_path):
+    wide = pd.DataFrame({f"c{i}": range(1000) for i in range(200)})
+    wide.to_parquet(tmp_path / "wide.parquet", row_group_size=100)
+    wide.to_csv(tmp_path / "wide.csv", index=False)
+    columns = ["c0", "c1", "c199"]
+    filters = [["c0", ">=", 900]]
+    # sourcery skip: no-loop-in-tests
+    for ext in ("csv", "parquet"):
+        data = HyFI.load_dataframe(
+            f"wide.{ext}", data_dir=str(tmp_path), columns=columns, filters=filters
+        )
+        assert data.columns.tolist() == columns
+        assert data.c0.tolist() == list(range(900, 1000))
+
+        chunks = HyFI.load_dataframe(
+            f"wide.{ext}",
+            data_dir=str(tmp_path),
+            columns=["c199"],
+            filters=[("c0", "in", [5, 500])],
+            chunksize=100,
+        )
+        data = pd.concat(chunks)
+        assert data.columns.tolist() == ["c199"]
+        assert data.c199.tolist() == [5, 500]
+
+    data = HyFI.load_data(
+        data_files="wide.parquet",
+        data_dir=str(tmp_path),
+        columns=columns,
+        filters=filters,
+    )
+    assert data["train"].shape == (100, 3)
+
+
+def test_load_dataframe_usecols_extras(tmp_path):
+    data = pd.DataFrame(
+        {
+            "id": range(3),
+            "t": ["a", "b", "c"],
+            "date": ["2020-01-01", "2020-01-02", "2020-01-03"],
+            "code": ["01", "02", "03"],
+            "other": 0,
+        }
+    )
+    data.to_csv(tmp_path / "b.csv", index=False)
+    # sourcery skip: no-loop-in-tests
+    for chunksize in (None, 2):
+        loaded = HyFI.load_dataframe(
+            "b.csv",
+            data_dir=str(tmp_path),
+            columns=["id", "t"],
+            parse_dates=["date"],
+            dtype={"code": "str"},
+            chunksize=chunksize,
+        )
+        if chunksize:
+            loaded = pd.concat(loaded)
+        assert loaded.columns.tolist() == ["id", "t"]
+        assert loaded.t.tolist() == ["a", "b", "c"]
+    usecols = _csv_usecols(["id", "t"], None, None, ["date"])
+    assert [c for c in data.columns if usecols(c)] == ["id", "t", "date"]
+
+
+def test_load_dataframe_partitioned(tmp_path):
+    data = pd.DataFrame({"id": range(6), "x": range(6), "part": [0, 1] * 3})
+    data.to_parquet(tmp_path / "parts.parquet", partition_cols=["part"])
+    loaded = HyFI.load_dataframe(
+        "parts.parquet", data_dir=str(tmp_path), columns=["id", "part", "missing"]
+    )
+    assert loaded.columns.tolist() == ["id", "part"]
+    assert sorted(loaded.id.tolist()) == list(range(6))
+
+
+if __name__ == "__main__":
+    import pathlib
+    import tempfile
+
+    test_load_dataframe_chunks(pathlib.Path(tempfile.mkdtemp()))